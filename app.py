@@ -1,34 +1,71 @@
 # app.py
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, jsonify, request, render_template, g
 from flask_socketio import SocketIO, emit
-import sqlite3
 import time
+import threading
 from threading import Thread
 import socket
 from flask import Response
 import json  # Add this import at the top of the file
+import change_feed
+import db
+import history
+import metrics
+import migrations
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret!'
 socketio = SocketIO(app)
 
-DB_PATH = 'village.db'
+DB_PATH = db.DEFAULT_DB_PATH
+SSE_KEEPALIVE = 15  # seconds between comment lines on an idle stream
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+def get_broadcaster():
+    """The one change-feed tail shared by every SSE and Socket.IO subscriber."""
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            _broadcaster = change_feed.Broadcaster(DB_PATH).start()
+        return _broadcaster
 
 def get_npc_id(name):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id FROM npcs WHERE name = ?', (name,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
+    return db.get_npc_id(name, DB_PATH)
 
 def get_npc_name(npc_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT name FROM npcs WHERE id = ?', (npc_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else 'Unknown'
+    return db.get_npc_name(npc_id, DB_PATH)
+
+def fetch_dashboard_state():
+    # Read the feed position first: events after it may repeat rows in the
+    # snapshot, but none can fall between the two.
+    return {
+        'last_event_id': change_feed.latest_event_id(DB_PATH),
+        'npcs': db.fetch_npcs(DB_PATH),
+        'interactions': db.fetch_recent_interactions(10, DB_PATH),
+        'actions': db.fetch_recent_actions(10, DB_PATH)
+    }
+
+@app.before_request
+def start_request_timer():
+    if metrics.enabled():
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.observe('http_request_seconds', time.perf_counter() - started,
+                        endpoint=request.endpoint or 'unknown', status=response.status_code)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text format: this process plus snapshots the simulation published."""
+    sources = {'dashboard': metrics.snapshot()}
+    sources.update(db.load_metrics_snapshots(DB_PATH))
+    return Response(metrics.render(sources), content_type='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -36,216 +73,114 @@ def index():
 
 @app.route('/api/npcs', methods=['GET'])
 def get_npcs():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name, personality, current_location FROM npcs')
-    npcs = cursor.fetchall()
-    conn.close()
-    npc_list = [{'id': npc[0], 'name': npc[1], 'personality': npc[2], 'current_location': npc[3]} for npc in npcs]
-    return jsonify(npc_list)
+    return jsonify(db.fetch_npcs(DB_PATH))
+
+def history_page(table):
+    """
+    One page of history, newest first. Query args: limit, cursor (from the
+    previous page's next_cursor), npc / speaker / listener / location, and
+    since / until as timestamps.
+    """
+    try:
+        filters = history.parse_filters(table, request.args)
+        page = history.query_page(
+            table, filters,
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', 100, type=int),
+            order=request.args.get('order', 'desc'),
+            db_path=DB_PATH,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page)
 
 @app.route('/api/interactions', methods=['GET'])
 def get_interactions():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT timestamp, npc_speaker_id, npc_listener_id, topic, content 
-        FROM interactions 
-        ORDER BY timestamp DESC 
-        LIMIT 100
-    ''')
-    interactions = cursor.fetchall()
-    conn.close()
-    interaction_list = []
-    for interaction in interactions:
-        interaction_list.append({
-            'timestamp': interaction[0],
-            'speaker_id': interaction[1],
-            'listener_id': interaction[2],
-            'topic': interaction[3],
-            'content': interaction[4]
-        })
-    return jsonify(interaction_list)
+    return history_page('interactions')
 
 @app.route('/api/actions', methods=['GET'])
 def get_actions():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT timestamp, npc_id, location, action 
-        FROM actions 
-        ORDER BY timestamp DESC 
-        LIMIT 100
-    ''')
-    actions = cursor.fetchall()
-    conn.close()
-    action_list = []
-    for action in actions:
-        action_list.append({
-            'timestamp': action[0],
-            'npc_id': action[1],
-            'location': action[2],
-            'action': action[3]
-        })
-    return jsonify(action_list)
+    return history_page('actions')
+
+EXPORT_FORMATS = {
+    'ndjson': (history.export_ndjson, 'application/x-ndjson'),
+    'csv': (history.export_csv, 'text/csv'),
+}
+
+@app.route('/api/export/<table>.<fmt>', methods=['GET'])
+def export_history(table, fmt):
+    """Streams the whole (filtered) history, oldest first, in constant memory."""
+    if table not in history.TABLES or fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'not found'}), 404
+    export, mimetype = EXPORT_FORMATS[fmt]
+    filters = history.parse_filters(table, request.args)
+    return Response(export(table, filters, db_path=DB_PATH), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={table}.{fmt}'})
 
 @app.route('/get_updates')
 def get_updates():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Fetch NPCs
-    cursor.execute('SELECT id, name, personality, current_location FROM npcs')
-    npcs = [{'id': row[0], 'name': row[1], 'personality': row[2], 'current_location': row[3]} for row in cursor.fetchall()]
-    
-    # Fetch recent interactions
-    cursor.execute('''
-        SELECT timestamp, speaker_id, listener_id, interaction_type, content 
-        FROM interactions 
-        ORDER BY timestamp DESC 
-        LIMIT 10
-    ''')
-    interactions = [
-        {
-            'timestamp': row[0],
-            'speaker_id': row[1],
-            'listener_id': row[2],
-            'interaction_type': row[3],
-            'content': row[4]
-        } for row in cursor.fetchall()
-    ]
-    
-    # Fetch recent actions
-    cursor.execute('''
-        SELECT timestamp, npc_id, location, action 
-        FROM actions 
-        ORDER BY timestamp DESC 
-        LIMIT 10
-    ''')
-    actions = [
-        {
-            'timestamp': row[0],
-            'npc_id': row[1],
-            'location': row[2],
-            'action': row[3]
-        } for row in cursor.fetchall()
-    ]
-    
-    conn.close()
-    
-    return jsonify({'npcs': npcs, 'interactions': interactions, 'actions': actions})
+    """The full dashboard state, or with ?since=<event id> only the feed events after it."""
+    since = request.args.get('since', type=int)
+    if since is None or not change_feed.can_resume(since, DB_PATH):
+        return jsonify(fetch_dashboard_state())
+    events = change_feed.events_since(since, db_path=DB_PATH)
+    last_event_id = events[-1][0] if events else since
+    return jsonify({
+        'last_event_id': last_event_id,
+        'events': [dict(event, id=event_id) for event_id, event in events],
+    })
+
+def sse_message(event_id, data):
+    return f"id: {event_id}\ndata: {json.dumps(data)}\n\n"
 
 @app.route('/sse')
 def sse():
-    def event_stream():
+    """
+    A snapshot, then every feed event as it happens. A reconnecting browser
+    sends Last-Event-ID and gets just the events it missed.
+    """
+    feed = get_broadcaster()
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    last_id = int(last_id) if last_id and last_id.isdigit() else None
+
+    def event_stream(last_id):
+        if last_id is None or not change_feed.can_resume(last_id, DB_PATH):
+            state = fetch_dashboard_state()
+            last_id = state['last_event_id']
+            yield sse_message(last_id, {'type': 'snapshot', **state})
         while True:
-            time.sleep(10)  # Wait for 10 seconds
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                
-                # Fetch NPCs
-                cursor.execute('SELECT id, name, personality, current_location FROM npcs')
-                npcs = [{'id': row[0], 'name': row[1], 'personality': row[2], 'current_location': row[3]} for row in cursor.fetchall()]
-                
-                # Fetch recent interactions
-                cursor.execute('''
-                    SELECT timestamp, speaker_id, listener_id, interaction_type, content 
-                    FROM interactions 
-                    ORDER BY timestamp DESC 
-                    LIMIT 10
-                ''')
-                interactions = [
-                    {
-                        'timestamp': row[0],
-                        'speaker_id': row[1],
-                        'listener_id': row[2],
-                        'interaction_type': row[3],
-                        'content': row[4]
-                    } for row in cursor.fetchall()
-                ]
-                
-                # Fetch recent actions
-                cursor.execute('''
-                    SELECT timestamp, npc_id, location, action 
-                    FROM actions 
-                    ORDER BY timestamp DESC 
-                    LIMIT 10
-                ''')
-                actions = [
-                    {
-                        'timestamp': row[0],
-                        'npc_id': row[1],
-                        'location': row[2],
-                        'action': row[3]
-                    } for row in cursor.fetchall()
-                ]
-            
-            data = {'npcs': npcs, 'interactions': interactions, 'actions': actions}
-            yield f"data: {json.dumps(data)}\n\n"
-    
-    return Response(event_stream(), content_type='text/event-stream')
+            events = feed.wait(last_id, timeout=SSE_KEEPALIVE)
+            if not events:
+                yield ": keepalive\n\n"
+                continue
+            for event_id, event in events:
+                yield sse_message(event_id, event)
+            last_id = events[-1][0]
+
+    return Response(event_stream(last_id), content_type='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 def background_thread():
-    """Send server generated events to clients."""
-    with app.app_context():
-        while True:
-            time.sleep(10)  # Adjust as needed
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
-            # Fetch NPCs
-            cursor.execute('SELECT id, name, personality, current_location FROM npcs')
-            npcs = [{'id': row[0], 'name': row[1], 'personality': row[2], 'current_location': row[3]} for row in cursor.fetchall()]
-            
-            # Fetch recent interactions
-            cursor.execute('''
-                SELECT timestamp, speaker_id, listener_id, interaction_type, content 
-                FROM interactions 
-                ORDER BY timestamp DESC 
-                LIMIT 10
-            ''')
-            interactions = [
-                {
-                    'timestamp': row[0],
-                    'speaker_id': row[1],
-                    'listener_id': row[2],
-                    'interaction_type': row[3],
-                    'content': row[4]
-                } for row in cursor.fetchall()
-            ]
-            
-            # Fetch recent actions
-            cursor.execute('''
-                SELECT timestamp, npc_id, location, action 
-                FROM actions 
-                ORDER BY timestamp DESC 
-                LIMIT 10
-            ''')
-            actions = [
-                {
-                    'timestamp': row[0],
-                    'npc_id': row[1],
-                    'location': row[2],
-                    'action': row[3]
-                } for row in cursor.fetchall()
-            ]
-            
-            conn.close()
-            
-            data = {'npcs': npcs, 'interactions': interactions, 'actions': actions}
-            print("Emitting update:", data)
-            socketio.emit('update', data)
+    """Forwards new feed events to every Socket.IO client in one emit per batch."""
+    feed = get_broadcaster()
+    last_id = feed.last_id
+    while True:
+        events = feed.wait(last_id, timeout=SSE_KEEPALIVE)
+        if events:
+            last_id = events[-1][0]
+            socketio.emit('events', [dict(event, id=event_id) for event_id, event in events])
 
 @socketio.on('connect')
 def handle_connect():
     print('Client connected')
+    emit('snapshot', fetch_dashboard_state())
 
 @socketio.on('disconnect')
 def handle_disconnect():
     print('Client disconnected')
 
 def print_db_schema():
-    conn = sqlite3.connect(DB_PATH)
+    conn = db.get_connection(DB_PATH)
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
     tables = cursor.fetchall()
@@ -255,9 +190,9 @@ def print_db_schema():
         columns = cursor.fetchall()
         for column in columns:
             print(f"  {column[1]} ({column[2]})")
-    conn.close()
 
 if __name__ == '__main__':
+    migrations.migrate(DB_PATH)
     print_db_schema()  # Add this line before running the app
     # Start the background thread
     thread = Thread(target=background_thread)
@@ -0,0 +1,101 @@
+# batch_actions.py
+"""
+One LLM call for the actions of several idle NPCs.
+
+Idle actions are 5-10 words each, so a per-NPC call is mostly fixed model
+overhead. Here the idle NPCs at a location are packed into one JSON-mode
+request and the returned actions are mapped back by name. NPCs the model
+skipped, or a whole batch whose JSON doesn't parse, fall back to the usual
+perform_action call.
+
+Batches only ever hold idle NPCs at one location. The default 'pairs'
+planner puts everyone it can into a conversation, leaving at most one idle
+NPC per location, so batching changes nothing there. It pays off with
+--pairing none, or a planner capped by max_conversations_per_location,
+where many NPCs idle at the same place.
+"""
+import json
+import sys
+
+from llm_scheduler import RequestDropped
+from prompt_builder import clean
+
+
+class ActionParseError(ValueError):
+    """The model's batch answer could not be read."""
+
+
+def build_batch_prompt(npcs, location):
+    cast = "\n".join(f"- {npc.name}: {npc.personality}" for npc in npcs)
+    return clean(f"""
+        Villagers at the {location}:
+        {cast}
+
+        For each villager, describe a brief action or thought in 5-10 words, in character.
+        Answer with JSON only, mapping each name to its action:
+        {{"actions": {{"<name>": "<action>"}}}}
+    """)
+
+
+def parse_actions(raw, npcs):
+    """Returns {npc: action} for the NPCs the model answered for."""
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        raise ActionParseError(f"not JSON: {e}") from e
+    actions = data.get('actions', data) if isinstance(data, dict) else None
+    if isinstance(actions, list):
+        actions = {str(item.get('name', '')): item.get('action', '') for item in actions if isinstance(item, dict)}
+    if not isinstance(actions, dict):
+        raise ActionParseError("no actions object in answer")
+
+    by_name = {npc.name.lower(): npc for npc in npcs}
+    parsed = {}
+    for name, action in actions.items():
+        npc = by_name.get(str(name).strip().lower())
+        if npc is not None and isinstance(action, str) and action.strip():
+            parsed[npc] = action.strip()
+    return parsed
+
+
+def generate_actions(npcs, location=None):
+    """
+    Generates and records one action for each NPC (all at the same location)
+    in as few calls as possible. Returns ({npc: action}, number of LLM calls);
+    NPCs whose request the scheduler dropped are left out.
+    """
+    if not npcs:
+        return {}, 0
+    if len(npcs) == 1:
+        action = npcs[0].perform_action()
+        return ({npcs[0]: action} if action is not None else {}), 1
+    location = location or npcs[0].current_location
+    calls = 1
+    try:
+        raw = npcs[0].generate(build_batch_prompt(npcs, location), format='json', kind='action')
+        actions = parse_actions(raw, npcs)
+    except RequestDropped:
+        return {}, calls
+    except Exception as e:
+        print(f"Batched actions at {location} failed, falling back:", e, file=sys.stderr)
+        actions = {}
+    for npc, action in actions.items():
+        npc.record_action(action)
+
+    for npc in npcs:
+        if npc not in actions:
+            action = npc.perform_action()
+            calls += 1
+            if action is not None:
+                actions[npc] = action
+    return {npc: actions[npc] for npc in npcs if npc in actions}, calls
+
+
+def batches(npcs, batch_size):
+    """Groups NPCs by location, then splits each group into batch_size chunks."""
+    by_location = {}
+    for npc in npcs:
+        by_location.setdefault(npc.current_location, []).append(npc)
+    for location, present in by_location.items():
+        for start in range(0, len(present), batch_size):
+            yield location, present[start:start + batch_size]
@@ -0,0 +1,107 @@
+# benchmarks/batch_actions.py
+"""
+Compares per-NPC and batched idle-action generation.
+
+Uses an in-process fake model with a fixed per-call overhead plus a per-token
+cost, so the numbers show how much of an action tick is call overhead.
+
+    python -m benchmarks.batch_actions --npcs 40 --ticks 5 --batch-size 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+from engine import TickEngine
+from encounters import EncounterPlanner
+from npc import NPC
+from population import load_population
+from village import Village
+from write_buffer import WriteBuffer
+
+CAST_LINE = re.compile(r"^- ([^:]+):", re.MULTILINE)
+
+
+class FakeLatencyClient:
+    """Sleeps call_overhead + tokens * token_time per call and returns canned text."""
+
+    def __init__(self, call_overhead=0.08, token_time=0.004):
+        self.model = 'fake'
+        self.call_overhead = call_overhead
+        self.token_time = token_time
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, format=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if format == 'json':
+            names = CAST_LINE.findall(prompt)
+            text = json.dumps({'actions': {name: "Kneads dough and hums an old tune." for name in names}})
+            tokens = 10 * len(names)
+        else:
+            text = "Kneads dough and hums an old tune."
+            tokens = 10
+        time.sleep(self.call_overhead + tokens * self.token_time)
+        return text
+
+
+def run_mode(npc_count, ticks, batch_size, concurrency, db_path):
+    client = FakeLatencyClient()
+    NPC.llm_client = client
+    NPC.response_cache = None
+    NPC.consolidator = None
+    NPC.db_path = db_path
+    write_buffer = WriteBuffer(db_path)
+    NPC.write_buffer = write_buffer
+
+    village = Village(db_path=db_path, write_buffer=write_buffer)
+    records = [
+        {'name': f"Villager{i}", 'personality': "busy villager", 'backstory': "Lives here.",
+         'current_location': village.locations[i % len(village.locations)]}
+        for i in range(npc_count)
+    ]
+    npcs = load_population(records, db_path=db_path, village=village)
+    engine = TickEngine(
+        village, npcs, concurrency=concurrency, move_probability=0.0, write_buffer=write_buffer,
+        planner=EncounterPlanner(policy='none'), action_batch_size=batch_size,
+    )
+    started = time.perf_counter()
+    try:
+        asyncio.run(engine.run(ticks))
+    finally:
+        engine.close()
+        write_buffer.close()
+    elapsed = time.perf_counter() - started
+    return {
+        'mode': f"batched({batch_size})" if batch_size else "per-npc",
+        'calls_per_tick': client.calls / ticks,
+        'seconds_per_tick': elapsed / ticks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--npcs', type=int, default=40)
+    parser.add_argument('--ticks', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for batch_size in (None, args.batch_size):
+            db_path = os.path.join(tmp, f"bench-{batch_size or 'single'}.db")
+            results.append(run_mode(args.npcs, args.ticks, batch_size, args.concurrency, db_path))
+    for result in results:
+        print(f"{result['mode']:>12}: {result['calls_per_tick']:6.1f} calls/tick, "
+              f"{result['seconds_per_tick']:.3f} s/tick")
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# benchmarks/compare.py
+"""
+Compares two benchmark result files written by benchmarks.suite.
+
+    python -m benchmarks.compare before.json after.json --threshold 0.1
+
+Metrics ending in _per_second are better when higher; those ending in
+_seconds or _ms are better when lower; anything else is shown but not
+judged. Exits with status 1 if any metric got worse by more than threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def direction(metric):
+    """+1 if higher is better, -1 if lower is better, 0 if not a performance number."""
+    if metric.endswith('_per_second'):
+        return 1
+    if metric.endswith('_seconds') or metric.endswith('_ms'):
+        return -1
+    return 0
+
+
+def flatten(report):
+    return {
+        f"{bench}.{metric}": value
+        for bench, results in report.get('results', {}).items()
+        for metric, value in results.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    }
+
+
+def compare(before, after, threshold=0.1):
+    """Returns [(name, old, new, change, verdict)] for metrics present in both."""
+    old, new = flatten(before), flatten(after)
+    rows = []
+    for name in sorted(old.keys() & new.keys()):
+        sign = direction(name.split('.', 1)[1])
+        change = (new[name] - old[name]) / old[name] if old[name] else 0.0
+        verdict = ''
+        if sign and abs(change) > threshold:
+            verdict = 'better' if change * sign > 0 else 'REGRESSION'
+        rows.append((name, old[name], new[name], change, verdict))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative change that counts (0.1 = 10%%)")
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"before: {before['meta'].get('commit')}  after: {after['meta'].get('commit')}")
+    rows = compare(before, after, args.threshold)
+    width = max((len(row[0]) for row in rows), default=10)
+    for name, old, new, change, verdict in rows:
+        print(f"{name:<{width}}  {old:>12.4g}  {new:>12.4g}  {change:>+8.1%}  {verdict}")
+    regressions = [row for row in rows if row[4] == 'REGRESSION']
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+# benchmarks/suite.py
+"""
+End-to-end benchmark suite.
+
+Runs against a local stub Ollama server (see stub_ollama.py) with
+configurable latency and jitter, in a throwaway database, and writes the
+numbers as JSON so two commits can be compared with benchmarks.compare:
+
+    python -m benchmarks.suite --out before.json
+    git checkout my-branch
+    python -m benchmarks.suite --out after.json
+    python -m benchmarks.compare before.json after.json
+
+Benchmarks:
+  population  NPC construction rate and bulk population load time
+  ticks       full LLM ticks (up to --llm-max-npcs) and the non-LLM part of
+              a tick (planning and movement) at every --sizes entry
+  db_writes   action and interaction write rate, buffered and per-row
+  api         latency of /get_updates and the JSON endpoints over a large
+              history (needs Flask)
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import db
+import stub_ollama
+from encounters import EncounterPlanner
+from engine import TickEngine
+from llm_client import LLMClient
+from npc import NPC, TOPICS
+from population import load_population
+from village import Village
+from world_state import WorldState, np
+from write_buffer import INSERT_ACTIONS, INSERT_INTERACTIONS, WriteBuffer, current_timestamp
+
+LOCATIONS = ["Marketplace", "Town Square", "Bakery", "Farmhouse", "River Bank"]
+API_ENDPOINTS = ['/get_updates', '/api/npcs', '/api/interactions', '/api/actions']
+
+
+def make_records(count, rng):
+    return [
+        {'name': f"Villager{i}", 'personality': "busy villager", 'backstory': "Lives here.",
+         'current_location': rng.choice(LOCATIONS)}
+        for i in range(count)
+    ]
+
+
+def reset_npc_class(db_path, llm_client=None, write_buffer=None):
+    NPC.db_path = db_path
+    NPC.write_buffer = write_buffer
+    NPC.response_cache = None
+    NPC.consolidator = None
+    if llm_client is not None:
+        NPC.llm_client = llm_client
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def bench_population(tmp, args, server_url):
+    rng = random.Random(args.seed)
+    db_path = os.path.join(tmp, 'population.db')
+    reset_npc_class(db_path)
+    NPC.initialize_database()
+
+    count = args.construct_npcs
+    elapsed, _ = timed(lambda: [
+        NPC(f"Single{i}", "busy villager", "Lives here.") for i in range(count)
+    ])
+    results = {
+        'npc_construct_count': count,
+        'npc_construct_per_second': count / elapsed,
+    }
+
+    count = args.load_npcs
+    elapsed, npcs = timed(load_population, make_records(count, rng), db_path=db_path)
+    results.update(population_load_count=len(npcs), population_load_seconds=elapsed,
+                   population_load_npcs_per_second=len(npcs) / elapsed)
+    return results
+
+
+def bench_ticks(tmp, args, server_url):
+    results = {}
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        db_path = os.path.join(tmp, f'ticks-{size}.db')
+        client = LLMClient(server_url, retries=0)
+        write_buffer = WriteBuffer(db_path)
+        reset_npc_class(db_path, client, write_buffer)
+        NPC.initialize_database()
+        village = Village(db_path=db_path, write_buffer=write_buffer, rng=random.Random(args.seed))
+        npcs = load_population(make_records(size, rng), db_path=db_path, village=village)
+        write_buffer.flush()
+        prefix = f'npcs_{size}'
+
+        if size <= args.llm_max_npcs:
+            engine = TickEngine(village, npcs, concurrency=args.concurrency, rng=random.Random(args.seed),
+                                write_buffer=write_buffer,
+                                planner=EncounterPlanner(topics=TOPICS, rng=random.Random(args.seed)))
+            try:
+                elapsed, _ = timed(asyncio.run, engine.run(args.ticks))
+            finally:
+                engine.close()
+            results[f'{prefix}_llm_ticks_per_second'] = args.ticks / elapsed
+            results[f'{prefix}_llm_calls_per_tick'] = client.calls / args.ticks
+
+        # The rest of a tick: planning encounters, moving NPCs and writing locations.
+        world = WorldState.from_npcs(npcs, village.locations, seed=args.seed) if np is not None else None
+        planner = EncounterPlanner(topics=TOPICS, rng=random.Random(args.seed))
+        engine = TickEngine(village, npcs, rng=random.Random(args.seed), write_buffer=write_buffer,
+                            planner=planner, world_state=world)
+        durations = []
+        for _ in range(args.ticks):
+            started = time.perf_counter()
+            engine.plan_tick()
+            engine._move()
+            write_buffer.flush()
+            durations.append(time.perf_counter() - started)
+        engine.close()
+        write_buffer.close()
+        results[f'{prefix}_world_tick_seconds'] = statistics.median(durations)
+    return results
+
+
+def bench_db_writes(tmp, args, server_url):
+    db_path = os.path.join(tmp, 'writes.db')
+    reset_npc_class(db_path)
+    NPC.initialize_database()
+    speaker, listener = load_population(make_records(2, random.Random(args.seed)), db_path=db_path)
+
+    write_buffer = WriteBuffer(db_path)
+    half = args.rows // 2
+    started = time.perf_counter()
+    for i in range(half):
+        write_buffer.add_action(speaker.id, "Bakery", f"Kneads dough, batch {i}.")
+        write_buffer.add_interaction(speaker.id, listener.id, "Talking to Villager1", f"Line {i}.")
+    write_buffer.close()
+    elapsed = time.perf_counter() - started
+    results = {'buffered_rows': 2 * half, 'buffered_rows_per_second': 2 * half / elapsed}
+
+    # One transaction per row, as NPC.log_action does without a write buffer.
+    half = args.direct_rows // 2
+    started = time.perf_counter()
+    for i in range(half):
+        speaker.log_action(speaker.id, "Bakery", f"Kneads dough, batch {i}.")
+        speaker.log_interaction("Talking to Villager1", f"Line {i}.", listener=listener)
+    elapsed = time.perf_counter() - started
+    results.update(direct_rows=2 * half, direct_rows_per_second=2 * half / elapsed)
+    return results
+
+
+def seed_history(db_path, npc_count, rows, rng):
+    reset_npc_class(db_path)
+    NPC.initialize_database()
+    npcs = load_population(make_records(npc_count, rng), db_path=db_path)
+    ids = [npc.id for npc in npcs]
+    timestamp = current_timestamp()
+    with db.transaction(db_path) as conn:
+        conn.executemany(INSERT_ACTIONS, (
+            (rng.choice(ids), rng.choice(LOCATIONS), f"Action {i}.", timestamp) for i in range(rows)
+        ))
+        conn.executemany(INSERT_INTERACTIONS, (
+            (rng.choice(ids), rng.choice(ids), "Talking", f"Line {i}.", timestamp) for i in range(rows)
+        ))
+
+
+def bench_api(tmp, args, server_url):
+    try:
+        import app as dashboard
+    except ImportError as e:
+        return {'skipped': f"Flask is not installed ({e})"}
+
+    db_path = os.path.join(tmp, 'api.db')
+    seed_history(db_path, args.api_npcs, args.history, random.Random(args.seed))
+    dashboard.DB_PATH = db_path
+    dashboard.app.logger.setLevel(logging.CRITICAL)
+    client = dashboard.app.test_client()
+
+    results = {'history_rows': 2 * args.history}
+    for endpoint in API_ENDPOINTS:
+        name = endpoint.strip('/').replace('/', '_')
+        status = client.get(endpoint).status_code  # warm up
+        durations = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            client.get(endpoint)
+            durations.append(time.perf_counter() - started)
+        durations.sort()
+        results[f'{name}_status'] = status
+        results[f'{name}_p50_ms'] = 1000 * durations[len(durations) // 2]
+        results[f'{name}_p95_ms'] = 1000 * durations[int(len(durations) * 0.95) - 1]
+    return results
+
+
+BENCHMARKS = {
+    'population': bench_population,
+    'ticks': bench_ticks,
+    'db_writes': bench_db_writes,
+    'api': bench_api,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default='benchmark-results.json')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), default=None)
+    parser.add_argument('--quick', action='store_true', help="small sizes, for checking the suite itself")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--latency', type=float, default=0.0, help="stub reply latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="stub reply jitter in seconds")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--llm-max-npcs', type=int, default=1000, help="largest size that runs full LLM ticks")
+    parser.add_argument('--ticks', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--construct-npcs', type=int, default=200)
+    parser.add_argument('--load-npcs', type=int, default=10000)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--direct-rows', type=int, default=2000)
+    parser.add_argument('--api-npcs', type=int, default=1000)
+    parser.add_argument('--history', type=int, default=200000, help="rows each of actions and interactions")
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.sizes = [10, 200]
+        args.llm_max_npcs = 200
+        args.construct_npcs = 20
+        args.load_npcs = 1000
+        args.rows = 5000
+        args.direct_rows = 200
+        args.history = 5000
+        args.requests = 10
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = stub_ollama.serve(latency=args.latency, jitter=args.jitter, seed=args.seed)
+    url = stub_ollama.base_url(server)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np is not None,
+            'args': vars(args),
+        },
+        'results': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='digidorf-bench-') as tmp:
+        for name in args.only or BENCHMARKS:
+            print(f"running {name}...", file=sys.stderr)
+            elapsed, results = timed(BENCHMARKS[name], tmp, args, url)
+            results['wall_seconds'] = elapsed
+            report['results'][name] = results
+    server.shutdown()
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    for name, results in report['results'].items():
+        print(f"\n{name}")
+        for metric, value in results.items():
+            print(f"  {metric:<40} {value:.4g}" if isinstance(value, float) else f"  {metric:<40} {value}")
+    print(f"\nwrote {args.out}")
+
+
+if __name__ == '__main__':
+    main()
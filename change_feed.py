@@ -0,0 +1,143 @@
+# change_feed.py
+"""
+Change feed from the simulation to the dashboard.
+
+Every WriteBuffer flush also appends one row per new action, interaction and
+location change to the events table, in the same transaction as the data, so
+the feed never shows rows that weren't committed. Event ids come from an
+AUTOINCREMENT key and only ever increase; they double as SSE event ids.
+
+In the dashboard a single Broadcaster tails that table and keeps a window of
+recent events in memory. Subscribers block on it instead of querying SQLite
+themselves, so the database load doesn't grow with the number of viewers. A
+producer in the same process can hand events to publish() directly and skip
+the polling delay.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+import db
+
+FEED_RETENTION = 10000  # events kept in the table for clients resuming after a gap
+
+INSERT_EVENT = 'INSERT INTO events (type, payload) VALUES (?, ?)'
+LAST_EVENT_ID = "SELECT seq FROM sqlite_sequence WHERE name = 'events'"
+EVENTS_SINCE = 'SELECT id, type, payload FROM events WHERE id > ? ORDER BY id LIMIT ?'
+OLDEST_EVENT_ID = 'SELECT MIN(id) FROM events'
+
+
+def build_events(actions, interactions, locations):
+    """Feed events for a write-buffer batch, in the order the rows were queued."""
+    events = [
+        {'type': 'action', 'npc_id': npc_id, 'location': location, 'action': action, 'timestamp': timestamp}
+        for npc_id, location, action, timestamp in actions
+    ]
+    events += [
+        {'type': 'interaction', 'speaker_id': speaker_id, 'listener_id': listener_id,
+         'interaction_type': interaction_type, 'content': content, 'timestamp': timestamp}
+        for speaker_id, listener_id, interaction_type, content, timestamp in interactions
+    ]
+    events += [{'type': 'move', 'npc_id': npc_id, 'location': location} for npc_id, location in locations.items()]
+    return events
+
+
+def _last_id(conn):
+    row = conn.execute(LAST_EVENT_ID).fetchone()
+    return row[0] if row else 0
+
+
+def record(conn, events):
+    """
+    Appends events inside the caller's transaction and returns them as
+    [(id, event)]. The write lock is held, so the new ids are contiguous.
+    """
+    if not events:
+        return []
+    first = _last_id(conn) + 1
+    conn.executemany(INSERT_EVENT, [(event['type'], json.dumps(event)) for event in events])
+    last = first + len(events) - 1
+    if last > FEED_RETENTION:
+        conn.execute('DELETE FROM events WHERE id <= ?', (last - FEED_RETENTION,))
+    return list(zip(range(first, last + 1), events))
+
+
+def latest_event_id(db_path=db.DEFAULT_DB_PATH):
+    return _last_id(db.get_connection(db_path))
+
+
+def oldest_event_id(db_path=db.DEFAULT_DB_PATH):
+    row = db.query_one(OLDEST_EVENT_ID, db_path=db_path)
+    return row[0] if row and row[0] is not None else None
+
+
+def events_since(after_id, limit=1000, db_path=db.DEFAULT_DB_PATH):
+    return [
+        (event_id, json.loads(payload))
+        for event_id, _, payload in db.query_all(EVENTS_SINCE, (after_id, limit), db_path)
+    ]
+
+
+def can_resume(after_id, db_path=db.DEFAULT_DB_PATH):
+    """False if events after after_id have already been trimmed from the table."""
+    oldest = oldest_event_id(db_path)
+    return oldest is None or oldest <= after_id + 1 or after_id >= latest_event_id(db_path)
+
+
+class Broadcaster:
+    """Fans new feed events out to any number of waiting subscribers."""
+
+    def __init__(self, db_path=db.DEFAULT_DB_PATH, poll_interval=0.25, backlog=2000):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._events = deque(maxlen=backlog)  # (id, event), oldest first
+        self._cond = threading.Condition()
+        self._thread = None
+        self.last_id = latest_event_id(db_path)
+
+    def start(self):
+        """Tails the events table on one daemon thread. Idempotent."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._tail, name='change-feed', daemon=True)
+            self._thread.start()
+        return self
+
+    def _tail(self):
+        while True:
+            try:
+                events = events_since(self.last_id, db_path=self.db_path)
+            except Exception as e:
+                print("Change feed poll failed:", e)
+                events = []
+            self.publish(events)
+            if len(events) < 1000:
+                time.sleep(self.poll_interval)
+
+    def publish(self, events):
+        """Adds [(id, event)] newer than anything seen so far and wakes subscribers."""
+        with self._cond:
+            added = False
+            for event_id, event in events:
+                if event_id > self.last_id:
+                    self._events.append((event_id, event))
+                    self.last_id = event_id
+                    added = True
+            if added:
+                self._cond.notify_all()
+
+    def since(self, after_id):
+        """
+        Events after after_id, from memory when the window reaches back that
+        far and from the table otherwise.
+        """
+        with self._cond:
+            if not self._events or self._events[0][0] <= after_id + 1:
+                return [(event_id, event) for event_id, event in self._events if event_id > after_id]
+        return events_since(after_id, db_path=self.db_path)
+
+    def wait(self, after_id, timeout=None):
+        """Blocks until there are events after after_id (or timeout) and returns them."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.last_id > after_id, timeout)
+        return self.since(after_id)
@@ -0,0 +1,396 @@
+# checkpoint.py
+"""
+Checkpoint and restore of a running simulation.
+
+A checkpoint is one binary file holding everything that isn't already in
+the database: the clock, the tick, every NPC (identity, location, short- and
+long-term memory, rolling summary), the order NPCs sit in at each location,
+the state of every RNG, and the event scheduler's queue. Together with the
+database it was taken against, it lets a run carry on exactly where it
+stopped.
+
+Layout (little-endian):
+
+    header    magic b'DDCK', format version u16, flags u16, section count u32
+    sections  count x (name 24s, offset u64, stored length u64, raw length u64)
+    data      each section starts on an 8-byte boundary
+
+Sections are flat arrays (ids, location codes, counts, times) or string
+tables (a u64 offsets array plus one UTF-8 blob), plus one JSON 'meta'
+section for the scalars and RNG states. With FLAG_ZLIB every section is
+zlib-compressed on its own. Reading maps the file and views numeric
+sections in place, so a 100k-NPC village loads without parsing a record at
+a time. The file is written next to its destination and renamed into
+place, so a crash mid-write leaves the previous checkpoint intact.
+"""
+import gc
+import json
+import mmap
+import os
+import random
+import signal
+import struct
+import sys
+import time
+import zlib
+from array import array
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+FORMAT_VERSION = 1
+MAGIC = b'DDCK'
+FLAG_ZLIB = 1
+HEADER = struct.Struct('<4sHHI')
+SECTION = struct.Struct('<24sQQQ')
+ALIGN = 8
+EPOCH = datetime(1970, 1, 1)
+NO_NPC = -1
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def to_micros(when):
+    return (when - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def rng_state(rng):
+    """JSON-friendly state of a random.Random or a NumPy Generator."""
+    if isinstance(rng, random.Random):
+        version, internal, gauss_next = rng.getstate()
+        return {'kind': 'random', 'version': version, 'state': list(internal), 'gauss_next': gauss_next}
+    return {'kind': 'numpy', 'state': rng.bit_generator.state}
+
+
+def set_rng_state(rng, state):
+    if state['kind'] == 'random':
+        rng.setstate((state['version'], tuple(state['state']), state['gauss_next']))
+    else:
+        rng.bit_generator.state = state['state']
+
+
+class CheckpointWriter:
+    def __init__(self):
+        self.sections = []  # (name, raw bytes)
+
+    def add_bytes(self, name, data):
+        if len(name.encode('ascii')) > 24:
+            raise ValueError(f"section name too long: {name!r}")
+        self.sections.append((name, data))
+
+    def add_array(self, name, typecode, values):
+        values = array(typecode, values)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        self.add_bytes(name, values.tobytes())
+
+    def add_strings(self, name, strings):
+        encoded = [string.encode('utf-8') for string in strings]
+        self.add_array(f'{name}.offsets', 'Q', accumulate((len(data) for data in encoded), initial=0))
+        self.add_bytes(f'{name}.blob', b"".join(encoded))
+
+    def add_json(self, name, value):
+        self.add_bytes(name, json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+    def write(self, path, compress=False, level=6):
+        flags = FLAG_ZLIB if compress else 0
+        stored = [(name, zlib.compress(data, level) if compress else data, len(data)) for name, data in self.sections]
+
+        offset = HEADER.size + SECTION.size * len(stored)
+        table = []
+        for name, data, raw_length in stored:
+            offset += -offset % ALIGN
+            table.append((name, offset, len(data), raw_length))
+            offset += len(data)
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(stored)))
+            for name, section_offset, length, raw_length in table:
+                f.write(SECTION.pack(name.encode('ascii'), section_offset, length, raw_length))
+            for (_, data, _), (_, section_offset, _, _) in zip(stored, table):
+                f.write(b"\0" * (section_offset - f.tell()))
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return offset
+
+
+class Checkpoint:
+    """A checkpoint file opened for reading. Sections are decoded on first use."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, self.flags, count = HEADER.unpack_from(self._map, 0)
+        except (ValueError, struct.error) as e:
+            self._file.close()
+            raise CheckpointError(f"{path} is not a checkpoint") from e
+        if magic != MAGIC:
+            self.close()
+            raise CheckpointError(f"{path} is not a checkpoint")
+        if version > FORMAT_VERSION:
+            self.close()
+            raise CheckpointError(f"{path} has format version {version}; this build reads up to {FORMAT_VERSION}")
+        self.version = version
+        self.sections = {}
+        for index in range(count):
+            name, offset, length, raw_length = SECTION.unpack_from(self._map, HEADER.size + index * SECTION.size)
+            self.sections[name.rstrip(b"\0").decode('ascii')] = (offset, length, raw_length)
+        self.meta = self.json('meta')
+
+    def bytes(self, name):
+        try:
+            offset, length, raw_length = self.sections[name]
+        except KeyError:
+            raise CheckpointError(f"{self.path} has no {name!r} section") from None
+        data = memoryview(self._map)[offset:offset + length]
+        if self.flags & FLAG_ZLIB:
+            data = zlib.decompress(data, bufsize=max(raw_length, 1))
+        return data
+
+    def array(self, name, typecode):
+        data = self.bytes(name)
+        if sys.byteorder == 'little':
+            return memoryview(data).cast(typecode)
+        values = array(typecode)
+        values.frombytes(data)
+        values.byteswap()
+        return values
+
+    def strings(self, name):
+        offsets = self.array(f'{name}.offsets', 'Q').tolist()
+        blob = bytes(self.bytes(f'{name}.blob'))
+        if blob.isascii():
+            # Byte offsets are character offsets: decode once and slice.
+            text = blob.decode('ascii')
+            return [text[start:end] for start, end in zip(offsets, offsets[1:])]
+        return [blob[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+
+    def json(self, name):
+        return json.loads(bytes(self.bytes(name)))
+
+    def close(self):
+        try:
+            self._map.close()
+        except (AttributeError, BufferError):
+            pass  # a caller still holds a view; the map goes when that does
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _split(flat, counts):
+    out, start = [], 0
+    for count in counts:
+        out.append(flat[start:start + count])
+        start += count
+    return out
+
+
+def save(path, village, npcs, tick=None, scheduler=None, rngs=None, write_buffer=None, extra=None, compress=False):
+    """
+    Writes a checkpoint of village and npcs. Pending summaries are folded and
+    the write buffer flushed first, so the database matches the snapshot.
+    rngs is {name: Random or Generator}; extra is any JSON-serializable dict
+    the caller wants back on restore. Returns the file size in bytes.
+    """
+    from npc import NPC
+    if NPC.consolidator is not None:
+        NPC.consolidator.drain()
+    if write_buffer is not None:
+        write_buffer.flush()
+
+    npcs = list(npcs)
+    index = {npc: i for i, npc in enumerate(npcs)}
+    locations = list(village.npcs_by_location)
+    locations += sorted({npc.current_location for npc in npcs} - set(locations))
+    codes = {location: code for code, location in enumerate(locations)}
+
+    writer = CheckpointWriter()
+    meta = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'clock': village.current_time.isoformat(),
+        'tick': tick,
+        'db_path': os.path.abspath(village.db_path),
+        'npc_count': len(npcs),
+        'locations': locations,
+        'rngs': {name: rng_state(rng) for name, rng in (rngs or {}).items()},
+        'scheduler': None,
+        'extra': extra or {},
+    }
+    writer.add_array('npc.ids', 'q', (npc.id for npc in npcs))
+    writer.add_array('npc.locations', 'I', (codes[npc.current_location] for npc in npcs))
+    writer.add_strings('npc.text', (
+        text for npc in npcs for text in (npc.name, npc.personality, npc.backstory, npc.rolling_summary or "")
+    ))
+    writer.add_array('npc.stm_counts', 'I', (len(npc.short_term_memory) for npc in npcs))
+    writer.add_strings('npc.stm', (memory for npc in npcs for memory in npc.short_term_memory))
+    writer.add_array('npc.ltm_counts', 'I', (len(npc.long_term_memory) for npc in npcs))
+    writer.add_strings('npc.ltm', (memory for npc in npcs for memory in npc.long_term_memory))
+    writer.add_array('village.order', 'I', (
+        index[npc] for present in village.npcs_by_location.values() for npc in present if npc in index
+    ))
+
+    if scheduler is not None:
+        state = scheduler.export_state()
+        queue = state['queue']
+        kinds = sorted({kind for _, _, kind, _, _ in queue})
+        meta['scheduler'] = {
+            'kinds': kinds,
+            'last_flush': state['last_flush'].isoformat(),
+            'processed': state['processed'],
+            'discarded': state['discarded'],
+            'llm_calls': state['llm_calls'],
+        }
+        writer.add_array('event.times', 'q', (to_micros(event[0]) for event in queue))
+        writer.add_array('event.seqs', 'q', (event[1] for event in queue))
+        writer.add_array('event.kinds', 'B', (kinds.index(event[2]) for event in queue))
+        writer.add_array('event.npcs', 'q', (NO_NPC if event[3] is None else event[3] for event in queue))
+        writer.add_array('event.blocks', 'q', (NO_NPC if event[4] is None else event[4] for event in queue))
+        writer.add_array('sched.blocks', 'q', state['blocks'])
+        writer.add_strings('sched.activity', (activity or "" for activity in state['activity']))
+        writer.add_array('sched.block_end', 'q', (
+            NO_NPC if end is None else to_micros(end) for end in state['block_end']
+        ))
+
+    writer.add_json('meta', meta)
+    return writer.write(path, compress=compress)
+
+
+def restore(checkpoint, village, npc_class=None):
+    """
+    Rebuilds the NPCs from checkpoint, in their saved order, sets the
+    village clock and re-creates each location's NPC order. No database
+    reads. Returns the NPCs.
+    """
+    # Everything built here stays alive, so collections mid-load are wasted work.
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return _restore(checkpoint, village, npc_class)
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def _restore(checkpoint, village, npc_class):
+    if npc_class is None:
+        from npc import NPC as npc_class
+    meta = checkpoint.meta
+    locations = meta['locations']
+    ids = checkpoint.array('npc.ids', 'q').tolist()
+    location_codes = checkpoint.array('npc.locations', 'I').tolist()
+    text = checkpoint.strings('npc.text')
+    short_term = _split(checkpoint.strings('npc.stm'), checkpoint.array('npc.stm_counts', 'I').tolist())
+    long_term = _split(checkpoint.strings('npc.ltm'), checkpoint.array('npc.ltm_counts', 'I').tolist())
+
+    npcs = []
+    for i, npc_id in enumerate(ids):
+        name, personality, backstory, summary = text[4 * i:4 * i + 4]
+        npc = npc_class.from_record(npc_id, name, personality, backstory, current_location=locations[location_codes[i]],
+                                    long_term_memory=long_term[i], rolling_summary=summary)
+        npc.short_term_memory = short_term[i]
+        npcs.append(npc)
+
+    village.current_time = datetime.fromisoformat(meta['clock'])
+    village.npcs_by_location = {location: {} for location in locations}
+    for i in checkpoint.array('village.order', 'I').tolist():
+        village.npcs_by_location[npcs[i].current_location][npcs[i]] = None
+    return npcs
+
+
+def restore_rngs(checkpoint, rngs):
+    """Puts each of {name: rng} back in its saved state. Names not in the checkpoint are left alone."""
+    saved = checkpoint.meta['rngs']
+    for name, rng in rngs.items():
+        if name in saved:
+            set_rng_state(rng, saved[name])
+
+
+def restore_scheduler(checkpoint, scheduler):
+    """Reloads the event queue into an EventScheduler built over the restored NPCs."""
+    info = checkpoint.meta['scheduler']
+    if info is None:
+        raise CheckpointError(f"{checkpoint.path} has no event scheduler state")
+    kinds = info['kinds']
+    queue = [
+        (from_micros(when), seq, kinds[kind], None if npc == NO_NPC else npc, None if block == NO_NPC else block)
+        for when, seq, kind, npc, block in zip(
+            checkpoint.array('event.times', 'q').tolist(), checkpoint.array('event.seqs', 'q').tolist(),
+            checkpoint.array('event.kinds', 'B').tolist(), checkpoint.array('event.npcs', 'q').tolist(),
+            checkpoint.array('event.blocks', 'q').tolist(),
+        )
+    ]
+    scheduler.restore_state({
+        'queue': queue,
+        'blocks': checkpoint.array('sched.blocks', 'q').tolist(),
+        'activity': [activity or None for activity in checkpoint.strings('sched.activity')],
+        'block_end': [None if end == NO_NPC else from_micros(end)
+                      for end in checkpoint.array('sched.block_end', 'q').tolist()],
+        'last_flush': datetime.fromisoformat(info['last_flush']),
+        'processed': info['processed'],
+        'discarded': info['discarded'],
+        'llm_calls': info['llm_calls'],
+    })
+
+
+class Checkpointer:
+    """
+    Decides when a run checkpoints: every interval seconds of wall time,
+    and once SIGTERM has asked the run to stop. Call step() between ticks,
+    where the state is consistent; save(path, compress) does the writing.
+    """
+
+    def __init__(self, path, save, interval=None, compress=False):
+        self.path = path
+        self.save = save
+        self.interval = interval
+        self.compress = compress
+        self.stop_requested = False
+        self.saves = 0
+        self.last_seconds = None
+        self.last_size = None
+        self._last_save = time.monotonic()
+
+    def install_signal_handler(self):
+        """
+        The first SIGTERM lets the current tick finish, checkpoints and ends
+        the run; a second one exits at once. Must be called from the main thread.
+        """
+        def handle_sigterm(signum, frame):
+            if self.stop_requested:
+                raise SystemExit(128 + signum)
+            self.stop_requested = True
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+
+    def due(self):
+        return self.stop_requested or (
+            self.interval is not None and time.monotonic() - self._last_save >= self.interval
+        )
+
+    def save_now(self):
+        started = time.perf_counter()
+        self.last_size = self.save(self.path, self.compress)
+        self.last_seconds = time.perf_counter() - started
+        self._last_save = time.monotonic()
+        self.saves += 1
+
+    def step(self):
+        """Checkpoints if one is due. Returns True if the run should stop."""
+        if self.due():
+            self.save_now()
+        return self.stop_requested
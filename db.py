@@ -0,0 +1,149 @@
+# db.py
+"""
+Shared SQLite access for the simulation and the dashboard.
+
+Each thread gets one long-lived connection per database file, opened in WAL
+mode so the simulation writer and the Flask readers don't block each other.
+The sqlite3 statement cache on each connection keeps the prepared form of
+every query below, so repeated calls skip re-parsing the SQL.
+"""
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+DEFAULT_DB_PATH = 'village.db'
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',  # 16 MB page cache
+)
+
+_local = threading.local()
+
+
+def _connections():
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    return connections
+
+
+def get_connection(db_path=DEFAULT_DB_PATH):
+    """Returns this thread's connection to db_path, opening it on first use."""
+    connections = _connections()
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=5.0, cached_statements=256)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        connections[db_path] = conn
+    return conn
+
+
+def close_connection(db_path=None):
+    """Closes this thread's connection to db_path, or all of them if db_path is None."""
+    connections = _connections()
+    paths = list(connections) if db_path is None else [db_path]
+    for path in paths:
+        conn = connections.pop(path, None)
+        if conn is not None:
+            conn.close()
+
+
+@contextmanager
+def transaction(db_path=DEFAULT_DB_PATH):
+    """Yields this thread's connection inside a transaction that commits on success."""
+    conn = get_connection(db_path)
+    with metrics.span('db_seconds', op='transaction'), conn:
+        yield conn
+
+
+def query_one(sql, params=(), db_path=DEFAULT_DB_PATH):
+    with metrics.span('db_seconds', op='query'):
+        return get_connection(db_path).execute(sql, params).fetchone()
+
+
+def query_all(sql, params=(), db_path=DEFAULT_DB_PATH):
+    with metrics.span('db_seconds', op='query'):
+        return get_connection(db_path).execute(sql, params).fetchall()
+
+
+# Queries shared by the NPC model and the dashboard.
+
+NPC_ID_BY_NAME = 'SELECT id FROM npcs WHERE name = ?'
+NPC_NAME_BY_ID = 'SELECT name FROM npcs WHERE id = ?'
+ALL_NPCS = 'SELECT id, name, personality, current_location FROM npcs'
+RECENT_INTERACTIONS = '''
+    SELECT timestamp, speaker_id, listener_id, interaction_type, content
+    FROM interactions
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+RECENT_ACTIONS = '''
+    SELECT timestamp, npc_id, location, action
+    FROM actions
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+
+
+def get_npc_id(name, db_path=DEFAULT_DB_PATH):
+    result = query_one(NPC_ID_BY_NAME, (name,), db_path)
+    return result[0] if result else None
+
+
+def get_npc_name(npc_id, db_path=DEFAULT_DB_PATH):
+    result = query_one(NPC_NAME_BY_ID, (npc_id,), db_path)
+    return result[0] if result else 'Unknown'
+
+
+def fetch_npcs(db_path=DEFAULT_DB_PATH):
+    return [
+        {'id': row[0], 'name': row[1], 'personality': row[2], 'current_location': row[3]}
+        for row in query_all(ALL_NPCS, db_path=db_path)
+    ]
+
+
+def fetch_recent_interactions(limit=10, db_path=DEFAULT_DB_PATH):
+    return [
+        {
+            'timestamp': row[0],
+            'speaker_id': row[1],
+            'listener_id': row[2],
+            'interaction_type': row[3],
+            'content': row[4]
+        } for row in query_all(RECENT_INTERACTIONS, (limit,), db_path)
+    ]
+
+
+def fetch_recent_actions(limit=10, db_path=DEFAULT_DB_PATH):
+    return [
+        {
+            'timestamp': row[0],
+            'npc_id': row[1],
+            'location': row[2],
+            'action': row[3]
+        } for row in query_all(RECENT_ACTIONS, (limit,), db_path)
+    ]
+
+
+def save_metrics_snapshot(source, samples, db_path=DEFAULT_DB_PATH):
+    """Publishes one process's metrics.snapshot() for the dashboard to serve."""
+    with transaction(db_path) as conn:
+        conn.execute('''
+            INSERT INTO metrics_snapshots (source, payload, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (source) DO UPDATE SET payload = excluded.payload, updated_at = excluded.updated_at
+        ''', (source, json.dumps(samples)))
+
+
+def load_metrics_snapshots(db_path=DEFAULT_DB_PATH):
+    return {
+        source: json.loads(payload)
+        for source, payload in query_all('SELECT source, payload FROM metrics_snapshots', db_path=db_path)
+    }
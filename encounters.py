@@ -0,0 +1,72 @@
+# encounters.py
+"""
+Decides who talks to whom each tick.
+
+The planner walks Village.npcs_by_location once, so a tick costs O(n) in the
+number of NPCs no matter how they are spread out, instead of comparing every
+pair of NPCs.
+"""
+import random
+
+# 'pairs'  - shuffle everyone at a location and pair them off
+# 'groups' - shuffle and split into conversations of up to group_size NPCs
+# 'none'   - nobody talks; everyone acts alone
+PAIRING_POLICIES = ('pairs', 'groups', 'none')
+
+
+class Encounter:
+    def __init__(self, location, participants, topic):
+        self.location = location
+        self.participants = participants
+        self.topic = topic
+
+    def __repr__(self):
+        names = ", ".join(npc.name for npc in self.participants)
+        return f"Encounter({self.location!r}, [{names}], {self.topic!r})"
+
+
+class EncounterPlanner:
+    def __init__(self, policy='pairs', group_size=4, max_conversations_per_location=None,
+                 topics=None, rng=None):
+        if policy not in PAIRING_POLICIES:
+            raise ValueError(f"policy must be one of {PAIRING_POLICIES}")
+        if group_size < 2:
+            raise ValueError("group_size must be at least 2")
+        self.policy = policy
+        self.group_size = 2 if policy == 'pairs' else group_size
+        self.max_conversations_per_location = max_conversations_per_location
+        self.topics = topics
+        self.rng = rng or random.Random()
+
+    def _topic(self):
+        if not self.topics:
+            return None
+        return self.rng.choice(self.topics)
+
+    def plan_location(self, location, present):
+        """Splits the NPCs at one location into encounters and idle NPCs."""
+        if self.policy == 'none' or len(present) < 2:
+            return [], list(present)
+
+        present = list(present)
+        self.rng.shuffle(present)
+        encounters = []
+        limit = self.max_conversations_per_location
+        start = 0
+        while len(present) - start >= 2 and (limit is None or len(encounters) < limit):
+            size = min(self.group_size, len(present) - start)
+            # Don't leave a single NPC alone at the end if a group can spare one.
+            if len(present) - start - size == 1 and size > 2:
+                size -= 1
+            encounters.append(Encounter(location, present[start:start + size], self._topic()))
+            start += size
+        return encounters, present[start:]
+
+    def plan(self, village):
+        """Returns (encounters, idle NPCs) for every location in the village."""
+        encounters, idle = [], []
+        for location, npcs in village.npcs_by_location.items():
+            location_encounters, location_idle = self.plan_location(location, npcs)
+            encounters.extend(location_encounters)
+            idle.extend(location_idle)
+        return encounters, idle
@@ -0,0 +1,230 @@
+# engine.py
+import asyncio
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from batch_actions import batches, generate_actions
+from encounters import EncounterPlanner
+from group_dialogue import DialogueParseError, run_group_dialogue
+from llm_client import LLMError
+from llm_scheduler import RequestDropped
+import metrics
+from npc import TOPICS
+
+
+class TickEngine:
+    """
+    Runs one simulation tick at a time with every NPC's LLM work in flight at once.
+
+    NPC methods are blocking (HTTP + SQLite), so each call runs on a worker
+    thread. A semaphore caps how many are outstanding. Independent work (idle
+    actions, separate conversations) runs concurrently; the steps inside one
+    conversation stay ordered, so a reaction always follows the line it answers.
+    With a write_buffer, the tick's rows are committed together at its end.
+    With group_dialogue, each conversation is one structured LLM call instead
+    of one call per line, falling back to the per-line chain if that fails.
+    With action_batch_size, idle NPCs at a location share one call per batch.
+    With an LLMScheduler, a tick waits only for its conversations: actions
+    run on in the background and are reported by the tick they finish in.
+    When the next tick starts, actions still waiting for a thread or in the
+    scheduler's queue are dropped, and an NPC whose action is still running
+    sits that tick's action out.
+    """
+
+    def __init__(self, village, npcs, concurrency=8, move_probability=0.3,
+                 time_step=60, rng=None, write_buffer=None, planner=None, world_state=None,
+                 group_dialogue=False, action_batch_size=None, scheduler=None):
+        self.village = village
+        self.scheduler = scheduler
+        self.tick = 0
+        self.group_dialogue = group_dialogue
+        self.action_batch_size = action_batch_size
+        self.world_state = world_state
+        self.write_buffer = write_buffer
+        self.npcs = list(npcs)
+        self.concurrency = concurrency
+        self.move_probability = move_probability
+        self.time_step = time_step
+        self.rng = rng or random.Random()
+        self.planner = planner or EncounterPlanner(topics=TOPICS, rng=self.rng)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='npc')
+        self._semaphore = None
+        self._actions = []  # (npcs, task) for actions running past their tick
+        self.skipped_actions = 0
+
+    async def _call(self, fn, *args, tick=None):
+        """
+        Runs fn on a worker thread once a slot is free. With tick, returns
+        None without calling fn if that tick is over by then.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            if tick is not None and tick < self.tick:
+                self.skipped_actions += 1
+                return None
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+
+    def plan_tick(self):
+        """Splits the population into encounters and idle NPCs for this tick."""
+        return self.planner.plan(self.village)
+
+    async def _conversation(self, encounter):
+        if self.group_dialogue:
+            try:
+                transcript = await self._call(
+                    run_group_dialogue, encounter.participants, encounter.topic, encounter.location
+                )
+            except RequestDropped:
+                return []
+            except (DialogueParseError, LLMError) as e:
+                print(f"Group dialogue at {encounter.location} failed, falling back:", e, file=sys.stderr)
+            else:
+                return [
+                    {'type': 'interaction', 'speaker': speaker, 'listener': listener, 'text': text}
+                    for speaker, listener, text in transcript
+                ]
+        return await self._chain_conversation(encounter)
+
+    async def _chain_conversation(self, encounter):
+        """
+        The first participant opens, then everyone else answers the line
+        before theirs, in order. A line the scheduler dropped ends the chain.
+        """
+        speaker, listener = encounter.participants[:2]
+        statement = await self._call(speaker.interact_with, listener, encounter.topic)
+        if statement is None:
+            return []
+        events = [{'type': 'interaction', 'speaker': speaker, 'listener': listener, 'text': statement}]
+        for responder in encounter.participants[1:]:
+            reaction = await self._call(responder.react_to, speaker, statement)
+            if reaction is None:
+                break
+            events.append({'type': 'interaction', 'speaker': responder, 'listener': speaker, 'text': reaction})
+            speaker, statement = responder, reaction
+        return events
+
+    async def _action(self, npc, tick=None):
+        action = await self._call(npc.perform_action, tick=tick)
+        if action is None:
+            return []
+        return [{'type': 'action', 'npc': npc, 'text': action}]
+
+    async def _action_batch(self, npcs, location, tick=None):
+        result = await self._call(generate_actions, npcs, location, tick=tick)
+        if result is None:
+            return []
+        actions, _ = result
+        return [{'type': 'action', 'npc': npc, 'text': action} for npc, action in actions.items()]
+
+    async def _without_actions(self, conversations, actions):
+        """
+        Waits for the conversations only; actions join the ones still running
+        from earlier ticks. Returns the conversations' results and those of
+        every action that has finished by then. A tick without conversations
+        waits for its actions, as nothing else sets how long it lasts.
+        """
+        for npcs, action in actions:
+            self._actions.append((npcs, asyncio.ensure_future(action)))
+        results = await asyncio.gather(*conversations)
+        if not conversations and self._actions:
+            await asyncio.wait([task for _, task in self._actions])
+        return results + self._finished_actions()
+
+    def _finished_actions(self):
+        finished = [task.result() for _, task in self._actions if task.done()]
+        self._actions = [(npcs, task) for npcs, task in self._actions if not task.done()]
+        return finished
+
+    async def finish_actions(self):
+        """Waits for actions still running from earlier ticks and returns their events."""
+        if self._actions:
+            await asyncio.wait([task for _, task in self._actions])
+        events = [event for result in self._finished_actions() for event in result]
+        if events and self.write_buffer is not None:
+            self.write_buffer.flush()
+        return events
+
+    def _move(self):
+        if self.world_state is not None:
+            return self._move_vectorized()
+        events = []
+        for npc in self.npcs:
+            if self.rng.random() < self.move_probability:
+                old_location = npc.current_location
+                new_location = self.village.move_npc(npc)
+                events.append({'type': 'move', 'npc': npc, 'from': old_location, 'to': new_location})
+        return events
+
+    def _move_vectorized(self):
+        world = self.world_state
+        indices, old_codes, new_codes = world.step_movement(self.move_probability)
+        world.sync_village(self.village, indices, old_codes)
+        world.write_locations(indices, self.write_buffer, self.village.db_path)
+        names = world.locations
+        return [
+            {'type': 'move', 'npc': world.npcs[index], 'from': names[old], 'to': names[new]}
+            for index, old, new in zip(indices.tolist(), old_codes.tolist(), new_codes.tolist())
+        ]
+
+    async def run_tick(self):
+        """
+        Runs one tick and returns its events in a stable order.
+        The clock is left alone so callers can report events at the tick's time.
+        """
+        self.tick += 1
+        if self.scheduler is not None:
+            self.scheduler.advance_tick(self.tick)
+        with metrics.span('tick_seconds'):
+            with metrics.span('tick_phase_seconds', phase='plan'):
+                encounters, idle = self.plan_tick()
+            tasks = [self._conversation(encounter) for encounter in encounters]
+            tick = None
+            if self.scheduler is not None:
+                tick = self.tick
+                acting = {npc for npcs, _ in self._actions for npc in npcs}
+                idle = [npc for npc in idle if npc not in acting]
+            if self.action_batch_size:
+                actions = [(batch, self._action_batch(batch, location, tick))
+                           for location, batch in batches(idle, self.action_batch_size)]
+            else:
+                actions = [([npc], self._action(npc, tick)) for npc in idle]
+            with metrics.span('tick_phase_seconds', phase='llm'):
+                if self.scheduler is None:
+                    results = await asyncio.gather(*tasks, *(action for _, action in actions))
+                else:
+                    results = await self._without_actions(tasks, actions)
+
+            events = [event for result in results for event in result]
+            with metrics.span('tick_phase_seconds', phase='move'):
+                events += self._move()
+            if self.write_buffer is not None:
+                with metrics.span('tick_phase_seconds', phase='flush'):
+                    self.write_buffer.flush()
+        metrics.inc('ticks_total')
+        return events
+
+    async def run(self, ticks, on_tick=None, delay=0, should_stop=None):
+        """
+        Runs up to ticks ticks. should_stop() is asked after each tick once
+        the clock has moved on, and ends the run early if it returns True.
+        Actions still running at the end are waited for and reported with
+        the last tick.
+        """
+        for tick in range(ticks):
+            events = await self.run_tick()
+            if on_tick is not None:
+                on_tick(tick, events)
+            self.village.advance_time(self.time_step)
+            if should_stop is not None and should_stop():
+                break
+            if delay:
+                await asyncio.sleep(delay)
+        events = await self.finish_actions()
+        if events and on_tick is not None:
+            on_tick(tick, events)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,286 @@
+# event_scheduler.py
+"""
+Discrete-event simulation of the village day.
+
+Instead of stepping the clock a minute at a time and visiting every NPC on
+every step, a priority queue holds timestamped events (wake-ups, schedule
+changes, arrivals, actions, conversations) and Village.current_time jumps
+straight from one to the next. An NPC following a daily routine schedules
+its next event and costs nothing until then, so a sleeping village costs
+nothing and a full day costs in proportion to what actually happens.
+
+Only 'act' and 'converse' events call the model.
+"""
+import heapq
+import itertools
+import random
+from datetime import timedelta
+
+import metrics
+from npc import TOPICS
+
+EVENT_KINDS = ('wake', 'schedule', 'arrive', 'act', 'converse')
+
+
+class Routine:
+    """
+    A daily timetable: (hour, activity, location) blocks sorted by hour. Each
+    block lasts until the next one starts, and the last one wraps around
+    midnight. activity is 'sleep', 'work' or 'leisure'; location None means
+    staying wherever the NPC is.
+    """
+
+    def __init__(self, blocks):
+        self.blocks = sorted(blocks)
+        if not self.blocks:
+            raise ValueError("a routine needs at least one block")
+
+    def block_at(self, when):
+        hour = when.hour + when.minute / 60
+        current = self.blocks[-1]
+        for block in self.blocks:
+            if block[0] <= hour:
+                current = block
+        return current
+
+    def next_change(self, when):
+        """The time the block after the one active at `when` starts."""
+        day = when.replace(hour=0, minute=0, second=0, microsecond=0)
+        for hour, _, _ in self.blocks:
+            start = day + timedelta(hours=hour)
+            if start > when:
+                return start
+        return day + timedelta(days=1, hours=self.blocks[0][0])
+
+
+ROUTINES = {
+    'baker': Routine([(4, 'work', 'Bakery'), (13, 'leisure', 'Marketplace'), (20, 'sleep', None)]),
+    'farmer': Routine([(5, 'work', 'Farmhouse'), (17, 'leisure', 'River Bank'), (21, 'sleep', None)]),
+    'villager': Routine([(7, 'leisure', 'Town Square'), (12, 'leisure', 'Marketplace'), (22, 'sleep', None)]),
+}
+
+
+def routine_for(npc):
+    """Picks a routine from the NPC's personality and backstory."""
+    text = f"{npc.personality} {npc.backstory}".lower()
+    for name, routine in ROUTINES.items():
+        if name in text:
+            return routine
+    return ROUTINES['villager']
+
+
+class Event:
+    __slots__ = ('time', 'seq', 'kind', 'npc', 'block')
+
+    def __init__(self, time, seq, kind, npc, block):
+        self.time = time
+        self.seq = seq
+        self.kind = kind
+        self.npc = npc
+        self.block = block  # the NPC's block counter when this was scheduled
+
+    def __lt__(self, other):
+        return (self.time, self.seq) < (other.time, other.seq)
+
+    def __repr__(self):
+        name = self.npc.name if self.npc is not None else None
+        return f"Event({self.time:%H:%M}, {self.kind!r}, {name!r})"
+
+
+class EventScheduler:
+    """
+    Drives Village.current_time from a queue of events.
+
+    Outputs use the same event dicts as TickEngine ('action', 'interaction',
+    'move'), so the same printers work for both. Events scheduled for a
+    routine block that has since ended are discarded when popped.
+    """
+
+    def __init__(self, village, npcs, routines=None, rng=None, write_buffer=None,
+                 act_interval=(30, 90), travel_minutes=(5, 20), converse_probability=0.5,
+                 topics=TOPICS, flush_interval=3600):
+        self.village = village
+        self.npcs = list(npcs)
+        self.rng = rng or random.Random()
+        self.write_buffer = write_buffer
+        self.act_interval = act_interval
+        self.travel_minutes = travel_minutes
+        self.converse_probability = converse_probability
+        self.topics = topics
+        self.flush_interval = timedelta(seconds=flush_interval)
+        self.routines = {npc: (routines or {}).get(npc.name) or routine_for(npc) for npc in self.npcs}
+        self.activity = {}  # npc -> activity of its current block
+        self.block_end = {}  # npc -> when its current block ends
+        self._block = {npc: 0 for npc in self.npcs}
+        self._queue = []
+        self._seq = itertools.count()
+        self._last_flush = village.current_time
+        self.processed = {kind: 0 for kind in EVENT_KINDS}
+        self.discarded = 0
+        self.llm_calls = 0
+
+    def schedule(self, when, kind, npc=None):
+        if kind not in EVENT_KINDS:
+            raise ValueError(f"kind must be one of {EVENT_KINDS}")
+        block = self._block.get(npc)
+        heapq.heappush(self._queue, Event(when, next(self._seq), kind, npc, block))
+
+    def start(self):
+        """Puts every NPC into the routine block for the current time."""
+        for npc in self.npcs:
+            self.schedule(self.village.current_time, 'schedule', npc)
+
+    def pending(self):
+        return len(self._queue)
+
+    def next_time(self):
+        return self._queue[0].time if self._queue else None
+
+    def run_until(self, end_time, on_event=None):
+        """
+        Processes every event due by end_time in time order, then leaves the
+        clock at end_time. on_event(event, outputs) is called after each one.
+        Returns the number of events processed.
+        """
+        count = 0
+        while self._queue and self._queue[0].time <= end_time:
+            event = heapq.heappop(self._queue)
+            if event.npc is not None and event.block != self._block[event.npc]:
+                self.discarded += 1
+                continue
+            self.village.current_time = event.time
+            with metrics.span('event_seconds', kind=event.kind):
+                outputs = getattr(self, f'_on_{event.kind}')(event)
+            self.processed[event.kind] += 1
+            count += 1
+            if on_event is not None:
+                on_event(event, outputs)
+            self._maybe_flush(event.time)
+        self.village.current_time = max(self.village.current_time, end_time)
+        if self.write_buffer is not None:
+            self.write_buffer.flush()
+        return count
+
+    def run_for(self, seconds, on_event=None):
+        return self.run_until(self.village.current_time + timedelta(seconds=seconds), on_event)
+
+    def export_state(self):
+        """
+        Everything needed to carry on later, with NPCs as indices into
+        self.npcs: the queue, each NPC's block counter, activity and block
+        end, and the counters.
+        """
+        index = {npc: i for i, npc in enumerate(self.npcs)}
+        return {
+            'queue': [
+                (event.time, event.seq, event.kind, index[event.npc] if event.npc is not None else None, event.block)
+                for event in self._queue
+            ],
+            'blocks': [self._block[npc] for npc in self.npcs],
+            'activity': [self.activity.get(npc) for npc in self.npcs],
+            'block_end': [self.block_end.get(npc) for npc in self.npcs],
+            'last_flush': self._last_flush,
+            'processed': dict(self.processed),
+            'discarded': self.discarded,
+            'llm_calls': self.llm_calls,
+        }
+
+    def restore_state(self, state):
+        """Inverse of export_state(), for a scheduler built over the same NPCs in the same order."""
+        self._queue = [
+            Event(when, seq, kind, self.npcs[npc] if npc is not None else None, block)
+            for when, seq, kind, npc, block in state['queue']
+        ]
+        heapq.heapify(self._queue)
+        self._seq = itertools.count(max((event.seq for event in self._queue), default=-1) + 1)
+        self._block = dict(zip(self.npcs, state['blocks']))
+        self.activity = {npc: activity for npc, activity in zip(self.npcs, state['activity']) if activity}
+        self.block_end = {npc: end for npc, end in zip(self.npcs, state['block_end']) if end is not None}
+        self._last_flush = state['last_flush']
+        self.processed.update(state['processed'])
+        self.discarded = state['discarded']
+        self.llm_calls = state['llm_calls']
+
+    def _maybe_flush(self, now):
+        if self.write_buffer is not None and now - self._last_flush >= self.flush_interval:
+            self.write_buffer.flush()
+            self._last_flush = now
+
+    def _after(self, minutes_range):
+        low, high = minutes_range
+        return self.village.current_time + timedelta(minutes=self.rng.uniform(low, high))
+
+    # Handlers. Each returns a list of output event dicts.
+
+    def _on_schedule(self, event):
+        npc = event.npc
+        now = self.village.current_time
+        routine = self.routines[npc]
+        _, activity, location = routine.block_at(now)
+
+        self._block[npc] += 1
+        self.activity[npc] = activity
+        self.block_end[npc] = routine.next_change(now)
+        next_kind = 'wake' if activity == 'sleep' else 'schedule'
+        self.schedule(self.block_end[npc], next_kind, npc)
+
+        if activity == 'sleep':
+            return []
+        if location is not None and location != npc.current_location:
+            self.schedule(self._after(self.travel_minutes), 'arrive', npc)
+            return []
+        self._settle(npc)
+        return []
+
+    _on_wake = _on_schedule
+
+    def _on_arrive(self, event):
+        npc = event.npc
+        _, _, location = self.routines[npc].block_at(self.village.current_time)
+        old_location = npc.current_location
+        self.village.relocate_npc(npc, location)
+        self._settle(npc)
+        return [{'type': 'move', 'npc': npc, 'from': old_location, 'to': location}]
+
+    def _settle(self, npc):
+        """Schedules what an awake NPC does next at its current location."""
+        if self._awake_company(npc) and self.rng.random() < self.converse_probability:
+            self._schedule_in_block(self._after((1, 10)), 'converse', npc)
+        self._schedule_in_block(self._after(self.act_interval), 'act', npc)
+
+    def _schedule_in_block(self, when, kind, npc):
+        if when < self.block_end[npc]:
+            self.schedule(when, kind, npc)
+
+    def _awake_company(self, npc):
+        return [
+            other for other in self.village.npcs_at(npc.current_location)
+            if other is not npc and self.activity.get(other, 'sleep') != 'sleep'
+        ]
+
+    def _on_act(self, event):
+        npc = event.npc
+        self._schedule_in_block(self._after(self.act_interval), 'act', npc)
+        self.llm_calls += 1
+        action = npc.perform_action()
+        if action is None:
+            return []
+        return [{'type': 'action', 'npc': npc, 'text': action}]
+
+    def _on_converse(self, event):
+        speaker = event.npc
+        company = self._awake_company(speaker)
+        if not company:
+            return []
+        listener = self.rng.choice(company)
+        topic = self.rng.choice(self.topics) if self.topics else None
+        statement = speaker.interact_with(listener, topic)
+        self.llm_calls += 1
+        if statement is None:
+            return []
+        events = [{'type': 'interaction', 'speaker': speaker, 'listener': listener, 'text': statement}]
+        reaction = listener.react_to(speaker, statement)
+        self.llm_calls += 1
+        if reaction is not None:
+            events.append({'type': 'interaction', 'speaker': listener, 'listener': speaker, 'text': reaction})
+        return events
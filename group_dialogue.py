@@ -0,0 +1,97 @@
+# group_dialogue.py
+"""
+Whole conversations from a single LLM call.
+
+Instead of one interact_with plus one react_to per participant, the model is
+asked for a short transcript of everyone at the location as JSON. The
+transcript is split back into per-speaker lines, which are logged as
+interactions and remembered by both speaker and listener, so the record of
+who said what to whom is the same as with pairwise calls.
+"""
+import json
+
+from prompt_builder import clean
+
+
+class DialogueParseError(ValueError):
+    """The model's transcript could not be mapped onto the participants."""
+
+
+def build_dialogue_prompt(participants, topic, location, turns):
+    cast = "\n".join(f"- {npc.name}: {npc.personality}. {npc.backstory}" for npc in participants)
+    names = ", ".join(npc.name for npc in participants)
+    return clean(f"""
+        Villagers at the {location}:
+        {cast}
+
+        Write a short conversation of about {turns} lines between {names} about {topic}.
+        Each line is 5-15 words and stays in character.
+        Answer with JSON only, in this form:
+        {{"lines": [{{"speaker": "<name>", "to": "<name>", "text": "<what they say>"}}]}}
+    """)
+
+
+def parse_transcript(raw, participants):
+    """
+    Returns [(speaker, listener, text)] with NPC objects. Unknown speakers are
+    an error; a missing or unknown listener defaults to the previous speaker,
+    or to the next participant for the opening line.
+    """
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        raise DialogueParseError(f"not JSON: {e}") from e
+    lines = data.get('lines') if isinstance(data, dict) else data
+    if not isinstance(lines, list) or not lines:
+        raise DialogueParseError("no lines in transcript")
+
+    by_name = {npc.name.lower(): npc for npc in participants}
+    transcript = []
+    previous = None
+    for line in lines:
+        if not isinstance(line, dict):
+            raise DialogueParseError(f"line is not an object: {line!r}")
+        speaker = by_name.get(str(line.get('speaker', '')).strip().lower())
+        text = str(line.get('text', '')).strip()
+        if speaker is None:
+            raise DialogueParseError(f"unknown speaker {line.get('speaker')!r}")
+        if not text:
+            continue
+        listener = by_name.get(str(line.get('to', '')).strip().lower())
+        if listener is None or listener is speaker:
+            if previous is not None and previous is not speaker:
+                listener = previous
+            else:
+                listener = next(npc for npc in participants if npc is not speaker)
+        transcript.append((speaker, listener, text))
+        previous = speaker
+    if not transcript:
+        raise DialogueParseError("transcript has no usable lines")
+    return transcript
+
+
+def record_transcript(transcript, participants, topic):
+    """Logs every line and updates both parties' memories."""
+    for speaker, listener, text in transcript:
+        speaker.add_to_memory(f"Said to {listener.name}: {text}")
+        listener.add_to_memory(f"{speaker.name} said: {text}")
+        speaker.log_interaction(f"Talking to {listener.name}", text, listener=listener)
+    for npc in participants:
+        others = ", ".join(other.name for other in participants if other is not npc)
+        npc.add_to_memory(f"Talked with {others} about {topic}", memory_type='long')
+
+
+def run_group_dialogue(participants, topic, location, turns=None):
+    """
+    Generates, parses and records one conversation. Returns the transcript, or
+    raises DialogueParseError / LLMError so the caller can fall back to
+    pairwise calls.
+    """
+    if len(participants) < 2:
+        raise ValueError("a conversation needs at least two participants")
+    turns = turns or 2 * len(participants)
+    prompt = build_dialogue_prompt(participants, topic, location, turns)
+    raw = participants[0].generate(prompt, format='json', kind='dialogue')
+    transcript = parse_transcript(raw, participants)
+    record_transcript(transcript, participants, topic)
+    return transcript
@@ -0,0 +1,370 @@
+# headless.py
+"""
+Fast-forward the village without a terminal audience.
+
+No sleeps between ticks, a choice of output (nothing, one JSON object per
+event, or the usual pretty print), and a closing throughput report on
+stderr. With --output ndjson, stdout carries nothing but events: any other
+output during the run, including from shard workers, goes to stderr.
+Without --llm-host the model is the in-process stub, and with --seed
+two runs produce the same event stream:
+
+    python headless.py --ticks 500 --seed 7 --output ndjson > run.ndjson
+
+A seeded run folds memory summaries inline instead of on the background
+worker and keeps one cached response per prompt, so nothing depends on
+thread timing. Unless --db is given the run uses a throwaway database.
+
+--llm-workers puts the LLM scheduler in front of the model: dialogue goes
+first, and a tick with conversations waits only for them while actions
+finish in the background. Actions that haven't started when the next tick begins,
+or that waited longer than their --deadline, are dropped and counted in the
+report. Which ones make it depends on timing, so such runs don't repeat
+exactly even with --seed:
+
+    python headless.py --ticks 200 --llm-workers 4 --deadline action=5 --stub-latency 0.05
+
+With --checkpoint the run saves its full state at the end, on SIGTERM and
+every --checkpoint-interval seconds; --resume carries on from such a file
+and, with a seed, prints exactly what the uninterrupted run would have:
+
+    python headless.py --db v.db --checkpoint v.ckpt --ticks 1000 --seed 7
+    python headless.py --resume v.ckpt --ticks 2000
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import checkpoint
+import metrics
+import simulation
+from encounters import PAIRING_POLICIES, EncounterPlanner
+from engine import TickEngine
+from event_scheduler import EventScheduler
+from llm_backends import client_for
+from llm_cache import ResponseCache
+from llm_scheduler import DEFAULT_DEADLINES, PRIORITIES, LLMScheduler
+from npc import NPC, TOPICS
+from population import load_population
+from sharding import ShardedSimulation
+from village import Village
+from world_state import WorldState
+from write_buffer import WriteBuffer
+
+OUTPUTS = ('quiet', 'ndjson', 'pretty')
+DEFAULT_START = '2026-01-01T08:00:00'
+CHECKPOINT_STEP = timedelta(hours=1)  # simulated time between checkpoint chances in event-driven runs
+PERSONALITIES = ["friendly baker", "grumpy farmer", "curious fisher", "gossiping merchant", "quiet scholar"]
+
+
+def synthetic_population(count, locations, rng):
+    return [
+        {
+            'name': f"Villager{i}",
+            'personality': PERSONALITIES[i % len(PERSONALITIES)],
+            'backstory': "Has lived in the village all their life.",
+            'current_location': rng.choice(locations),
+        }
+        for i in range(count)
+    ]
+
+
+def event_record(tick, village, event):
+    record = {'tick': tick, 'time': village.get_current_time_str(), 'type': event['type']}
+    if event['type'] == 'interaction':
+        record.update(speaker=event['speaker'].name, listener=event['listener'].name, text=event['text'])
+    elif event['type'] == 'action':
+        record.update(npc=event['npc'].name, location=event['npc'].current_location, text=event['text'])
+    elif event['type'] == 'move':
+        record.update(npc=event['npc'].name, **{'from': event['from'], 'to': event['to']})
+    return record
+
+
+def make_printer(output, village, out=None):
+    if output == 'quiet':
+        return lambda tick, events: None
+    if output == 'ndjson':
+        def write(tick, events):
+            for event in events:
+                out.write(json.dumps(event_record(tick, village, event)) + "\n")
+        return write
+
+    def pretty(tick, events):
+        simulation.print_separator()
+        simulation.print_time_header(village)
+        for event in events:
+            if event['type'] == 'interaction':
+                simulation.print_interaction(event['speaker'], event['listener'], event['text'])
+            elif event['type'] == 'action':
+                simulation.print_npc_action(event['npc'], event['text'])
+            elif event['type'] == 'move':
+                simulation.print_movement(event['npc'], event['from'], event['to'])
+    return pretty
+
+
+def run_mode(args):
+    return 'events' if args.event_driven else 'ticks'
+
+
+def run(args, db_path, out=None):
+    out = out or sys.stdout
+    rng = random.Random(args.seed)
+    deterministic = args.seed is not None
+    if args.metrics:
+        metrics.enable()
+
+    write_buffer = WriteBuffer(db_path, durability=args.durability)
+    client = client_for(args.llm_host, args.stub_latency)
+    NPC.db_path = db_path
+    NPC.write_buffer = write_buffer
+    NPC.llm_client = client
+    scheduler = None
+    if args.llm_workers:
+        scheduler = LLMScheduler(client, workers=args.llm_workers,
+                                 default_deadlines={**DEFAULT_DEADLINES, **args.deadline})
+        NPC.llm_client = scheduler
+    NPC.response_cache = ResponseCache(variants=1 if deterministic else 3, rng=random.Random(rng.random()))
+    if deterministic:
+        NPC.consolidator = None
+    NPC.initialize_database()
+
+    village = Village(db_path=db_path, write_buffer=write_buffer, rng=random.Random(rng.random()))
+    resumed = None
+    if args.resume:
+        resumed = checkpoint.Checkpoint(args.resume)
+        mode = resumed.meta['extra'].get('mode')
+        if mode != run_mode(args):
+            raise SystemExit(f"{args.resume} was taken in {mode} mode; rerun with the same mode")
+        npcs = checkpoint.restore(resumed, village)
+        run_start = datetime.fromisoformat(resumed.meta['extra']['run_start'])
+    else:
+        village.current_time = run_start = datetime.fromisoformat(args.start)
+        if args.npcs:
+            source = synthetic_population(args.npcs, village.locations, rng)
+        else:
+            source = args.population
+        npcs = load_population(source, db_path=db_path, village=village)
+    write_buffer.flush()
+    printer = make_printer(args.output, village, out)
+    rngs = {'village': village.rng, 'cache': NPC.response_cache.rng}
+    state = {'tick': lambda: None, 'scheduler': None}
+    checkpointer = None
+    if args.checkpoint:
+        def save(path, compress):
+            return checkpoint.save(path, village, npcs, tick=state['tick'](), scheduler=state['scheduler'],
+                                   rngs=rngs, write_buffer=write_buffer, compress=compress,
+                                   extra={'mode': run_mode(args), 'run_start': run_start.isoformat()})
+        checkpointer = checkpoint.Checkpointer(args.checkpoint, save, interval=args.checkpoint_interval,
+                                               compress=args.compress)
+        checkpointer.install_signal_handler()
+
+    sharded = engine = None
+    started = time.perf_counter()
+    try:
+        if args.event_driven:
+            events = EventScheduler(village, npcs, rng=random.Random(rng.random()), write_buffer=write_buffer)
+            rngs['events'] = events.rng
+            state['scheduler'] = events
+            if resumed:
+                checkpoint.restore_scheduler(resumed, events)
+                checkpoint.restore_rngs(resumed, rngs)
+            else:
+                events.start()
+            first_event = sum(events.processed.values())
+
+            def on_event(event, outputs):
+                if outputs:
+                    printer(sum(events.processed.values()), outputs)
+
+            end = run_start + timedelta(hours=args.hours)
+            while village.current_time < end:
+                events.run_until(min(village.current_time + CHECKPOINT_STEP, end), on_event=on_event)
+                if checkpointer is not None and checkpointer.step():
+                    break
+            steps = sum(events.processed.values()) - first_event
+            unit = 'events'
+        elif args.shards:
+            planner = EncounterPlanner(policy=args.pairing, topics=TOPICS, rng=random.Random(rng.random()))
+            sharded = ShardedSimulation(village, npcs, shards=args.shards, write_buffer=write_buffer,
+                                        planner=planner, rng=random.Random(rng.random()),
+                                        concurrency=args.concurrency, seed=args.seed, llm_hosts=args.llm_host,
+                                        stub_latency=args.stub_latency, group_dialogue=args.group_dialogue,
+                                        action_batch_size=args.action_batch_size)
+            try:
+                sharded.run(args.ticks, on_tick=lambda tick, events: printer(tick + 1, events))
+            finally:
+                sharded.close()
+            steps = args.ticks
+            unit = 'ticks'
+        else:
+            world_state = None
+            if args.vectorized:
+                world_state = WorldState.from_npcs(npcs, village.locations, seed=rng.randrange(2 ** 32))
+                rngs['world'] = world_state.rng
+            engine_rng = random.Random(rng.random())
+            rngs['engine'] = engine_rng
+            planner = EncounterPlanner(policy=args.pairing, topics=TOPICS, rng=engine_rng)
+            engine = TickEngine(village, npcs, concurrency=args.concurrency, rng=engine_rng,
+                                write_buffer=write_buffer, planner=planner, world_state=world_state,
+                                group_dialogue=args.group_dialogue, action_batch_size=args.action_batch_size,
+                                scheduler=scheduler)
+            state['tick'] = lambda: engine.tick
+            if resumed:
+                engine.tick = resumed.meta['tick']
+                checkpoint.restore_rngs(resumed, rngs)
+            first_tick = engine.tick
+            try:
+                asyncio.run(engine.run(
+                    args.ticks - first_tick,
+                    on_tick=lambda tick, events: printer(first_tick + tick + 1, events),
+                    should_stop=checkpointer.step if checkpointer is not None else None,
+                ))
+            finally:
+                engine.close()
+            steps = engine.tick - first_tick
+            unit = 'ticks'
+        if checkpointer is not None and not checkpointer.stop_requested:
+            checkpointer.save_now()
+    finally:
+        if resumed is not None:
+            resumed.close()
+        if NPC.consolidator is not None:
+            NPC.consolidator.drain()
+        if scheduler is not None:
+            scheduler.close()
+        write_buffer.close()
+    elapsed = time.perf_counter() - started
+    out.flush()
+
+    llm_calls = sharded.llm_calls if sharded else client.calls
+    report = {
+        unit: steps,
+        'npcs': len(npcs),
+        'seconds': round(elapsed, 3),
+        f'{unit}_per_second': round(steps / elapsed, 2) if elapsed else None,
+        'llm_calls': llm_calls,
+        'llm_calls_per_second': round(llm_calls / elapsed, 2) if elapsed else None,
+        'cache_hits': sharded.cache_hits if sharded else NPC.response_cache.hits,
+        'db_writes': write_buffer.rows_written,
+        'db_writes_per_second': round(write_buffer.rows_written / elapsed, 2) if elapsed else None,
+        'simulated_until': village.get_current_time_str(),
+    }
+    if scheduler is not None:
+        stats = scheduler.stats()
+        report['llm_dropped'] = {reason: stats[reason] for reason in ('superseded', 'expired', 'stale')}
+        if engine is not None:
+            report['llm_dropped']['not_started'] = engine.skipped_actions
+    if sharded:
+        report.update(shards=args.shards, shard_sizes=sharded.shard_sizes(), migrations=sharded.migrations)
+    if checkpointer is not None:
+        report.update(checkpoints=checkpointer.saves, checkpoint_seconds=round(checkpointer.last_seconds, 3),
+                      checkpoint_bytes=checkpointer.last_size, stopped_early=checkpointer.stop_requested)
+    if args.metrics:
+        report['metrics'] = metrics.summary()
+    return report
+
+
+def print_report(report, output):
+    if output == 'ndjson':
+        print(json.dumps(report), file=sys.stderr)
+        return
+    report = dict(report)
+    breakdown = report.pop('metrics', None)
+    width = max(len(key) for key in report)
+    print("\nThroughput", file=sys.stderr)
+    for key, value in report.items():
+        print(f"  {key:<{width}}  {value}", file=sys.stderr)
+    if breakdown:
+        print("\nMetrics (count, mean)", file=sys.stderr)
+        for key, value in sorted(breakdown.items()):
+            if isinstance(value, dict):
+                value = f"{value['count']:>8}  {value['mean']:.6f}"
+            print(f"  {key:<48}  {value}", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ticks', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', choices=OUTPUTS, default='quiet')
+    parser.add_argument('--population', default=simulation.DEFAULT_POPULATION)
+    parser.add_argument('--npcs', type=int, default=None, help="generate this many NPCs instead of --population")
+    parser.add_argument('--db', default=None, help="database file (default: a temporary one)")
+    parser.add_argument('--start', default=DEFAULT_START, help="simulated start time, ISO format")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--durability', choices=('normal', 'full', 'off'), default='normal')
+    parser.add_argument('--pairing', choices=PAIRING_POLICIES, default='pairs')
+    parser.add_argument('--group-dialogue', action='store_true')
+    parser.add_argument('--action-batch-size', type=int, default=None,
+                        help="share one call per this many idle NPCs at a location; "
+                             "'pairs' leaves at most one idle NPC per location, so use with --pairing none")
+    parser.add_argument('--vectorized', action='store_true')
+    parser.add_argument('--event-driven', action='store_true', help="run routines for --hours instead of ticks")
+    parser.add_argument('--hours', type=float, default=24)
+    parser.add_argument('--checkpoint', default=None,
+                        help="checkpoint file, written at the end, on SIGTERM and every --checkpoint-interval")
+    parser.add_argument('--checkpoint-interval', type=float, default=None, help="seconds of wall time")
+    parser.add_argument('--compress', action='store_true', help="zlib-compress the checkpoint")
+    parser.add_argument('--resume', default=None, help="carry on from this checkpoint; --ticks/--hours stay totals")
+    parser.add_argument('--shards', type=int, default=None,
+                        help="run NPCs in this many worker processes (tick mode only)")
+    parser.add_argument('--llm-host', action='append', default=[], help="Ollama URL; repeat to balance across several")
+    parser.add_argument('--llm-workers', type=int, default=None,
+                        help="send LLM calls through a priority scheduler with this many workers")
+    parser.add_argument('--deadline', action='append', default=[], metavar='KIND=SECONDS',
+                        help="drop KIND requests (dialogue, action, summary) queued longer than this; "
+                             f"repeatable (default: {', '.join(f'{k}={v:g}' for k, v in DEFAULT_DEADLINES.items())})")
+    parser.add_argument('--metrics', action='store_true', help="time the hot paths and add them to the report")
+    parser.add_argument('--stub-latency', type=float, default=0.0, help="seconds per call for the built-in stub")
+    args = parser.parse_args(argv)
+    if args.shards is not None and (args.shards < 1 or args.event_driven or args.vectorized):
+        parser.error("--shards needs a positive count and can't be combined with --event-driven or --vectorized")
+    if args.shards is not None and (args.checkpoint or args.resume):
+        parser.error("--shards doesn't support --checkpoint or --resume")
+    if args.shards is not None and args.llm_workers:
+        parser.error("--shards doesn't support --llm-workers")
+    if args.deadline and not args.llm_workers:
+        parser.error("--deadline needs --llm-workers")
+    deadlines = {}
+    for item in args.deadline:
+        kind, _, seconds = item.partition('=')
+        try:
+            deadlines[kind] = float(seconds)
+        except ValueError:
+            parser.error(f"--deadline expects KIND=SECONDS, got {item!r}")
+        if kind not in PRIORITIES:
+            parser.error(f"--deadline kind must be one of {', '.join(PRIORITIES)}")
+    args.deadline = deadlines
+    if args.checkpoint and not (args.db or args.resume):
+        parser.error("--checkpoint needs --db, so the history it refers to outlives the run")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.resume and not args.db:
+        with checkpoint.Checkpoint(args.resume) as resumed:
+            args.db = resumed.meta['db_path']
+    out = sys.stdout
+    # stdout carries only events in NDJSON mode; diagnostics printed
+    # anywhere else during the run go to stderr.
+    with contextlib.ExitStack() as stack:
+        if args.output == 'ndjson':
+            stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+        if args.db:
+            report = run(args, args.db, out)
+        else:
+            tmp = stack.enter_context(tempfile.TemporaryDirectory(prefix='digidorf-'))
+            report = run(args, os.path.join(tmp, 'village.db'), out)
+    print_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+# history.py
+"""
+Paging and exporting the interaction and action history.
+
+Pages are keyset-paginated on (timestamp, id): the cursor is the last row's
+key and the next page starts strictly after it, so every page costs the
+same index range scan however deep into the history it is, and rows written
+meanwhile don't shift the pages. NPC names are joined in the same query.
+A filter that matches either of two columns (an NPC as speaker or listener)
+runs one keyset branch per column, each on its own index and limit, and
+merges them, so it never sorts the NPC's whole history.
+
+Exports walk the same keyset in fixed-size chunks from a generator, so
+memory use doesn't depend on how many rows there are.
+"""
+import base64
+import csv
+import io
+import json
+
+import db
+
+MAX_PAGE_SIZE = 1000
+EXPORT_CHUNK_SIZE = 1000
+
+TABLES = {
+    'interactions': {
+        'select': '''
+            SELECT i.id, i.timestamp, i.speaker_id, s.name, i.listener_id, l.name, i.interaction_type, i.content
+            FROM interactions i
+            LEFT JOIN npcs s ON s.id = i.speaker_id
+            LEFT JOIN npcs l ON l.id = i.listener_id
+        ''',
+        'alias': 'i',
+        'columns': ('id', 'timestamp', 'speaker_id', 'speaker', 'listener_id', 'listener',
+                    'interaction_type', 'content'),
+        'filters': {
+            # A tuple matches any of its clauses; each becomes a UNION ALL branch.
+            'npc': (
+                'i.speaker_id = (SELECT id FROM npcs WHERE name = ?)',
+                'i.listener_id = (SELECT id FROM npcs WHERE name = ?) AND i.speaker_id IS NOT i.listener_id',
+            ),
+            'speaker': 'i.speaker_id = (SELECT id FROM npcs WHERE name = ?)',
+            'listener': 'i.listener_id = (SELECT id FROM npcs WHERE name = ?)',
+        },
+    },
+    'actions': {
+        'select': '''
+            SELECT a.id, a.timestamp, a.npc_id, n.name, a.location, a.action
+            FROM actions a
+            LEFT JOIN npcs n ON n.id = a.npc_id
+        ''',
+        'alias': 'a',
+        'columns': ('id', 'timestamp', 'npc_id', 'npc', 'location', 'action'),
+        'filters': {
+            'npc': 'a.npc_id = (SELECT id FROM npcs WHERE name = ?)',
+            'location': 'a.location = ?',
+        },
+    },
+}
+TIME_FILTERS = ('since', 'until')
+
+
+def encode_cursor(timestamp, row_id):
+    raw = json.dumps([timestamp, row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"invalid cursor {cursor!r}") from e
+    if not isinstance(row_id, int):
+        raise ValueError(f"invalid cursor {cursor!r}")
+    return timestamp, row_id
+
+
+def normalize_time(value):
+    """Accepts ISO 8601 ('2024-05-01T12:00:00') or SQLite's 'YYYY-MM-DD HH:MM:SS'."""
+    return value.replace('T', ' ').rstrip('Z')[:19]
+
+
+def parse_filters(table, args):
+    """Picks the supported filters for table out of a request's query args."""
+    spec = TABLES[table]
+    filters = {name: args[name] for name in spec['filters'] if args.get(name)}
+    for name in TIME_FILTERS:
+        if args.get(name):
+            filters[name] = normalize_time(args[name])
+    return filters
+
+
+def build_query(table, filters, after=None, order='desc', limit=100):
+    spec = TABLES[table]
+    alias = spec['alias']
+    clauses, params, branches = [], [], None
+    for name, value in filters.items():
+        if name == 'since':
+            clause = f'{alias}.timestamp >= ?'
+        elif name == 'until':
+            clause = f'{alias}.timestamp < ?'
+        else:
+            clause = spec['filters'][name]
+        if isinstance(clause, tuple):
+            branches = [(branch, [value] * branch.count('?')) for branch in clause]
+            continue
+        clauses.append(clause)
+        params.extend([value] * clause.count('?'))
+    if after is not None:
+        comparison = '<' if order == 'desc' else '>'
+        clauses.append(f'({alias}.timestamp, {alias}.id) {comparison} (?, ?)')
+        params.extend(after)
+    direction = 'DESC' if order == 'desc' else 'ASC'
+    order_by = f' ORDER BY {alias}.timestamp {direction}, {alias}.id {direction} LIMIT ?'
+    if branches is None:
+        return _select(spec, clauses) + order_by, params + [limit]
+    parts, union_params = [], []
+    for clause, branch_params in branches:
+        parts.append(f'SELECT * FROM ({_select(spec, [clause] + clauses)}{order_by})')
+        union_params += branch_params + params + [limit]
+    sql = ' UNION ALL '.join(parts) + f' ORDER BY timestamp {direction}, id {direction} LIMIT ?'
+    return sql, union_params + [limit]
+
+
+def _select(spec, clauses):
+    sql = spec['select']
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    return sql
+
+
+def fetch_rows(table, filters, after=None, order='desc', limit=100, db_path=db.DEFAULT_DB_PATH):
+    sql, params = build_query(table, filters, after, order, limit)
+    return db.query_all(sql, params, db_path)
+
+
+def query_page(table, filters=None, cursor=None, limit=100, order='desc', db_path=db.DEFAULT_DB_PATH):
+    """Returns {'items': [...], 'next_cursor': str or None}, newest first by default."""
+    if table not in TABLES:
+        raise ValueError(f"unknown table {table!r}")
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be 'asc' or 'desc'")
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = decode_cursor(cursor) if cursor else None
+    rows = fetch_rows(table, filters or {}, after, order, limit + 1, db_path)
+    columns = TABLES[table]['columns']
+    items = [dict(zip(columns, row)) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last[1], last[0])
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+def iter_chunks(table, filters=None, order='asc', chunk_size=EXPORT_CHUNK_SIZE, db_path=db.DEFAULT_DB_PATH):
+    """Yields every matching row, oldest first, in lists of up to chunk_size."""
+    after = None
+    while True:
+        rows = fetch_rows(table, filters or {}, after, order, chunk_size, db_path)
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1][1], rows[-1][0])
+
+
+def export_ndjson(table, filters=None, db_path=db.DEFAULT_DB_PATH):
+    columns = TABLES[table]['columns']
+    for rows in iter_chunks(table, filters, db_path=db_path):
+        yield "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+
+
+def export_csv(table, filters=None, db_path=db.DEFAULT_DB_PATH):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TABLES[table]['columns'])
+    for rows in iter_chunks(table, filters, db_path=db_path):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
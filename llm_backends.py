@@ -0,0 +1,183 @@
+# llm_backends.py
+"""
+Routing and load balancing across several local LLM servers.
+
+A BackendRegistry looks like a single LLM client (generate/embed/model), so it
+can be used as NPC.llm_client or wrapped by the LLMScheduler. Each call's
+kind picks a model (e.g. a tiny model for actions, a stronger one for
+dialogue), and the request goes to whichever healthy backend serving that
+model has the fewest requests in flight. A backend that fails is taken out of
+rotation and re-checked after health_interval seconds.
+"""
+import os
+import threading
+import time
+
+from llm_client import LLMClient, LLMError
+from stub_ollama import stub_response
+
+
+class StubClient:
+    """In-process stand-in for an Ollama server: deterministic replies, no I/O."""
+
+    def __init__(self, model='phi3', latency=0.0, fail=False):
+        self.model = model
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, model=None, format=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail:
+            raise LLMError("stub backend configured to fail")
+        return stub_response(prompt, format)
+
+    def route(self, kind=None):
+        return self.model
+
+    def embed(self, texts, model=None, **kwargs):
+        raise LLMError("stub backend has no embedding model")
+
+    def health_check(self, timeout=5):
+        return not self.fail
+
+
+class Backend:
+    def __init__(self, name, client, models=None):
+        self.name = name
+        self.client = client
+        self.models = set(models) if models else None  # None serves any model
+        self.outstanding = 0
+        self.healthy = True
+        self.checked_at = 0.0
+        self.calls = 0
+        self.failures = 0
+
+    def serves(self, model):
+        return self.models is None or model in self.models
+
+
+class BackendRegistry:
+    def __init__(self, default_model='phi3', routes=None, health_interval=30.0):
+        self.model = default_model
+        self.routes = dict(routes or {})  # kind -> model
+        self.health_interval = health_interval
+        self.backends = []
+        self._lock = threading.Lock()
+        self._turn = 0
+
+    @classmethod
+    def from_urls(cls, urls, default_model='phi3', routes=None, **client_options):
+        registry = cls(default_model=default_model, routes=routes)
+        for url in urls:
+            registry.add_backend(url, LLMClient(url, model=default_model, **client_options))
+        return registry
+
+    def add_backend(self, name, client, models=None):
+        backend = Backend(name, client, models)
+        with self._lock:
+            self.backends.append(backend)
+        return backend
+
+    def route(self, kind=None):
+        return self.routes.get(kind, self.model)
+
+    @property
+    def calls(self):
+        with self._lock:
+            return sum(backend.calls for backend in self.backends)
+
+    def _candidates(self, model):
+        """Backends for model, least outstanding first; unhealthy ones only once due a re-check."""
+        now = time.monotonic()
+        with self._lock:
+            self._turn += 1
+            serving = [backend for backend in self.backends if backend.serves(model)]
+            ready = [b for b in serving if b.healthy or now - b.checked_at >= self.health_interval]
+            # Rotate before sorting so ties are broken round-robin.
+            offset = self._turn % len(ready) if ready else 0
+            ready = ready[offset:] + ready[:offset]
+            return sorted(ready, key=lambda backend: backend.outstanding)
+
+    def generate(self, prompt, kind=None, key=None, **kwargs):
+        model = kwargs.pop('model', None) or self.route(kind)
+        candidates = self._candidates(model)
+        if not candidates:
+            raise LLMError(f"No backend available for model {model!r}")
+        last_error = None
+        for backend in candidates:
+            with self._lock:
+                backend.outstanding += 1
+                backend.calls += 1
+            try:
+                result = backend.client.generate(prompt, model=model, **kwargs)
+            except LLMError as e:
+                last_error = e
+                self._mark(backend, healthy=False)
+                continue
+            finally:
+                with self._lock:
+                    backend.outstanding -= 1
+            if not backend.healthy:
+                self._mark(backend, healthy=True)
+            return result
+        raise LLMError(f"All backends for {model!r} failed; last error: {last_error}")
+
+    def embed(self, texts, **kwargs):
+        last_error = None
+        for backend in self._candidates(kwargs.get('model') or self.model):
+            try:
+                return backend.client.embed(texts, **kwargs)
+            except LLMError as e:
+                last_error = e
+        raise LLMError(f"No backend could embed: {last_error}")
+
+    def _mark(self, backend, healthy):
+        with self._lock:
+            backend.healthy = healthy
+            backend.checked_at = time.monotonic()
+            if not healthy:
+                backend.failures += 1
+
+    def check_health(self):
+        """Probes every backend now and returns {name: healthy}."""
+        for backend in list(self.backends):
+            self._mark(backend, healthy=backend.client.health_check())
+        return {backend.name: backend.healthy for backend in self.backends}
+
+    def start_health_checks(self):
+        """Re-probes all backends every health_interval seconds on a daemon thread."""
+        def loop():
+            while True:
+                self.check_health()
+                time.sleep(self.health_interval)
+
+        thread = threading.Thread(target=loop, name='llm-health', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        with self._lock:
+            return {
+                backend.name: {
+                    'healthy': backend.healthy,
+                    'outstanding': backend.outstanding,
+                    'calls': backend.calls,
+                    'failures': backend.failures,
+                }
+                for backend in self.backends
+            }
+
+
+def client_for(hosts=(), stub_latency=0.0):
+    """The stub with no hosts, a plain LLMClient for one, a BackendRegistry for several."""
+    model = os.environ.get('DIGIDORF_MODEL', 'phi3')
+    if not hosts:
+        return StubClient(model=model, latency=stub_latency)
+    if len(hosts) == 1:
+        return LLMClient(hosts[0], model=model)
+    return BackendRegistry.from_urls(hosts, default_model=model)
@@ -0,0 +1,180 @@
+# llm_cache.py
+import hashlib
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(prompt, model):
+    """Content address for a prompt: the same text to the same model is the same key."""
+    return hashlib.sha256(f"{model}\0{prompt}".encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM responses keyed by prompt content.
+
+    The in-memory tier is an LRU bounded by max_entries. The optional SQLite
+    tier (db_path) survives restarts and can be shared between runs; it is
+    bounded by max_db_entries and trimmed oldest-first. Both honour ttl.
+
+    With variants > 1 a key keeps collecting fresh responses until it holds
+    that many, and hits then pick one at random, so NPCs don't repeat
+    themselves word for word.
+    """
+
+    def __init__(self, max_entries=10000, ttl=None, variants=1, db_path=None,
+                 max_db_entries=100000, rng=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variants = max(1, variants)
+        self.db_path = db_path
+        self.max_db_entries = max_db_entries
+        self.rng = rng or random.Random()
+        self._entries = OrderedDict()  # key -> (created_at, [responses])
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.miss_seconds = 0.0
+        if db_path:
+            self._open_db()
+
+    def _open_db(self):
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT NOT NULL,
+                variant INTEGER NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (key, variant)
+            )
+        ''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache (created_at)')
+        self._db.commit()
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def _load_from_db(self, key, now):
+        rows = self._db.execute(
+            'SELECT response, created_at FROM llm_cache WHERE key = ? ORDER BY variant', (key,)
+        ).fetchall()
+        if not rows:
+            return None
+        created_at = min(row[1] for row in rows)
+        if self._expired(created_at, now):
+            self._db.execute('DELETE FROM llm_cache WHERE key = ?', (key,))
+            self._db.commit()
+            return None
+        return created_at, [row[0] for row in rows]
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, prompt, model):
+        """
+        Returns a cached response, or None if the key is missing, expired, or
+        has not collected all of its variants yet.
+        """
+        key = make_key(prompt, model)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0], now):
+                del self._entries[key]
+                entry = None
+            from_disk = False
+            if entry is None and self._db is not None:
+                entry = self._load_from_db(key, now)
+                if entry is not None:
+                    self._store(key, entry)
+                    from_disk = True
+            if entry is None or len(entry[1]) < self.variants:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.disk_hits += from_disk
+            return self.rng.choice(entry[1])
+
+    def put(self, prompt, model, response):
+        key = make_key(prompt, model)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[0], now):
+                entry = (now, [])
+            responses = entry[1]
+            if len(responses) >= self.variants:
+                return
+            responses.append(response)
+            self._store(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO llm_cache (key, variant, response, created_at) VALUES (?, ?, ?, ?)',
+                    (key, len(responses) - 1, response, entry[0])
+                )
+                self._db_puts += 1
+                if self._db_puts % 100 == 0:
+                    self._trim_db(now)
+                self._db.commit()
+
+    def _trim_db(self, now):
+        if self.ttl is not None:
+            self._db.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - self.ttl,))
+        self._db.execute('''
+            DELETE FROM llm_cache WHERE rowid IN (
+                SELECT rowid FROM llm_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_db_entries,))
+
+    def get_or_generate(self, prompt, model, generate):
+        """
+        Returns a cached response or calls generate() and caches its result.
+        Exceptions from generate() propagate and nothing is cached.
+        """
+        cached = self.get(prompt, model)
+        if cached is not None:
+            return cached
+        started = time.perf_counter()
+        response = generate()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.miss_seconds += elapsed
+        self.put(prompt, model, response)
+        return response
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            average_miss = self.miss_seconds / self.misses if self.misses else 0.0
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'estimated_seconds_saved': self.hits * average_miss,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM llm_cache')
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
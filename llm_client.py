@@ -0,0 +1,192 @@
+# llm_client.py
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_BASE_URL = os.environ.get('OLLAMA_HOST', 'http://127.0.0.1:11434')
+DEFAULT_MODEL = os.environ.get('DIGIDORF_MODEL', 'phi3')
+
+# Errors that mean a pooled keep-alive connection was closed by the server
+# while idle. The request never reached the model, so it is safe to resend.
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+
+class LLMError(Exception):
+    """Raised when the LLM backend cannot produce a response."""
+
+
+class LLMClient:
+    """
+    Talks to the Ollama HTTP API over a small pool of keep-alive connections.
+    One client is shared by every NPC, so the model stays loaded between calls
+    and no process or TCP handshake is paid per prompt.
+    """
+
+    def __init__(self, base_url=DEFAULT_BASE_URL, model=DEFAULT_MODEL, keep_alive='30m',
+                 timeout=30, retries=2, backoff=0.5, pool_size=8):
+        if '://' not in base_url:
+            base_url = 'http://' + base_url
+        parts = urlsplit(base_url)
+        self.base_url = base_url
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or (443 if parts.scheme == 'https' else 11434)
+        self.use_tls = parts.scheme == 'https'
+        self.model = model
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.prompt_tokens = 0  # as counted by the server (prompt_eval_count)
+        self.completion_tokens = 0
+
+    def _new_connection(self, timeout):
+        if self.use_tls:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _acquire(self, timeout):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            return self._new_connection(timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _release(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def _send(self, method, path, payload, timeout):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
+        conn, reused = self._acquire(timeout)
+        try:
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+            except STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                conn.close()
+                conn = self._new_connection(timeout)
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+            data = response.read()
+        except BaseException:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        return response.status, data
+
+    def generate(self, prompt, model=None, timeout=None, options=None, format=None, kind=None, key=None):
+        """
+        Sends a single non-streaming generate request and returns the response text.
+        kind and key are accepted so callers can treat this client and the
+        LLMScheduler alike; a plain client ignores them.
+        """
+        payload = {
+            'model': model or self.model,
+            'prompt': prompt,
+            'stream': False,
+            'keep_alive': self.keep_alive,
+        }
+        if options:
+            payload['options'] = options
+        if format:
+            payload['format'] = format
+        started = time.perf_counter()
+        try:
+            result = self._request('/api/generate', payload, timeout)
+            text = result['response']
+        except KeyError as e:
+            self._record(started, failed=True)
+            raise LLMError(f"Malformed response from LLM: missing {e}") from e
+        except LLMError:
+            self._record(started, failed=True)
+            raise
+        self._record(started, prompt_tokens=result.get('prompt_eval_count', 0),
+                     completion_tokens=result.get('eval_count', 0))
+        return text.strip()
+
+    def route(self, kind=None):
+        """The model a request of this kind will use."""
+        return self.model
+
+    def embed(self, texts, model=None, timeout=None):
+        """Returns one embedding vector (list of floats) per input text."""
+        payload = {'model': model or self.model, 'input': list(texts), 'keep_alive': self.keep_alive}
+        try:
+            return self._request('/api/embed', payload, timeout)['embeddings']
+        except KeyError as e:
+            raise LLMError(f"Malformed embedding response: missing {e}") from e
+
+    def _request(self, path, payload, timeout=None):
+        """
+        POSTs payload and returns the decoded JSON body. Transient failures
+        (connection errors, timeouts, 5xx) are retried with exponential
+        backoff; anything else raises LLMError straight away.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            try:
+                status, data = self._send('POST', path, payload, timeout)
+            except (OSError, http.client.HTTPException) as e:
+                last_error = e
+                continue
+            if status >= 500:
+                last_error = LLMError(f"HTTP {status}: {data[:200]!r}")
+                continue
+            if status != 200:
+                raise LLMError(f"HTTP {status}: {data[:200]!r}")
+            try:
+                return json.loads(data)
+            except ValueError as e:
+                raise LLMError(f"Malformed response from LLM: {e}") from e
+        raise LLMError(f"LLM request failed after {self.retries + 1} attempts: {last_error}")
+
+    def health_check(self, timeout=5):
+        """True if the server answers its model list endpoint."""
+        try:
+            status, _ = self._send('GET', '/api/tags', None, timeout)
+        except (OSError, http.client.HTTPException):
+            return False
+        return status == 200
+
+    def _record(self, started, failed=False, prompt_tokens=0, completion_tokens=0):
+        with self._lock:
+            self.calls += 1
+            self.errors += failed
+            self.total_seconds += time.perf_counter() - started
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,223 @@
+# llm_scheduler.py
+"""
+Central queue in front of the LLM client.
+
+Every request carries a kind: dialogue is served before actions, and actions
+before summarization. A fixed pool of workers drains the queue in that
+order, so a pile of flavor-text actions can't hold up a conversation reply.
+
+Requests can carry a deadline and are dropped unserved once it passes. A new
+request from the same requester for the same kind supersedes one still
+waiting. advance_tick() drops queued work from ticks that are over. When the
+queue is full, submit() blocks (backpressure) and gives up after
+submit_timeout.
+"""
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from llm_client import LLMError
+
+PRIORITIES = {'dialogue': 0, 'action': 1, 'summary': 2}
+DEFAULT_KIND = 'action'
+# Seconds a request may wait in the queue when the caller gives no deadline;
+# dialogue always waits, since a conversation can't go on without its line.
+DEFAULT_DEADLINES = {'action': 30.0, 'summary': 120.0}
+
+
+class RequestDropped(LLMError):
+    """The request was never sent: superseded, past its deadline, or stale."""
+
+
+class SchedulerFull(LLMError):
+    """The queue stayed full for longer than submit_timeout."""
+
+
+class _Request:
+    __slots__ = ('priority', 'deadline', 'seq', 'kind', 'key', 'tick', 'prompt', 'kwargs',
+                 'future', 'enqueued_at', 'done')
+
+    def sort_key(self):
+        return (self.priority, self.deadline if self.deadline is not None else float('inf'), self.seq)
+
+    def __lt__(self, other):
+        return self.sort_key() < other.sort_key()
+
+
+class LLMScheduler:
+    """
+    Wraps an LLM client and exposes the same generate() call, so it can be
+    dropped in as NPC.llm_client.
+    """
+
+    def __init__(self, client, workers=4, max_queue=256, submit_timeout=30.0,
+                 default_deadlines=None, tick_bound_kinds=('action',)):
+        self.client = client
+        self.model = client.model
+        self.max_queue = max_queue
+        self.submit_timeout = submit_timeout
+        self.default_deadlines = dict(default_deadlines or {})
+        self.tick_bound_kinds = set(tick_bound_kinds)
+        self.current_tick = 0
+        self._heap = []
+        self._by_key = {}  # (key, kind) -> waiting request
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._waits = {kind: [0, 0.0, 0.0] for kind in PRIORITIES}  # count, total, max
+        self._counts = {'completed': 0, 'failed': 0, 'superseded': 0, 'expired': 0, 'stale': 0}
+        self._depth = 0
+        self._workers = [
+            threading.Thread(target=self._work, name=f'llm-scheduler-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, prompt, kind=DEFAULT_KIND, key=None, deadline=None, **kwargs):
+        """
+        Queues a request and returns a Future for the response text.
+        deadline is seconds from now; key identifies the requester (e.g. the
+        NPC's name) for superseding.
+        """
+        if kind not in PRIORITIES:
+            raise ValueError(f"kind must be one of {sorted(PRIORITIES)}")
+        if deadline is None:
+            deadline = self.default_deadlines.get(kind)
+        now = time.monotonic()
+
+        request = _Request()
+        request.priority = PRIORITIES[kind]
+        request.deadline = now + deadline if deadline is not None else None
+        request.seq = next(self._seq)
+        request.kind = kind
+        request.key = key
+        request.prompt = prompt
+        request.kwargs = kwargs
+        request.future = Future()
+        request.enqueued_at = now
+        request.done = False
+
+        with self._cond:
+            if self._closed:
+                raise LLMError("scheduler is closed")
+            if not self._cond.wait_for(lambda: self._depth < self.max_queue, timeout=self.submit_timeout):
+                raise SchedulerFull(f"LLM queue full ({self.max_queue} waiting)")
+            request.tick = self.current_tick
+            if key is not None:
+                previous = self._by_key.get((key, kind))
+                if previous is not None:
+                    self._drop(previous, 'superseded')
+                self._by_key[(key, kind)] = request
+            heapq.heappush(self._heap, request)
+            self._depth += 1
+            self._cond.notify_all()
+        return request.future
+
+    def generate(self, prompt, kind=DEFAULT_KIND, key=None, deadline=None, **kwargs):
+        """Blocking submit(); same return value and errors as LLMClient.generate."""
+        return self.submit(prompt, kind=kind, key=key, deadline=deadline, **kwargs).result()
+
+    def embed(self, texts, **kwargs):
+        return self.client.embed(texts, **kwargs)
+
+    def route(self, kind=None):
+        return self.client.route(kind)
+
+    @property
+    def calls(self):
+        """Requests handed to the client so far."""
+        with self._cond:
+            return self._counts['completed'] + self._counts['failed']
+
+    def advance_tick(self, tick):
+        """Starts a new tick and drops queued tick-bound work from earlier ones."""
+        with self._cond:
+            self.current_tick = tick
+            for request in list(self._heap):
+                if not request.done and request.kind in self.tick_bound_kinds and request.tick < tick:
+                    self._drop(request, 'stale')
+
+    def _drop(self, request, reason):
+        # Caller holds the lock. The entry stays in the heap and is skipped when popped.
+        request.done = True
+        self._depth -= 1
+        self._counts[reason] += 1
+        if request.key is not None and self._by_key.get((request.key, request.kind)) is request:
+            del self._by_key[(request.key, request.kind)]
+        request.future.set_exception(RequestDropped(f"{request.kind} request {reason}"))
+        self._cond.notify_all()
+
+    def _next(self):
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0].done:
+                    heapq.heappop(self._heap)
+                if self._heap:
+                    request = heapq.heappop(self._heap)
+                    now = time.monotonic()
+                    if request.deadline is not None and now > request.deadline:
+                        self._drop(request, 'expired')
+                        continue
+                    request.done = True
+                    self._depth -= 1
+                    if request.key is not None and self._by_key.get((request.key, request.kind)) is request:
+                        del self._by_key[(request.key, request.kind)]
+                    waits = self._waits[request.kind]
+                    wait = now - request.enqueued_at
+                    waits[0] += 1
+                    waits[1] += wait
+                    waits[2] = max(waits[2], wait)
+                    self._cond.notify_all()
+                    return request
+                if self._closed:
+                    return None
+                self._cond.wait()
+
+    def _work(self):
+        while True:
+            request = self._next()
+            if request is None:
+                return
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = self.client.generate(request.prompt, kind=request.kind, **request.kwargs)
+            except BaseException as e:
+                with self._cond:
+                    self._counts['failed'] += 1
+                request.future.set_exception(e)
+            else:
+                with self._cond:
+                    self._counts['completed'] += 1
+                request.future.set_result(result)
+
+    def stats(self):
+        with self._cond:
+            depth_by_kind = {kind: 0 for kind in PRIORITIES}
+            for request in self._heap:
+                if not request.done:
+                    depth_by_kind[request.kind] += 1
+            return {
+                'queue_depth': self._depth,
+                'depth_by_kind': depth_by_kind,
+                'wait_seconds': {
+                    kind: {
+                        'count': count,
+                        'mean': total / count if count else 0.0,
+                        'max': longest,
+                    }
+                    for kind, (count, total, longest) in self._waits.items()
+                },
+                **self._counts,
+            }
+
+    def close(self):
+        """Stops the workers after the queue drains."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
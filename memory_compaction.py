@@ -0,0 +1,247 @@
+# memory_compaction.py
+"""
+Compaction of long-term memory.
+
+Every conversation line writes a long-term memory ("Talked to George about
+weather", "Reacted to George"), so the table fills with near-duplicates.
+compact() folds each NPC's older raw memories into one counted row per
+group -- "Talked to George 37 times, mostly about weather" -- and keeps the
+newest keep_recent rows as they are. A group's row keeps its tallies in
+detail, so later passes add to it. It takes the id of the group's latest
+memory, which keeps ordering by id roughly chronological.
+
+The raw rows are archived before they are deleted. The archive is a
+separate SQLite file next to the database ("village-archive.db" for
+"village.db"), with one zlib-compressed JSON batch per NPC per pass, so the
+live database only holds what prompts use. load_archive() reads it back.
+A batch is keyed on its NPC and first id, so a pass that fails after
+archiving writes the same batch again when rerun instead of a duplicate.
+
+Each group of NPCs is read and rewritten under one write lock on the
+database, so writes that land during a pass are never lost. Compaction is
+still an offline job: run it between simulation runs, because a running
+process keeps memory windows and recall indexes that refer to the rows it
+deletes.
+
+    python memory_compaction.py --db village.db --keep-recent 50 --vacuum
+"""
+import argparse
+import json
+import os
+import re
+import zlib
+from collections import Counter
+
+import db
+import migrations
+
+KEEP_RECENT = 50
+NPCS_PER_TRANSACTION = 200
+
+TALKED = re.compile(r"^Talked to (.+?) about (.+)$")
+REACTED = re.compile(r"^Reacted to (.+)$")
+
+CREATE_ARCHIVE = '''
+    CREATE TABLE IF NOT EXISTS memory_archive (
+        id INTEGER PRIMARY KEY,
+        npc_name TEXT NOT NULL,
+        first_id INTEGER NOT NULL,
+        last_id INTEGER NOT NULL,
+        row_count INTEGER NOT NULL,
+        payload BLOB NOT NULL,
+        archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+CREATE_ARCHIVE_INDEX = '''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_memory_archive_batch ON memory_archive (npc_name, first_id)
+'''
+INSERT_ARCHIVE = '''
+    INSERT OR REPLACE INTO memory_archive (npc_name, first_id, last_id, row_count, payload) VALUES (?, ?, ?, ?, ?)
+'''
+NPC_MEMORIES = '''
+    SELECT id, memory, count, memory_key, detail FROM long_term_memory WHERE npc_name = ? ORDER BY id
+'''
+
+
+def archive_path_for(db_path):
+    root, extension = os.path.splitext(db_path)
+    return f"{root}-archive{extension or '.db'}"
+
+
+def group_key(memory):
+    """(key, topic) for a raw memory. Unrecognized memories group by exact text."""
+    match = TALKED.match(memory)
+    if match:
+        return f"talked:{match.group(1)}", match.group(2)
+    match = REACTED.match(memory)
+    if match:
+        return f"reacted:{match.group(1)}", None
+    return f"same:{memory}", None
+
+
+def render(key, count, detail):
+    kind, _, subject = key.partition(':')
+    if kind == 'talked':
+        topics = Counter(detail.get('topics', {}))
+        if count == 1 and topics:
+            return f"Talked to {subject} about {next(iter(topics))}"
+        text = f"Talked to {subject} {count} times"
+        if topics:
+            text += f", mostly about {topics.most_common(1)[0][0]}"
+        return text
+    if kind == 'reacted':
+        return f"Reacted to {subject}" if count == 1 else f"Reacted to {subject} {count} times"
+    return subject if count == 1 else f"{subject} ({count} times)"
+
+
+def plan_npc(rows, keep_recent=KEEP_RECENT, min_count=2):
+    """
+    Works out one NPC's compaction from its rows (id, memory, count, key,
+    detail) in id order. Returns (groups, archived) where groups maps key
+    to {'id', 'count', 'detail', 'memory', 'merged': [ids], 'existing': id
+    or None} and archived lists the raw rows being folded away.
+    """
+    raw = [row for row in rows if row[3] is None]
+    old = raw[:-keep_recent] if keep_recent else raw
+    existing = {row[3]: row for row in rows if row[3] is not None}
+
+    candidates = {}
+    for row in old:
+        key, topic = group_key(row[1])
+        group = candidates.setdefault(key, {'rows': [], 'topics': Counter()})
+        group['rows'].append(row)
+        if topic is not None:
+            group['topics'][topic] += row[2]
+
+    groups, archived = {}, []
+    for key, candidate in candidates.items():
+        previous = existing.get(key)
+        if previous is None and sum(row[2] for row in candidate['rows']) < min_count:
+            continue
+        detail = json.loads(previous[4]) if previous is not None and previous[4] else {}
+        topics = Counter(detail.get('topics', {}))
+        topics.update(candidate['topics'])
+        if topics:
+            detail['topics'] = dict(topics)
+        count = sum(row[2] for row in candidate['rows']) + (previous[2] if previous is not None else 0)
+        ids = [row[0] for row in candidate['rows']]
+        groups[key] = {
+            'id': max(ids + ([previous[0]] if previous is not None else [])),
+            'count': count,
+            'detail': detail,
+            'memory': render(key, count, detail),
+            'merged': ids,
+            'existing': previous[0] if previous is not None else None,
+        }
+        archived.extend(candidate['rows'])
+    archived.sort()
+    return groups, archived
+
+
+def _apply(conn, npc_name, groups):
+    stale = [group['existing'] for group in groups.values() if group['existing'] is not None]
+    removed = stale + [memory_id for group in groups.values() for memory_id in group['merged']]
+    # Vectors of removed rows go too; load_index re-embeds the new rows when next needed.
+    conn.executemany('DELETE FROM long_term_memory_embeddings WHERE memory_id = ?', ((i,) for i in removed))
+    conn.executemany('DELETE FROM long_term_memory WHERE id = ?', ((i,) for i in removed))
+    conn.executemany('''
+        INSERT INTO long_term_memory (id, npc_name, memory, count, memory_key, detail) VALUES (?, ?, ?, ?, ?, ?)
+    ''', [
+        (group['id'], npc_name, group['memory'], group['count'], key, json.dumps(group['detail']))
+        for key, group in groups.items()
+    ])
+    return len(removed) - len(groups)
+
+
+def _archive(conn, npc_name, rows):
+    payload = zlib.compress(json.dumps([[row[0], row[1], row[2]] for row in rows]).encode('utf-8'))
+    conn.execute(INSERT_ARCHIVE, (npc_name, rows[0][0], rows[-1][0], len(rows), payload))
+
+
+def compact(db_path=db.DEFAULT_DB_PATH, keep_recent=KEEP_RECENT, min_count=2, npc_names=None,
+            archive_path=None, archive=True):
+    """
+    Compacts the long-term memories of npc_names (default: every NPC with
+    memories). Each batch of NPCs is planned, archived and rewritten while
+    holding the database's write lock. Returns counts of what changed.
+    """
+    migrations.migrate(db_path)
+    if npc_names is None:
+        npc_names = [row[0] for row in db.query_all('SELECT DISTINCT npc_name FROM long_term_memory', db_path=db_path)]
+    archive_path = archive_path or archive_path_for(db_path)
+    if archive:
+        with db.transaction(archive_path) as conn:
+            conn.execute(CREATE_ARCHIVE)
+            conn.execute(CREATE_ARCHIVE_INDEX)
+
+    stats = {'npcs': 0, 'rows_before': 0, 'rows_removed': 0, 'rows_archived': 0, 'groups': 0}
+    conn = db.get_connection(db_path)
+    for start in range(0, len(npc_names), NPCS_PER_TRANSACTION):
+        # IMMEDIATE takes the write lock before planning, so no memory can be
+        # added between reading a batch and rewriting it.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            plans = []
+            for npc_name in npc_names[start:start + NPCS_PER_TRANSACTION]:
+                rows = conn.execute(NPC_MEMORIES, (npc_name,)).fetchall()
+                stats['rows_before'] += len(rows)
+                groups, archived = plan_npc(rows, keep_recent, min_count)
+                if groups:
+                    plans.append((npc_name, groups, archived))
+            # The archive commits first: if the rewrite then fails, the rows are
+            # still live and a rerun replaces the same batches.
+            if plans and archive:
+                with db.transaction(archive_path) as archive_conn:
+                    for npc_name, _, archived in plans:
+                        _archive(archive_conn, npc_name, archived)
+            for npc_name, groups, archived in plans:
+                stats['rows_removed'] += _apply(conn, npc_name, groups)
+                stats['rows_archived'] += len(archived)
+                stats['groups'] += len(groups)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        stats['npcs'] += len(plans)
+    stats['rows_after'] = stats['rows_before'] - stats['rows_removed']
+    return stats
+
+
+def load_archive(npc_name, archive_path=None, db_path=db.DEFAULT_DB_PATH):
+    """Every archived raw memory of npc_name as (id, memory, count), oldest first."""
+    archive_path = archive_path or archive_path_for(db_path)
+    if not os.path.exists(archive_path):
+        return []
+    rows = db.query_all(
+        'SELECT payload FROM memory_archive WHERE npc_name = ? ORDER BY first_id', (npc_name,), archive_path
+    )
+    return [tuple(entry) for (payload,) in rows for entry in json.loads(zlib.decompress(payload))]
+
+
+def vacuum(db_path=db.DEFAULT_DB_PATH):
+    """Gives the space freed by compaction back to the file system."""
+    db.get_connection(db_path).execute('VACUUM')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=db.DEFAULT_DB_PATH)
+    parser.add_argument('--keep-recent', type=int, default=KEEP_RECENT, help="raw memories kept per NPC")
+    parser.add_argument('--min-count', type=int, default=2, help="smallest group worth a counted row")
+    parser.add_argument('--archive', default=None, help="archive file (default: <db>-archive.db)")
+    parser.add_argument('--no-archive', action='store_true', help="drop compacted rows instead of archiving them")
+    parser.add_argument('--vacuum', action='store_true', help="shrink the database file afterwards")
+    args = parser.parse_args(argv)
+
+    before = os.path.getsize(args.db) if os.path.exists(args.db) else 0
+    stats = compact(args.db, args.keep_recent, args.min_count, archive_path=args.archive, archive=not args.no_archive)
+    if args.vacuum:
+        vacuum(args.db)
+    stats['file_bytes_before'] = before
+    stats['file_bytes_after'] = os.path.getsize(args.db)
+    for key, value in stats.items():
+        print(f"{key:<18} {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# memory_consolidation.py
+"""
+Background consolidation of short-term memory into a rolling summary.
+
+When an NPC's short-term buffer fills up, the oldest entries are handed to a
+ConsolidationWorker. The worker asks the model to fold them into the NPC's
+rolling summary on its own thread, so the tick never waits on a summarization
+call. Prompts read whatever summary is current.
+"""
+import queue
+import threading
+
+import db
+
+
+def load_summary(npc_name, db_path=db.DEFAULT_DB_PATH):
+    row = db.query_one('SELECT summary FROM memory_summaries WHERE npc_name = ?', (npc_name,), db_path)
+    return row[0] if row else ""
+
+
+def load_summaries(db_path=db.DEFAULT_DB_PATH):
+    return dict(db.query_all('SELECT npc_name, summary FROM memory_summaries', db_path=db_path))
+
+
+def save_summary(npc_name, summary, db_path=db.DEFAULT_DB_PATH):
+    with db.transaction(db_path) as conn:
+        conn.execute('''
+            INSERT INTO memory_summaries (npc_name, summary, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (npc_name) DO UPDATE SET summary = excluded.summary, updated_at = excluded.updated_at
+        ''', (npc_name, summary))
+
+
+class ConsolidationWorker:
+    """
+    Folds memories into NPC summaries on a single background thread.
+
+    Jobs for an NPC that already has one waiting are merged into it, so a slow
+    model means fewer, larger summarization calls instead of a growing queue.
+    A failed fold puts its memories back and queues the NPC again, up to
+    max_attempts times in a row, since they are no longer in short-term memory.
+    """
+
+    def __init__(self, max_attempts=3):
+        self.max_attempts = max_attempts
+        self._queue = queue.Queue()
+        self._pending = {}  # npc -> memories waiting to be folded
+        self._attempts = {}  # npc -> failed folds in a row
+        self._lock = threading.Lock()
+        self._thread = None
+        self.completed = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='memory-consolidation', daemon=True)
+            self._thread.start()
+
+    def submit(self, npc, memories):
+        if not memories:
+            return
+        with self._lock:
+            if npc in self._pending:
+                self._pending[npc].extend(memories)
+                return
+            self._pending[npc] = list(memories)
+            self._ensure_started()
+        self._queue.put(npc)
+
+    def _run(self):
+        while True:
+            npc = self._queue.get()
+            try:
+                if npc is None:
+                    return
+                with self._lock:
+                    memories = self._pending.pop(npc, [])
+                try:
+                    npc.fold_into_summary(memories)
+                    self.completed += 1
+                    with self._lock:
+                        self._attempts.pop(npc, None)
+                except Exception as e:
+                    self.failed += 1
+                    self._retry(npc, memories, e)
+            finally:
+                self._queue.task_done()
+
+    def _retry(self, npc, memories, error):
+        with self._lock:
+            attempts = self._attempts[npc] = self._attempts.get(npc, 0) + 1
+            if attempts >= self.max_attempts:
+                del self._attempts[npc]
+                print(f"Error consolidating memories for {npc.name}, dropping {len(memories)} after "
+                      f"{attempts} attempts:", error)
+                return
+            print(f"Error consolidating memories for {npc.name}, retrying:", error)
+            # A submit() since the pop has already queued the NPC; just go first.
+            queued = npc in self._pending
+            self._pending.setdefault(npc, [])[:0] = memories
+        if not queued:
+            self._queue.put(npc)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def drain(self):
+        """Blocks until every submitted job has been folded."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
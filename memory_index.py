@@ -0,0 +1,181 @@
+# memory_index.py
+"""
+Embedding-based retrieval over an NPC's long-term memories.
+
+Each memory is embedded once, when it is written, and kept as a row of a
+per-NPC NumPy matrix. Vectors are persisted in long_term_memory_embeddings,
+keyed by the long_term_memory row they belong to. Prompts pull the top-k
+memories most similar to the current input instead of the most recent ones,
+so prompt size stays flat however long the history gets.
+"""
+import hashlib
+import re
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+import db
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+class HashingEmbedder:
+    """
+    Deterministic bag-of-words embedder using the signed hashing trick over
+    words and word bigrams. No model needed, so it works offline and in tests.
+    """
+
+    def __init__(self, dim=256):
+        if np is None:
+            raise ImportError("HashingEmbedder requires numpy (pip install numpy)")
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text):
+        words = TOKEN_PATTERN.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], 'little') % self.dim
+                sign = 1.0 if digest[4] & 1 else -1.0
+                vectors[row, bucket] += sign
+        return normalize(vectors)
+
+
+class OllamaEmbedder:
+    """Embeds through an Ollama embedding model via the shared LLMClient."""
+
+    def __init__(self, client, model='nomic-embed-text'):
+        if np is None:
+            raise ImportError("OllamaEmbedder requires numpy (pip install numpy)")
+        self.client = client
+        self.model = model
+        self.name = f"ollama-{model}"
+        self.dim = None
+
+    def embed(self, texts):
+        vectors = np.asarray(self.client.embed(list(texts), model=self.model), dtype=np.float32)
+        if len(texts) and self.dim is None:
+            self.dim = vectors.shape[1]
+        return normalize(vectors.reshape(len(texts), -1))
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class MemoryIndex:
+    """
+    Unit-length memory vectors in a growable matrix, searched by cosine
+    similarity. With max_size, adding to a full index drops the oldest.
+    """
+
+    def __init__(self, embedder, max_size=None):
+        self.embedder = embedder
+        self.max_size = max_size
+        self.texts = []
+        self._matrix = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, text, vector):
+        if self.max_size is not None and self._size >= self.max_size:
+            self._matrix[:self._size - 1] = self._matrix[1:self._size]
+            del self.texts[0]
+            self._size -= 1
+        if self._matrix is None:
+            self._matrix = np.zeros((16, len(vector)), dtype=np.float32)
+        elif self._size == len(self._matrix):
+            grown = np.zeros((len(self._matrix) * 2, self._matrix.shape[1]), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+        self._matrix[self._size] = vector
+        self.texts.append(text)
+        self._size += 1
+
+    def add_many(self, texts, vectors):
+        for text, vector in zip(texts, vectors):
+            self.add(text, vector)
+
+    def search(self, query, k=5):
+        """Returns up to k (memory, score) pairs, best first."""
+        if not self._size or k <= 0:
+            return []
+        query_vector = self.embedder.embed([query])[0]
+        scores = self._matrix[:self._size] @ query_vector
+        k = min(k, self._size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.texts[i], float(scores[i])) for i in top]
+
+
+def vector_to_blob(vector):
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def blob_to_vector(blob):
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+INSERT_EMBEDDING = '''
+    INSERT OR REPLACE INTO long_term_memory_embeddings (memory_id, npc_name, embedder, vector)
+    VALUES (?, ?, ?, ?)
+'''
+
+
+def load_index(npc_name, embedder, db_path=db.DEFAULT_DB_PATH, limit=None, write_buffer=None):
+    """
+    Builds an NPC's index from the database, from the newest limit memories
+    if limit is given. Memories without a stored vector for this embedder
+    (older rows, compacted rows, or a different embedder) are embedded now
+    and written back, so this backfill happens once. With a write_buffer
+    the vectors are queued on it instead of written straight away.
+    """
+    rows = db.query_all('''
+        SELECT id, memory, vector FROM (
+            SELECT m.id, m.memory, e.vector
+            FROM long_term_memory m
+            LEFT JOIN long_term_memory_embeddings e
+                ON e.memory_id = m.id AND e.embedder = ?
+            WHERE m.npc_name = ?
+            ORDER BY m.id DESC
+            LIMIT ?
+        ) ORDER BY id
+    ''', (embedder.name, npc_name, -1 if limit is None else limit), db_path)
+
+    missing = [(memory_id, memory) for memory_id, memory, blob in rows if blob is None]
+    fresh = {}
+    if missing:
+        vectors = embedder.embed([memory for _, memory in missing])
+        fresh = {memory_id: vector for (memory_id, _), vector in zip(missing, vectors)}
+        backfill = [
+            (memory_id, npc_name, embedder.name, vector_to_blob(vector)) for memory_id, vector in fresh.items()
+        ]
+        if write_buffer is not None:
+            write_buffer.add_embeddings(backfill)
+        else:
+            with db.transaction(db_path) as conn:
+                conn.executemany(INSERT_EMBEDDING, backfill)
+
+    index = MemoryIndex(embedder, max_size=limit)
+    for memory_id, memory, blob in rows:
+        vector = fresh[memory_id] if blob is None else blob_to_vector(blob)
+        index.add(memory, vector)
+    return index
+
+
+def save_memory(npc_name, memory, vector, embedder, db_path=db.DEFAULT_DB_PATH):
+    """Inserts a long-term memory and its vector in one transaction."""
+    with db.transaction(db_path) as conn:
+        cursor = conn.execute('INSERT INTO long_term_memory (npc_name, memory) VALUES (?, ?)', (npc_name, memory))
+        conn.execute(INSERT_EMBEDDING, (cursor.lastrowid, npc_name, embedder.name, vector_to_blob(vector)))
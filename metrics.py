@@ -0,0 +1,184 @@
+# metrics.py
+"""
+Counters, histograms and timing spans for the hot paths.
+
+Off by default; set DIGIDORF_METRICS=1 (or call enable()) to turn it on.
+When off, inc() and observe() return at once and span() hands back a shared
+no-op context manager, so the instrumented code pays one flag check.
+
+Metrics live in this process. The simulation publishes a snapshot to the
+database (db.save_metrics_snapshot) and the dashboard's /metrics endpoint
+renders its own metrics plus every published snapshot in the Prometheus
+text format, one source label per process.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+
+TIME_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+_enabled = os.environ.get('DIGIDORF_METRICS', '') not in ('', '0')
+_lock = threading.Lock()
+_metrics = {}  # (name, ((label, value), ...)) -> Counter | Histogram
+
+
+def enabled():
+    return _enabled
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def reset():
+    with _lock:
+        _metrics.clear()
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def to_dict(self):
+        return {'value': self.value}
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+
+def _get(name, labels, factory):
+    key = (name, tuple(sorted(labels.items())))
+    metric = _metrics.get(key)
+    if metric is None:
+        metric = _metrics.setdefault(key, factory())
+    return metric
+
+
+def inc(name, amount=1, **labels):
+    if not _enabled:
+        return
+    with _lock:
+        _get(name, labels, Counter).value += amount
+
+
+def observe(name, value, buckets=TIME_BUCKETS, **labels):
+    if not _enabled:
+        return
+    with _lock:
+        _get(name, labels, lambda: Histogram(buckets)).observe(value)
+
+
+class _Span:
+    __slots__ = ('name', 'labels', 'started')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **labels):
+    """Times the with-block into the histogram name (seconds)."""
+    if not _enabled:
+        return _NO_SPAN
+    return _Span(name, labels)
+
+
+def snapshot():
+    """A JSON-serializable copy of every metric in this process."""
+    with _lock:
+        return [
+            {'name': name, 'labels': dict(labels), 'kind': metric.kind, **metric.to_dict()}
+            for (name, labels), metric in _metrics.items()
+        ]
+
+
+def summary():
+    """{'name{label=value}': total or {'count', 'mean'}} for quick reports."""
+    result = {}
+    for sample in snapshot():
+        labels = ",".join(f"{key}={value}" for key, value in sorted(sample['labels'].items()))
+        key = f"{sample['name']}{{{labels}}}" if labels else sample['name']
+        if sample['kind'] == 'counter':
+            result[key] = sample['value']
+        else:
+            mean = sample['sum'] / sample['count'] if sample['count'] else 0.0
+            result[key] = {'count': sample['count'], 'mean': mean}
+    return result
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+
+def render(sources):
+    """
+    Prometheus text exposition of {source: snapshot}. Each sample gets a
+    source label; samples are grouped under one TYPE line per metric name.
+    """
+    by_name = {}
+    for source, samples in sources.items():
+        for sample in samples:
+            by_name.setdefault(sample['name'], []).append((source, sample))
+
+    lines = []
+    for name in sorted(by_name):
+        samples = by_name[name]
+        kind = samples[0][1]['kind']
+        lines.append(f"# TYPE {name} {kind}")
+        for source, sample in samples:
+            labels = {'source': source, **sample['labels']}
+            if kind == 'counter':
+                lines.append(f"{name}{_format_labels(labels)} {sample['value']}")
+                continue
+            cumulative = 0
+            for bound, count in zip(sample['buckets'] + ['+Inf'], sample['counts']):
+                cumulative += count
+                le = bound if bound == '+Inf' else repr(float(bound))
+                lines.append(f"{name}_bucket{_format_labels({**labels, 'le': le})} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {sample['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {sample['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,151 @@
+# migrations.py
+"""
+Versioned schema for village.db.
+
+The applied version lives in SQLite's user_version pragma. migrate() applies
+whatever is missing, each step in its own transaction, and remembers per
+process which databases are already current so repeat calls are free.
+"""
+import threading
+
+import db
+
+MIGRATIONS = [
+    (1, (
+        '''
+        CREATE TABLE IF NOT EXISTS npcs (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            personality TEXT NOT NULL,
+            backstory TEXT NOT NULL,
+            current_location TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS long_term_memory (
+            id INTEGER PRIMARY KEY,
+            npc_name TEXT NOT NULL,
+            memory TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS interactions (
+            id INTEGER PRIMARY KEY,
+            speaker_id INTEGER,
+            listener_id INTEGER,
+            interaction_type TEXT,
+            content TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (speaker_id) REFERENCES npcs (id),
+            FOREIGN KEY (listener_id) REFERENCES npcs (id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS actions (
+            id INTEGER PRIMARY KEY,
+            npc_id INTEGER,
+            location TEXT,
+            action TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (npc_id) REFERENCES npcs (id)
+        )
+        ''',
+    )),
+    (2, (
+        # Without a unique constraint INSERT OR IGNORE let duplicates in;
+        # keep the first row per name, which is the one get_npc_id returned.
+        'DELETE FROM npcs WHERE id NOT IN (SELECT MIN(id) FROM npcs GROUP BY name)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_npcs_name ON npcs (name)',
+        'CREATE INDEX IF NOT EXISTS idx_long_term_memory_npc_name ON long_term_memory (npc_name)',
+        'CREATE INDEX IF NOT EXISTS idx_interactions_timestamp ON interactions (timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_actions_timestamp ON actions (timestamp)',
+    )),
+    (3, (
+        '''
+        CREATE TABLE IF NOT EXISTS long_term_memory_embeddings (
+            memory_id INTEGER PRIMARY KEY,
+            npc_name TEXT NOT NULL,
+            embedder TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            FOREIGN KEY (memory_id) REFERENCES long_term_memory (id)
+        )
+        ''',
+    )),
+    (4, (
+        '''
+        CREATE TABLE IF NOT EXISTS memory_summaries (
+            npc_name TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    )),
+    (5, (
+        '''
+        CREATE TABLE IF NOT EXISTS metrics_snapshots (
+            source TEXT PRIMARY KEY,
+            payload TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    )),
+    (6, (
+        '''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    )),
+    (7, (
+        # Keyset paging filtered by NPC or location (see history.py).
+        'CREATE INDEX IF NOT EXISTS idx_actions_npc_time ON actions (npc_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_actions_location_time ON actions (location, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_interactions_speaker_time ON interactions (speaker_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_interactions_listener_time ON interactions (listener_id, timestamp)',
+    )),
+    (8, (
+        # Compacted memories (see memory_compaction.py): one row stands for
+        # count raw ones; memory_key names the group and detail holds its tallies.
+        'ALTER TABLE long_term_memory ADD COLUMN count INTEGER NOT NULL DEFAULT 1',
+        'ALTER TABLE long_term_memory ADD COLUMN memory_key TEXT',
+        'ALTER TABLE long_term_memory ADD COLUMN detail TEXT',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_long_term_memory_key ON long_term_memory (npc_name, memory_key) '
+        'WHERE memory_key IS NOT NULL',
+    )),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+_migrated = set()
+_lock = threading.Lock()
+
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(db_path=db.DEFAULT_DB_PATH):
+    """Brings db_path up to LATEST_VERSION. Safe to call from several processes."""
+    with _lock:
+        if db_path in _migrated:
+            return
+        conn = db.get_connection(db_path)
+        for version, statements in MIGRATIONS:
+            if get_version(conn) >= version:
+                continue
+            # IMMEDIATE takes the write lock before re-checking, so two processes
+            # starting together don't both apply the same step.
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if get_version(conn) < version:
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(f'PRAGMA user_version = {version}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        _migrated.add(db_path)
@@ -1,164 +1,222 @@
 # npc.py
-import sqlite3
 from datetime import datetime
-import subprocess
 import json
 import random  # Add this import at the top of the file
+from llm_client import LLMClient, LLMError
+import metrics
+from llm_scheduler import RequestDropped
+from llm_cache import ResponseCache
+import db
+import migrations
+import memory_index
+from memory_consolidation import ConsolidationWorker, load_summary, save_summary
+from prompt_builder import PromptBuilder, count_tokens
+
+TOPICS = ["weather", "village news", "hobbies", "food", "family"]
 
 class NPC:
-    db_path = 'village.db'  # Class-level attribute for database path
+    db_path = db.DEFAULT_DB_PATH  # Class-level attribute for database path
+    llm_client = LLMClient()  # Shared by every NPC so connections stay warm
+    prompt_builder = PromptBuilder()  # Token budgets and the cached persona prefix
+    response_cache = ResponseCache(variants=3)  # Set to None to always ask the model
+    write_buffer = None  # Optional WriteBuffer; None writes each row straight away
+    # Embeds long-term memories for relevance-based recall; None keeps the
+    # plain most-recent summary. Swap in an OllamaEmbedder for semantic recall.
+    embedder = memory_index.HashingEmbedder() if memory_index.np is not None else None
+    memory_recall_k = 5
+    memory_recall_limit = 500  # Vectors kept in the recall index; older ones drop out
+    long_term_memory_window = 50  # Newest long-term memories held in RAM; older_memories() fetches the rest
+    short_term_memory_limit = 20  # Oldest half is consolidated once this many entries pile up
+    consolidator = ConsolidationWorker()  # Set to None to summarize inline
+    _world = None  # WorldState this NPC is a view over, if any
+    _world_index = None
+    _recall_index = None
 
     def __init__(self, name, personality, backstory):
+        self._init_state(name, personality, backstory)
+        self.initialize_database()
+        self.initialize_npc()
+        self.load_long_term_memory()
+        self.rolling_summary = load_summary(self.name, self.db_path)
+        self.id = self.get_npc_id()  # Set the id attribute
+
+    def _init_state(self, name, personality, backstory, current_location="Town Square"):
         self.name = name
         self.personality = personality
         self.backstory = backstory
-        self.current_location = "Town Square"  # Default location
+        self.current_location = current_location  # Default location
         self.short_term_memory = []
         self.long_term_memory = []
-        self.initialize_database()
-        self.initialize_npc()
-        self.load_long_term_memory()
-        self.id = self.get_npc_id()  # Set the id attribute
+        self.rolling_summary = ""
+        self.id = None
+
+    @property
+    def current_location(self):
+        if self._world is not None:
+            return self._world.location_name(self._world_index)
+        return self._current_location
+
+    @current_location.setter
+    def current_location(self, location):
+        if self._world is not None:
+            self._world.set_location(self._world_index, location)
+        else:
+            self._current_location = location
+
+    @classmethod
+    def from_record(cls, npc_id, name, personality, backstory, current_location="Town Square",
+                    long_term_memory=None, rolling_summary=""):
+        """
+        Builds an NPC from rows that were already loaded, without any database
+        round trips. Used by the bulk population loader.
+        """
+        npc = cls.__new__(cls)
+        npc._init_state(name, personality, backstory, current_location)
+        npc.long_term_memory = list(long_term_memory or [])[-cls.long_term_memory_window:]
+        npc.rolling_summary = rolling_summary
+        npc.id = npc_id
+        return npc
 
     @classmethod
     def initialize_database(cls):
-        conn = sqlite3.connect(cls.db_path)
-        cursor = conn.cursor()
-        
-        # Create the npcs table if it doesn't exist
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS npcs (
-            id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL,
-            personality TEXT NOT NULL,
-            backstory TEXT NOT NULL,
-            current_location TEXT NOT NULL
-        )
-        ''')
-        
-        # Create the long_term_memory table if it doesn't exist
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS long_term_memory (
-            id INTEGER PRIMARY KEY,
-            npc_name TEXT NOT NULL,
-            memory TEXT NOT NULL
-        )
-        ''')
-        
-        # Drop and recreate the interactions table
-        cursor.execute('DROP TABLE IF EXISTS interactions')
-        cursor.execute('''
-        CREATE TABLE interactions (
-            id INTEGER PRIMARY KEY,
-            speaker_id INTEGER,
-            listener_id INTEGER,
-            interaction_type TEXT,
-            content TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (speaker_id) REFERENCES npcs (id),
-            FOREIGN KEY (listener_id) REFERENCES npcs (id)
-        )
-        ''')
-
-        # Create the actions table
-        cursor.execute('DROP TABLE IF EXISTS actions')
-        cursor.execute('''
-        CREATE TABLE actions (
-            id INTEGER PRIMARY KEY,
-            npc_id INTEGER,
-            location TEXT,
-            action TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (npc_id) REFERENCES npcs (id)
-        )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        """
+        Applies any pending schema migrations. Runs once per process and
+        database; later calls return immediately and never touch history.
+        """
+        migrations.migrate(cls.db_path)
 
     def initialize_npc(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         # Insert NPC into the database if not exists
-        cursor.execute('''
-            INSERT OR IGNORE INTO npcs (name, personality, backstory, current_location)
-            VALUES (?, ?, ?, ?)
-        ''', (self.name, self.personality, self.backstory, self.current_location))
-        conn.commit()
-        conn.close()
+        with db.transaction(self.db_path) as conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO npcs (name, personality, backstory, current_location)
+                VALUES (?, ?, ?, ?)
+            ''', (self.name, self.personality, self.backstory, self.current_location))
 
     def get_npc_id(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT id FROM npcs WHERE name = ?', (self.name,))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else None
+        return db.get_npc_id(self.name, self.db_path)
 
     def load_long_term_memory(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT memory FROM long_term_memory WHERE npc_name = ?', (self.name,))
-        memories = cursor.fetchall()
-        self.long_term_memory = [memory[0] for memory in memories]
-        conn.close()
+        memories = db.query_all(
+            'SELECT memory FROM long_term_memory WHERE npc_name = ? ORDER BY id DESC LIMIT ?',
+            (self.name, self.long_term_memory_window), self.db_path
+        )
+        self.long_term_memory = [memory[0] for memory in reversed(memories)]
+
+    def older_memories(self, limit=50, offset=None):
+        """
+        Long-term memories from the database, newest first, skipping offset
+        of them (by default as many as are held in RAM). Compacted groups
+        come back as their counted summary; see memory_compaction.load_archive
+        for the raw rows behind them.
+        """
+        if offset is None:
+            offset = len(self.long_term_memory)
+        rows = db.query_all(
+            'SELECT memory FROM long_term_memory WHERE npc_name = ? ORDER BY id DESC LIMIT ? OFFSET ?',
+            (self.name, limit, offset), self.db_path
+        )
+        return [row[0] for row in rows]
 
     def save_long_term_memory(self, memory):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO long_term_memory (npc_name, memory) VALUES (?, ?)', (self.name, memory))
-        conn.commit()
-        conn.close()
+        if self.embedder is not None:
+            vector = self.embedder.embed([memory])[0]
+            self.get_recall_index().add(memory, vector)
+            if self.write_buffer is not None:
+                self.write_buffer.add_memory(
+                    self.name, memory, self.embedder.name, memory_index.vector_to_blob(vector)
+                )
+            else:
+                memory_index.save_memory(self.name, memory, vector, self.embedder, self.db_path)
+            return
+        if self.write_buffer is not None:
+            self.write_buffer.add_memory(self.name, memory)
+            return
+        with db.transaction(self.db_path) as conn:
+            conn.execute('INSERT INTO long_term_memory (npc_name, memory) VALUES (?, ?)', (self.name, memory))
+
+    def get_recall_index(self):
+        """Loads this NPC's newest memory vectors on first use."""
+        if self._recall_index is None:
+            self._recall_index = memory_index.load_index(
+                self.name, self.embedder, self.db_path, limit=self.memory_recall_limit,
+                write_buffer=self.write_buffer,
+            )
+        return self._recall_index
+
+    def recall(self, query, k=None):
+        """Returns the k long-term memories most relevant to query, best first."""
+        if self.embedder is None:
+            return []
+        k = self.memory_recall_k if k is None else k
+        # Over-fetch so repeated memories don't crowd out distinct ones.
+        with metrics.span('memory_recall_seconds'):
+            matches = self.get_recall_index().search(query, k * 3)
+        return list(dict.fromkeys(memory for memory, _ in matches))[:k]
 
     def add_to_memory(self, entry, memory_type='short'):
         if memory_type == 'short':
             self.short_term_memory.append(entry)
+            if len(self.short_term_memory) >= self.short_term_memory_limit:
+                self.transfer_to_long_term_memory()
         elif memory_type == 'long':
             self.long_term_memory.append(entry)
+            if len(self.long_term_memory) > self.long_term_memory_window:
+                del self.long_term_memory[0]
             self.save_long_term_memory(entry)
 
     def transfer_to_long_term_memory(self):
         # Transfer the oldest half of short-term memories to long-term
         transfer_count = len(self.short_term_memory) // 2
         transferred_memories = self.short_term_memory[:transfer_count]
-        self.short_term_memory = self.short_term_memory[transfer_count:]
-        
-        # Summarize transferred memories before adding to long-term
-        summary = self.summarize_memories(transferred_memories)
-        self.long_term_memory.append(summary)
-        self.save_long_term_memory()
+        del self.short_term_memory[:transfer_count]
 
-    def summarize_memories(self, memories):
-        # Use LLM to summarize memories
-        prompt = f"""
-        Summarize the following memories in a concise paragraph:
-        {self.format_memory(memories)}
-        Summary:
+        # Fold them into the rolling summary off the tick path when possible
+        if self.consolidator is not None:
+            self.consolidator.submit(self, transferred_memories)
+        else:
+            self.fold_into_summary(transferred_memories)
+
+    def fold_into_summary(self, memories):
+        """
+        Merges memories into the rolling summary and persists it. A failed LLM
+        call raises and leaves the current summary in place.
         """
-        return self.call_llm(prompt)
+        if not memories:
+            return
+        summary = self.summarize_memories(memories)
+        self.rolling_summary = summary
+        if self.write_buffer is not None:
+            self.write_buffer.add_summary(self.name, summary)
+        else:
+            save_summary(self.name, summary, self.db_path)
+
+    def summarize_memories(self, memories):
+        # Use LLM to summarize memories, on top of what is already summarized
+        prompt = self.prompt_builder.build(
+            self,
+            "Update the summary of earlier events with the recent events, in one concise paragraph.",
+            summary=self.rolling_summary or "Nothing yet.",
+            recent=memories,
+        )
+        return self.generate(prompt, kind='summary')
 
     def generate_prompt(self, user_input):
         """
         Generates a prompt for the LLM based on the NPC's current state and memories.
         """
-        summarized_long_term = self.summarize_long_term_memory()
+        relevant = self.recall(user_input)
+        if not relevant and self.long_term_memory:
+            relevant = [self.summarize_long_term_memory()]
 
-        prompt = f"""
-        You are {self.name}, a {self.personality}.
-        Backstory: {self.backstory}
-        Current mood: {self.get_current_mood()}
-        
-        Recent memories:
-        {self.format_memory(self.short_term_memory)}
-        
-        Long-term memories (summarized):
-        {summarized_long_term}
-        
-        Interaction with User:
-        User: {user_input}
-        {self.name}:
-        """
-        return prompt
+        return self.prompt_builder.build(
+            self,
+            f"User: {user_input}",
+            mood=self.get_current_mood(),
+            summary=self.rolling_summary,
+            memories=relevant,
+            recent=self.short_term_memory,
+        )
 
     def summarize_long_term_memory(self):
         """
@@ -186,23 +244,45 @@ class NPC:
         """
         return "\n".join([f"- {mem}" for mem in memory_list])
 
-    def call_llm(self, prompt):
+    def generate(self, prompt, format=None, kind='action'):
+        """
+        Calls the local Ollama Phi3 model with the given prompt and raises on failure.
+        Goes through the shared pooled HTTP client rather than the ollama CLI,
+        with the response cache in front of it when one is configured.
+        Pass format='json' for structured output. kind ('dialogue', 'action'
+        or 'summary') sets the request's priority when llm_client is an
+        LLMScheduler.
+        """
+        def ask_model():
+            if not metrics.enabled():
+                return self.llm_client.generate(prompt, format=format, kind=kind, key=self.name)
+            metrics.inc('llm_calls_total', kind=kind)
+            metrics.observe('llm_prompt_tokens', count_tokens(prompt), metrics.SIZE_BUCKETS, kind=kind)
+            with metrics.span('llm_call_seconds', kind=kind):
+                response = self.llm_client.generate(prompt, format=format, kind=kind, key=self.name)
+            metrics.observe('llm_response_tokens', count_tokens(response), metrics.SIZE_BUCKETS, kind=kind)
+            return response
+
+        if self.response_cache is None:
+            return ask_model()
+        return self.response_cache.get_or_generate(prompt, self.llm_client.route(kind), ask_model)
+
+    def call_llm(self, prompt, kind='action'):
         """
-        Calls the local Ollama Phi3 model with the given prompt.
-        Assumes Ollama can be invoked via command line and returns the output.
+        Like generate(), but returns an in-character apology instead of raising.
+        Returns None if the scheduler dropped the request as no longer needed.
         """
         try:
-            result = subprocess.run(
-                ['ollama', 'run', 'phi3', prompt],
-                capture_output=True,
-                text=True,
-                timeout=30  # seconds
-            )
-            if result.returncode != 0:
-                print("Error calling LLM:", result.stderr)
-                return "I'm sorry, I couldn't process that."
-            return result.stdout.strip()
+            return self.generate(prompt, kind=kind)
+        except RequestDropped:
+            metrics.inc('llm_dropped_total', kind=kind)
+            return None
+        except LLMError as e:
+            metrics.inc('llm_errors_total', kind=kind)
+            print("Error calling LLM:", e)
+            return "I'm sorry, I couldn't process that."
         except Exception as e:
+            metrics.inc('llm_errors_total', kind=kind)
             print("Exception during LLM call:", e)
             return "I'm sorry, something went wrong."
 
@@ -210,67 +290,74 @@ class NPC:
         # Update memories
         self.add_to_memory(f"User: {user_input}")
         prompt = self.generate_prompt(user_input)
-        response = self.call_llm(prompt)
+        response = self.call_llm(prompt, kind='dialogue')
         self.add_to_memory(f"{self.name}: {response}")
         self.log_interaction(user_input, response)
         return response
 
-    def log_interaction(self, action, details):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
+    def log_interaction(self, action, details, listener=None):
+        listener_id = listener.id if listener is not None else None
+        if self.write_buffer is not None:
+            self.write_buffer.add_interaction(self.id, listener_id, action, details)
+            return
+        with db.transaction(self.db_path) as conn:
+            conn.execute('''
                 INSERT INTO interactions (speaker_id, listener_id, interaction_type, content)
                 VALUES (?, ?, ?, ?)
-            ''', (self.id, None, action, details))
-            conn.commit()
+            ''', (self.id, listener_id, action, details))
 
     def interact_with(self, other_npc, topic=None):
         if topic is None:
-            topics = ["weather", "village news", "hobbies", "food", "family"]
-            topic = random.choice(topics)
-        
-        prompt = f"""
-        You are {self.name}, a {self.personality}.
-        You're talking to {other_npc.name}, a {other_npc.personality}, about {topic}.
-        Say something brief (5-10 words) to start the conversation.
-        {self.name}:
-        """
+            topic = random.choice(TOPICS)
         
-        response = self.call_llm(prompt)
+        prompt = self.prompt_builder.build(
+            self,
+            f"You're talking to {other_npc.name}, a {other_npc.personality}, about {topic}.\n"
+            "Say something brief (5-10 words) to start the conversation."
+        )
+
+        response = self.call_llm(prompt, kind='dialogue')
+        if response is None:
+            return None
         self.add_to_memory(f"Talked to {other_npc.name} about {topic}", memory_type='long')
-        self.log_interaction(f"Talking to {other_npc.name}", response)
+        self.log_interaction(f"Talking to {other_npc.name}", response, listener=other_npc)
         return response
 
     def react_to(self, other_npc, other_npc_statement):
-        prompt = f"""
-        You are {self.name}, a {self.personality}.
-        {other_npc.name} just said: "{other_npc_statement}"
-        Respond briefly (5-10 words).
-        {self.name}:
-        """
-        
-        response = self.call_llm(prompt)
+        prompt = self.prompt_builder.build(
+            self,
+            f'{other_npc.name} just said: "{other_npc_statement}"\n'
+            "Respond briefly (5-10 words)."
+        )
+
+        response = self.call_llm(prompt, kind='dialogue')
+        if response is None:
+            return None
         self.add_to_memory(f"Reacted to {other_npc.name}", memory_type='long')
-        self.log_interaction(f"Reacting to {other_npc.name}", response)
+        self.log_interaction(f"Reacting to {other_npc.name}", response, listener=other_npc)
         return response
 
     def perform_action(self):
-        prompt = f"""
-        You are {self.name}, a {self.personality}.
-        You are at the {self.current_location}.
-        Describe a brief action or thought in 5-10 words.
-        {self.name}:
-        """
-        action = self.call_llm(prompt)
-        self.add_to_memory(f"Action: {action}")
-        self.log_action(self.get_npc_id(), self.current_location, action)
+        prompt = self.prompt_builder.build(
+            self,
+            f"You are at the {self.current_location}.\n"
+            "Describe a brief action or thought in 5-10 words."
+        )
+        action = self.call_llm(prompt, kind='action')
+        if action is not None:
+            self.record_action(action)
         return action
 
+    def record_action(self, action):
+        self.add_to_memory(f"Action: {action}")
+        self.log_action(self.id, self.current_location, action)
+
     def log_action(self, npc_id, location, action):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
+        if self.write_buffer is not None:
+            self.write_buffer.add_action(npc_id, location, action)
+            return
+        with db.transaction(self.db_path) as conn:
+            conn.execute('''
                 INSERT INTO actions (npc_id, location, action)
                 VALUES (?, ?, ?)
             ''', (npc_id, location, action))
-            conn.commit()
@@ -0,0 +1,114 @@
+# population.py
+"""
+Bulk loading of NPC populations.
+
+A population file lists NPCs with name, personality, backstory and an
+optional current_location, as JSON, YAML or CSV. load_population() inserts
+them all in one executemany, then reads back ids, each NPC's window of
+recent long-term memories and memory summaries with one query each, so
+startup cost doesn't scale with database round trips.
+"""
+import csv
+import json
+import os
+
+import db
+import migrations
+from memory_consolidation import load_summaries
+from npc import NPC
+
+REQUIRED_FIELDS = ('name', 'personality', 'backstory')
+DEFAULT_LOCATION = "Town Square"
+# Each NPC's newest memories, the same window NPC.load_long_term_memory reads.
+RECENT_MEMORIES = '''
+    SELECT npc_name, memory FROM (
+        SELECT npc_name, memory, id, ROW_NUMBER() OVER (PARTITION BY npc_name ORDER BY id DESC) AS recency
+        FROM long_term_memory
+    ) WHERE recency <= ? ORDER BY id
+'''
+
+
+def read_population(path):
+    """Reads a population file into a list of NPC records (dicts)."""
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding='utf-8') as f:
+        if extension == '.json':
+            data = json.load(f)
+        elif extension in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError as e:
+                raise ImportError("Reading YAML populations requires PyYAML (pip install pyyaml)") from e
+            data = yaml.safe_load(f)
+        elif extension == '.csv':
+            data = list(csv.DictReader(f))
+        else:
+            raise ValueError(f"Unsupported population file type: {extension}")
+
+    if isinstance(data, dict):
+        data = data.get('npcs', [])
+    return validate_records(data, source=path)
+
+
+def validate_records(records, source='population'):
+    seen = set()
+    valid = []
+    for index, record in enumerate(records):
+        missing = [field for field in REQUIRED_FIELDS if not record.get(field)]
+        if missing:
+            raise ValueError(f"{source}: NPC #{index} is missing {', '.join(missing)}")
+        if record['name'] in seen:
+            raise ValueError(f"{source}: duplicate NPC name {record['name']!r}")
+        seen.add(record['name'])
+        valid.append(record)
+    return valid
+
+
+def load_population(source, db_path=None, village=None):
+    """
+    Inserts the NPCs from source (a file path or a list of records) and
+    returns NPC objects for them, in file order. NPCs that already exist keep
+    their id and long-term memories. If a village is given, each NPC is added.
+    """
+    records = read_population(source) if isinstance(source, str) else validate_records(source)
+    db_path = db_path or NPC.db_path
+    migrations.migrate(db_path)
+
+    with db.transaction(db_path) as conn:
+        conn.executemany('''
+            INSERT OR IGNORE INTO npcs (name, personality, backstory, current_location)
+            VALUES (?, ?, ?, ?)
+        ''', [
+            (r['name'], r['personality'], r['backstory'], r.get('current_location') or DEFAULT_LOCATION)
+            for r in records
+        ])
+
+    wanted = {r['name'] for r in records}
+    stored = {
+        name: (npc_id, location)
+        for npc_id, name, location in db.query_all('SELECT id, name, current_location FROM npcs', db_path=db_path)
+        if name in wanted
+    }
+    memories = {name: [] for name in wanted}
+    for npc_name, memory in db.query_all(RECENT_MEMORIES, (NPC.long_term_memory_window,), db_path):
+        if npc_name in memories:
+            memories[npc_name].append(memory)
+
+    summaries = load_summaries(db_path)
+
+    npcs = []
+    for record in records:
+        npc_id, stored_location = stored[record['name']]
+        npc = NPC.from_record(
+            npc_id,
+            record['name'],
+            record['personality'],
+            record['backstory'],
+            current_location=record.get('current_location') or stored_location,
+            long_term_memory=memories[record['name']],
+            rolling_summary=summaries.get(record['name'], ""),
+        )
+        if village is not None:
+            village.add_npc(npc)
+        npcs.append(npc)
+    return npcs
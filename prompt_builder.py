@@ -0,0 +1,133 @@
+# prompt_builder.py
+"""
+Token-budgeted prompt assembly.
+
+Every prompt starts with the NPC's persona block, built once per NPC and
+reused byte for byte, so Ollama can keep that prefix in its context cache
+between calls. Everything that changes from call to call (memories, recent
+events, the instruction) comes after it, each section capped by its own token
+budget and stripped of wasted whitespace.
+"""
+import re
+import threading
+
+import metrics
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+DEFAULT_BUDGETS = {
+    'persona': 120,
+    'summary': 120,
+    'memories': 160,
+    'recent': 160,
+    'instruction': 160,
+}
+
+
+def count_tokens(text):
+    """
+    Approximate token count: words and punctuation marks. Close enough to
+    a BPE tokenizer for short English text to budget and compare prompts.
+    """
+    return len(TOKEN_PATTERN.findall(text))
+
+
+def clean(text):
+    """Strips indentation and trailing spaces, collapses runs of spaces and blank lines."""
+    lines = [" ".join(line.split()) for line in text.strip().splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+
+
+def truncate(text, budget):
+    """Cuts text after budget tokens, on a token boundary."""
+    if budget <= 0:
+        return ""
+    for index, match in enumerate(TOKEN_PATTERN.finditer(text)):
+        if index == budget:
+            return text[:match.start()].rstrip() + "..."
+    return text
+
+
+def fit_items(items, budget, newest_first=False):
+    """
+    Keeps as many whole items as fit in budget. Items are assumed ranked
+    best-first, or oldest-first when newest_first is set (then the newest
+    ones are kept, still in chronological order).
+    """
+    ordered = list(reversed(items)) if newest_first else list(items)
+    kept, used = [], 0
+    for item in ordered:
+        cost = count_tokens(item) + 1  # the list bullet
+        if used + cost > budget:
+            break
+        kept.append(item)
+        used += cost
+    return list(reversed(kept)) if newest_first else kept
+
+
+class PromptBuilder:
+    def __init__(self, budgets=None):
+        self.budgets = dict(DEFAULT_BUDGETS, **(budgets or {}))
+        self._prefixes = {}  # (name, personality, backstory) -> persona block
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.total_tokens = 0
+        self.max_tokens = 0
+        self.prefix_tokens = 0
+
+    def persona_prefix(self, npc):
+        """The NPC's fixed opening lines, cached so every call sends identical bytes."""
+        key = (npc.name, npc.personality, npc.backstory)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            persona = clean(f"You are {npc.name}, a {npc.personality}.\nBackstory: {npc.backstory}")
+            prefix = truncate(persona, self.budgets['persona']) + "\n\n"
+            with self._lock:
+                prefix = self._prefixes.setdefault(key, prefix)
+        return prefix
+
+    def build(self, npc, instruction, summary=None, memories=None, recent=None, mood=None):
+        """
+        Assembles a prompt: persona prefix, then the optional sections, then the
+        instruction and the NPC's name as the reply cue.
+        """
+        with metrics.span('prompt_build_seconds'):
+            return self._build(npc, instruction, summary, memories, recent, mood)
+
+    def _build(self, npc, instruction, summary, memories, recent, mood):
+        prefix = self.persona_prefix(npc)
+        sections = []
+        if mood:
+            sections.append(f"Current mood: {mood}")
+        if summary:
+            sections.append("Earlier events: " + truncate(clean(summary), self.budgets['summary']))
+        if memories:
+            kept = fit_items([clean(m) for m in memories], self.budgets['memories'])
+            if kept:
+                sections.append("Relevant memories:\n" + "\n".join(f"- {m}" for m in kept))
+        if recent:
+            kept = fit_items([clean(m) for m in recent], self.budgets['recent'], newest_first=True)
+            if kept:
+                sections.append("Recent events:\n" + "\n".join(f"- {m}" for m in kept))
+        sections.append(truncate(clean(instruction), self.budgets['instruction']))
+        prompt = prefix + "\n\n".join(sections) + f"\n{npc.name}:"
+        self._record(prompt, prefix)
+        return prompt
+
+    def _record(self, prompt, prefix):
+        tokens = count_tokens(prompt)
+        with self._lock:
+            self.calls += 1
+            self.total_tokens += tokens
+            self.max_tokens = max(self.max_tokens, tokens)
+            self.prefix_tokens += count_tokens(prefix)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'prompts': self.calls,
+                'total_tokens': self.total_tokens,
+                'mean_tokens': self.total_tokens / self.calls if self.calls else 0.0,
+                'max_tokens': self.max_tokens,
+                'prefix_share': self.prefix_tokens / self.total_tokens if self.total_tokens else 0.0,
+            }
@@ -0,0 +1,367 @@
+# sharding.py
+"""
+Runs a tick-based simulation across several worker processes.
+
+Each NPC is owned by exactly one shard, picked by a hash of its name. The
+owning process holds the live NPC (memories, summary, recall index) and
+makes its LLM calls, so prompt building, parsing and memory upkeep run on
+as many cores as there are shards instead of behind one interpreter lock.
+
+The coordinator in the parent process keeps only lightweight handles (id,
+name, location). Every tick it plans encounters with the usual planner,
+gathers each conversation's participants onto one shard (an NPC's state is
+pickled across when it moves), sends each shard its share of the work and
+collects the results in shard order. Workers only read the database: their
+writes, including recall-index embedding backfills, are collected and
+replayed into the coordinator's WriteBuffer, which commits the tick as one
+transaction.
+Movement also happens in the coordinator, so with a seed and a fixed shard
+count the event stream is the same on every run.
+"""
+import asyncio
+import multiprocessing
+import random
+import sys
+import threading
+import traceback
+import zlib
+
+from encounters import Encounter, EncounterPlanner
+from npc import TOPICS
+
+
+def shard_for(name, shards):
+    """Stable owner of an NPC: the same on every run and in every process."""
+    return zlib.crc32(name.encode('utf-8')) % shards
+
+
+def _shard_seed(seed, index):
+    return None if seed is None else seed * 1000 + index
+
+
+class CollectingBuffer:
+    """
+    Stands in for WriteBuffer inside a worker. Records each write call in
+    order so the coordinator can replay it; flush() does nothing.
+    """
+
+    METHODS = ('add_action', 'add_interaction', 'add_memory', 'set_location', 'set_locations', 'add_summary',
+               'add_embeddings')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = []
+
+    def __getattr__(self, name):
+        if name not in self.METHODS:
+            raise AttributeError(name)
+
+        def record(*args):
+            with self._lock:
+                self._calls.append((name, args))
+        return record
+
+    def __len__(self):
+        return len(self._calls)
+
+    def flush(self):
+        return 0
+
+    def drain(self):
+        with self._lock:
+            calls, self._calls = self._calls, []
+        return calls
+
+
+class FixedPlanner:
+    """Hands the engine the plan the coordinator already made."""
+
+    def __init__(self):
+        self.next_plan = ([], [])
+
+    def plan(self, village):
+        plan, self.next_plan = self.next_plan, ([], [])
+        return plan
+
+
+class ShardHandle:
+    """What the coordinator knows about an NPC that lives in a worker."""
+
+    def __init__(self, npc_id, name, current_location, shard):
+        self.id = npc_id
+        self.name = name
+        self.current_location = current_location
+        self.shard = shard
+
+    def __repr__(self):
+        return f"ShardHandle({self.name!r}, shard={self.shard})"
+
+
+def export_state(npc):
+    return {
+        'id': npc.id,
+        'name': npc.name,
+        'personality': npc.personality,
+        'backstory': npc.backstory,
+        'current_location': npc.current_location,
+        'long_term_memory': npc.long_term_memory,
+        'rolling_summary': npc.rolling_summary,
+        'short_term_memory': npc.short_term_memory,
+    }
+
+
+class Shard:
+    """The worker side: owns some NPCs and runs their part of each tick."""
+
+    def __init__(self, config):
+        from engine import TickEngine
+        from llm_backends import client_for
+        from llm_cache import ResponseCache
+        from npc import NPC
+        from village import Village
+
+        self.NPC = NPC
+        self.collector = CollectingBuffer()
+        seed = config['seed']
+        NPC.db_path = config['db_path']
+        NPC.write_buffer = self.collector
+        NPC.llm_client = self.client = client_for(config['llm_hosts'], config['stub_latency'])
+        NPC.response_cache = ResponseCache(variants=1 if seed is not None else 3, rng=random.Random(seed))
+        NPC.consolidator = None
+        self.npcs = {}
+        village = Village(config['db_path'], write_buffer=self.collector)
+        self.engine = TickEngine(village, [], concurrency=config['concurrency'], move_probability=0.0,
+                                 rng=random.Random(seed), write_buffer=self.collector, planner=FixedPlanner(),
+                                 group_dialogue=config['group_dialogue'],
+                                 action_batch_size=config['action_batch_size'])
+        self.loop = asyncio.new_event_loop()
+
+    def add(self, states):
+        for state in states:
+            npc = self.NPC.from_record(
+                state['id'], state['name'], state['personality'], state['backstory'],
+                current_location=state['current_location'], long_term_memory=state['long_term_memory'],
+                rolling_summary=state['rolling_summary'],
+            )
+            npc.short_term_memory = list(state.get('short_term_memory', []))
+            self.npcs[npc.name] = npc
+        return len(self.npcs)
+
+    def remove(self, names):
+        return [export_state(self.npcs.pop(name)) for name in names]
+
+    def tick(self, locations, encounters, idle):
+        for name, location in locations:
+            self.npcs[name].current_location = location
+        self.engine.planner.next_plan = (
+            [Encounter(location, [self.npcs[name] for name in names], topic)
+             for location, names, topic in encounters],
+            [self.npcs[name] for name in idle],
+        )
+        events = self.loop.run_until_complete(self.engine.run_tick())
+        summary = []
+        for event in events:
+            if event['type'] == 'interaction':
+                summary.append(('interaction', event['speaker'].name, event['listener'].name, event['text']))
+            elif event['type'] == 'action':
+                summary.append(('action', event['npc'].name, event['text']))
+        stats = {'llm_calls': self.client.calls, 'cache_hits': self.NPC.response_cache.hits}
+        return summary, self.collector.drain(), stats
+
+    def close(self):
+        self.engine.close()
+        self.loop.close()
+        return self.collector.drain()
+
+
+def _worker_main(conn, config):
+    # Workers never produce events, and the parent's stdout may be an event stream.
+    sys.stdout = sys.stderr
+    shard = Shard(config)
+    while True:
+        command, args = conn.recv()
+        try:
+            result = getattr(shard, command)(*args)
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+            continue
+        conn.send(('ok', result))
+        if command == 'close':
+            break
+    conn.close()
+
+
+class ShardError(RuntimeError):
+    pass
+
+
+class ShardedSimulation:
+    """
+    Coordinator for a tick-based run over shards worker processes.
+
+    npcs are loaded NPC objects (e.g. from load_population); their state is
+    shipped to the owning workers and the coordinator's village holds
+    ShardHandles in their place. run_tick() returns events in the same
+    format as TickEngine, with handles standing in for NPCs.
+    """
+
+    def __init__(self, village, npcs, shards=2, write_buffer=None, planner=None, rng=None,
+                 move_probability=0.3, time_step=60, concurrency=8, seed=None, llm_hosts=(),
+                 stub_latency=0.0, group_dialogue=False, action_batch_size=None):
+        self.village = village
+        self.shards = shards
+        self.write_buffer = write_buffer
+        self.rng = rng or random.Random()
+        self.planner = planner or EncounterPlanner(topics=TOPICS, rng=self.rng)
+        self.move_probability = move_probability
+        self.time_step = time_step
+        self.tick = 0
+        self.migrations = 0
+        self._stats = [{'llm_calls': 0, 'cache_hits': 0} for _ in range(shards)]
+        self._moved = {}  # name -> handle whose new location its shard hasn't heard about yet
+
+        self.handles = []
+        for npc in npcs:
+            village.remove_npc(npc)
+            handle = ShardHandle(npc.id, npc.name, npc.current_location, shard_for(npc.name, shards))
+            village.add_npc(handle)
+            self.handles.append(handle)
+        self.by_name = {handle.name: handle for handle in self.handles}
+
+        context = multiprocessing.get_context('spawn')
+        config = {
+            'db_path': village.db_path, 'seed': seed, 'llm_hosts': list(llm_hosts), 'stub_latency': stub_latency,
+            'concurrency': concurrency, 'group_dialogue': group_dialogue, 'action_batch_size': action_batch_size,
+        }
+        self._conns, self._processes = [], []
+        for index in range(shards):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker_main, args=(child, {**config, 'seed': _shard_seed(seed, index)}),
+                                      name=f'shard-{index}', daemon=True)
+            process.start()
+            child.close()
+            self._conns.append(parent)
+            self._processes.append(process)
+
+        states = [[] for _ in range(shards)]
+        for npc, handle in zip(npcs, self.handles):
+            states[handle.shard].append(export_state(npc))
+        self._broadcast('add', [(shard_states,) for shard_states in states])
+
+    def _broadcast(self, command, args_per_shard):
+        """Sends every shard its command at once, then collects the replies in shard order."""
+        for conn, args in zip(self._conns, args_per_shard):
+            conn.send((command, args))
+        results = []
+        for index, conn in enumerate(self._conns):
+            status, result = conn.recv()
+            if status == 'error':
+                raise ShardError(f"shard {index} failed on {command}:\n{result}")
+            results.append(result)
+        return results
+
+    def _migrate(self, encounters):
+        """
+        Gathers each conversation's participants onto one shard: whichever
+        of their shards currently owns the fewest NPCs, which keeps the
+        shards close to even as NPCs move around.
+        """
+        sizes = self.shard_sizes()
+        leaving = [[] for _ in range(self.shards)]
+        arriving = [[] for _ in range(self.shards)]
+        for encounter in encounters:
+            target = min({handle.shard for handle in encounter.participants}, key=lambda shard: (sizes[shard], shard))
+            for handle in encounter.participants:
+                if handle.shard != target:
+                    leaving[handle.shard].append(handle.name)
+                    arriving[target].append(handle)
+                    sizes[handle.shard] -= 1
+                    sizes[target] += 1
+                    handle.shard = target
+        if not any(leaving):
+            return
+        exported = {}
+        for states in self._broadcast('remove', [(names,) for names in leaving]):
+            for state in states:
+                state['current_location'] = self.by_name[state['name']].current_location
+                exported[state['name']] = state
+        self._broadcast('add', [([exported[handle.name] for handle in handles],) for handles in arriving])
+        self.migrations += sum(len(names) for names in leaving)
+
+    def _move(self):
+        events = []
+        for handle in self.handles:
+            if self.rng.random() < self.move_probability:
+                old_location = handle.current_location
+                new_location = self.village.move_npc(handle)
+                self._moved[handle.name] = handle
+                events.append({'type': 'move', 'npc': handle, 'from': old_location, 'to': new_location})
+        return events
+
+    def run_tick(self):
+        self.tick += 1
+        encounters, idle = self.planner.plan(self.village)
+        self._migrate(encounters)
+
+        work = [([], [], []) for _ in range(self.shards)]
+        for handle in self._moved.values():
+            work[handle.shard][0].append((handle.name, handle.current_location))
+        self._moved = {}
+        for encounter in encounters:
+            names = [handle.name for handle in encounter.participants]
+            work[encounter.participants[0].shard][1].append((encounter.location, names, encounter.topic))
+        for handle in idle:
+            work[handle.shard][2].append(handle.name)
+
+        events = []
+        for index, (summary, calls, stats) in enumerate(self._broadcast('tick', work)):
+            self._stats[index] = stats
+            self._replay(calls)
+            for item in summary:
+                if item[0] == 'interaction':
+                    events.append({'type': 'interaction', 'speaker': self.by_name[item[1]],
+                                   'listener': self.by_name[item[2]], 'text': item[3]})
+                else:
+                    events.append({'type': 'action', 'npc': self.by_name[item[1]], 'text': item[2]})
+        events += self._move()
+        if self.write_buffer is not None:
+            self.write_buffer.flush()
+        return events
+
+    def _replay(self, calls):
+        if self.write_buffer is None:
+            return
+        for method, args in calls:
+            getattr(self.write_buffer, method)(*args)
+
+    def run(self, ticks, on_tick=None):
+        for tick in range(ticks):
+            events = self.run_tick()
+            if on_tick is not None:
+                on_tick(tick, events)
+            self.village.advance_time(self.time_step)
+
+    @property
+    def llm_calls(self):
+        return sum(stats['llm_calls'] for stats in self._stats)
+
+    @property
+    def cache_hits(self):
+        return sum(stats['cache_hits'] for stats in self._stats)
+
+    def shard_sizes(self):
+        sizes = [0] * self.shards
+        for handle in self.handles:
+            sizes[handle.shard] += 1
+        return sizes
+
+    def close(self):
+        """Collects any last writes from the workers and stops them."""
+        try:
+            for calls in self._broadcast('close', [()] * self.shards):
+                self._replay(calls)
+        finally:
+            for process in self._processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
@@ -1,9 +1,22 @@
 # simulation.py
-import time
+import asyncio
+import os
 from datetime import timedelta
 import random
 from village import Village
-from npc import NPC
+from npc import NPC, TOPICS
+from encounters import EncounterPlanner
+from engine import TickEngine
+from write_buffer import WriteBuffer
+from population import load_population
+from world_state import WorldState
+from llm_scheduler import DEFAULT_DEADLINES, LLMScheduler
+from llm_backends import BackendRegistry
+from event_scheduler import EventScheduler
+import db
+import metrics
+
+DEFAULT_POPULATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'population.json')
 
 def print_separator():
     print("\n" + "="*50 + "\n")
@@ -34,56 +47,87 @@ def print_movement(npc, old_location, new_location):
     print(f"🚶 {npc.name} moved from {old_location} to {new_location}")
     print()
 
-def main():
+def main(population_path=DEFAULT_POPULATION, concurrency=8, durability='normal', vectorized=False,
+         pairing='pairs', group_dialogue=False, action_batch_size=None, llm_workers=None,
+         llm_deadlines=None, llm_hosts=None, model_routes=None, event_driven=False, hours=24, ticks=25, delay=0.5,
+         seed=None, collect_metrics=False):
+    if collect_metrics:
+        metrics.enable()
     NPC.initialize_database()  # Add this line
-    village = Village()
-    
-    npc1 = NPC(
-        name="Evelyn",
-        personality="friendly baker",
-        backstory="Runs the local bakery, loves chatting."
-    )
+    write_buffer = WriteBuffer(NPC.db_path, durability=durability)
+    write_buffer.install_shutdown_hooks()
+    NPC.write_buffer = write_buffer
+    if llm_hosts:
+        registry = BackendRegistry.from_urls(llm_hosts, default_model=NPC.llm_client.model, routes=model_routes)
+        registry.start_health_checks()
+        NPC.llm_client = registry
+    scheduler = None
+    if llm_workers:
+        # Engine threads queue up requests; the scheduler decides what the model sees first.
+        deadlines = DEFAULT_DEADLINES if llm_deadlines is None else llm_deadlines
+        scheduler = LLMScheduler(NPC.llm_client, workers=llm_workers, default_deadlines=deadlines)
+        NPC.llm_client = scheduler
+    rng = random.Random(seed)
+    village = Village(write_buffer=write_buffer, rng=random.Random(rng.random()))
     
-    npc2 = NPC(
-        name="George",
-        personality="grumpy farmer",
-        backstory="50-year farming veteran, outspoken."
-    )
-    
-    village.add_npc(npc1)
-    village.add_npc(npc2)
+    npcs = load_population(population_path, village=village)
 
     print("🏘️ Village Simulation Starting")
     print(f"🕒 Time: {village.get_current_time_str()}")
-    print(f"👩‍🍳 {npc1.name} at {npc1.current_location}")
-    print(f"👨‍🌾 {npc2.name} at {npc2.current_location}")
+    for npc in npcs:
+        print(f"👤 {npc.name} at {npc.current_location}")
+
+    def publish_metrics():
+        if metrics.enabled():
+            db.save_metrics_snapshot('simulation', metrics.snapshot(), NPC.db_path)
 
-    for _ in range(25):  # Simulate 10 time steps
+    def print_tick(tick, events):
+        publish_metrics()
         print_separator()
         print_time_header(village)
-        
-        if npc1.current_location == npc2.current_location:
-            speaker, listener = random.sample([npc1, npc2], 2)
-            
-            initial_statement = speaker.interact_with(listener)
-            print_interaction(speaker, listener, initial_statement)
-            
-            reaction = listener.react_to(speaker, initial_statement)
-            print_interaction(listener, speaker, reaction)
-        else:
-            for npc in [npc1, npc2]:
-                action = npc.perform_action()
-                print_npc_action(npc, action)
-        
-        # Move NPCs (30% chance)
-        for npc in [npc1, npc2]:
-            if random.random() < 0.3:
-                old_location = npc.current_location
-                new_location = village.move_npc(npc)
-                print_movement(npc, old_location, new_location)
-        
-        village.advance_time(60)  # Advance time by 60 seconds
-        time.sleep(0.5)  # Pause for 1 second between time steps
+        for event in events:
+            if event['type'] == 'interaction':
+                print_interaction(event['speaker'], event['listener'], event['text'])
+            elif event['type'] == 'action':
+                print_npc_action(event['npc'], event['text'])
+            elif event['type'] == 'move':
+                print_movement(event['npc'], event['from'], event['to'])
+
+    if event_driven:
+        # Jump from event to event following each NPC's daily routine.
+        def print_event(event, outputs):
+            if outputs:
+                print_tick(None, outputs)
+
+        events = EventScheduler(village, npcs, write_buffer=write_buffer, rng=random.Random(rng.random()))
+        events.start()
+        try:
+            events.run_for(hours * 3600, on_event=print_event)
+        finally:
+            if NPC.consolidator is not None:
+                NPC.consolidator.close()
+            if scheduler is not None:
+                scheduler.close()
+            write_buffer.close()
+        print_separator()
+        print(f"🏁 Simulation ended after {sum(events.processed.values())} events and {events.llm_calls} LLM calls.")
+        return
+
+    world_state = WorldState.from_npcs(npcs, village.locations, seed=rng.randrange(2 ** 32)) if vectorized else None
+    engine_rng = random.Random(rng.random())
+    planner = EncounterPlanner(policy=pairing, topics=TOPICS, rng=engine_rng)
+    engine = TickEngine(village, npcs, concurrency=concurrency, rng=engine_rng, write_buffer=write_buffer,
+                        world_state=world_state, planner=planner, group_dialogue=group_dialogue,
+                        action_batch_size=action_batch_size, scheduler=scheduler)
+    try:
+        asyncio.run(engine.run(ticks, on_tick=print_tick, delay=delay))
+    finally:
+        engine.close()
+        if NPC.consolidator is not None:
+            NPC.consolidator.close()
+        if scheduler is not None:
+            scheduler.close()
+        write_buffer.close()
 
     print_separator()
     print("🏁 Simulation ended.")
@@ -0,0 +1,159 @@
+# stub_ollama.py
+"""
+A tiny stand-in for the Ollama HTTP API, for running the simulation and
+exercising LLMClient without a real model.
+
+    python stub_ollama.py --port 11434 --latency 0.2 --jitter 0.05
+
+latency and jitter (seconds) delay each generate/embed reply by
+latency +/- jitter, to approximate a real model in benchmarks.
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_PHRASES = [
+    "Lovely day for it, isn't it?",
+    "I was just thinking about the harvest.",
+    "Have you tried the new bread?",
+    "The river is running high today.",
+    "Mind the geese by the square.",
+    "I could use a cup of tea.",
+]
+
+
+CAST_LINE = re.compile(r"^- ([^:\n]+):", re.MULTILINE)
+TURNS = re.compile(r"about (\d+) lines")
+
+
+def _phrase(prompt, salt=0):
+    digest = hashlib.sha256(f"{salt}\0{prompt}".encode('utf-8')).digest()
+    return STUB_PHRASES[digest[0] % len(STUB_PHRASES)]
+
+
+def stub_response(prompt, format=None):
+    """
+    Picks a canned reply deterministically from the prompt text. JSON-mode
+    requests get JSON: a transcript for group dialogue prompts, an actions
+    object for batched action prompts (see group_dialogue.py and
+    batch_actions.py), cast taken from the prompt's "- Name:" lines.
+    """
+    if format != 'json':
+        digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+        return STUB_PHRASES[digest[0] % len(STUB_PHRASES)]
+    names = CAST_LINE.findall(prompt)
+    if '"lines"' in prompt and len(names) >= 2:
+        match = TURNS.search(prompt)
+        turns = int(match.group(1)) if match else len(names)
+        lines = [
+            {'speaker': names[i % len(names)], 'to': names[(i + 1) % len(names)], 'text': _phrase(prompt, i)}
+            for i in range(turns)
+        ]
+        return json.dumps({'lines': lines})
+    if '"actions"' in prompt and names:
+        return json.dumps({'actions': {name: _phrase(prompt, name) for name in names}})
+    return json.dumps({'text': _phrase(prompt)})
+
+
+def stub_embedding(text, dim=16):
+    """A deterministic pseudo-embedding derived from the text's hash."""
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return [(digest[i % len(digest)] - 128) / 128 for i in range(dim)]
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real server
+    disable_nagle_algorithm = True
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json(200, {'models': [{'name': 'phi3'}]})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def _delay(self):
+        server = self.server
+        if server.latency or server.jitter:
+            with server.rng_lock:
+                offset = server.rng.uniform(-server.jitter, server.jitter)
+            time.sleep(max(0.0, server.latency + offset))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': 'invalid json'})
+            return
+        if self.path in ('/api/embed', '/api/generate'):
+            self._delay()
+        if self.path == '/api/embed':
+            texts = request.get('input', [])
+            texts = [texts] if isinstance(texts, str) else texts
+            self._send_json(200, {'model': request.get('model'), 'embeddings': [stub_embedding(t) for t in texts]})
+            return
+        if self.path != '/api/generate':
+            self._send_json(404, {'error': 'not found'})
+            return
+        self.server.request_count += 1
+        prompt = request.get('prompt', '')
+        self._send_json(200, {
+            'model': request.get('model', 'phi3'),
+            'response': stub_response(prompt, request.get('format')),
+            'done': True,
+            'prompt_eval_count': len(prompt.split()),
+            'eval_count': 8,
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host='127.0.0.1', port=0, latency=0.0, jitter=0.0, seed=None):
+    server = ThreadingHTTPServer((host, port), StubOllamaHandler)
+    server.daemon_threads = True
+    server.request_count = 0
+    server.latency = latency
+    server.jitter = jitter
+    server.rng = random.Random(seed)
+    server.rng_lock = threading.Lock()
+    return server
+
+
+def serve(host='127.0.0.1', port=0, latency=0.0, jitter=0.0, seed=None):
+    """Starts the stub server on a background thread and returns it."""
+    server = make_server(host, port, latency, jitter, seed)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def base_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a stub Ollama server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every reply")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random +/- seconds on top of latency")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.latency, args.jitter, args.seed)
+    print(f"Stub Ollama listening on {base_url(server)}")
+    server.serve_forever()
@@ -1,37 +1,55 @@
 # village.py
-import sqlite3
 import random
 from datetime import datetime, timedelta  # Add this import at the top of the file
+import db
 
 class Village:
-    def __init__(self, db_path='village.db'):
+    def __init__(self, db_path=db.DEFAULT_DB_PATH, write_buffer=None, rng=None):
         self.db_path = db_path
+        self.write_buffer = write_buffer
+        self.rng = rng or random.Random()
         self.locations = ["Marketplace", "Town Square", "Bakery", "Farmhouse", "River Bank"]
         self.current_time = datetime.now()
+        # Location -> NPCs currently there. Dicts with None values are used as
+        # insertion-ordered sets so iteration order is reproducible.
+        self.npcs_by_location = {location: {} for location in self.locations}
 
     def add_npc(self, npc):
         # Assign a random starting location if not set
         if npc.current_location is None:
-            npc.current_location = random.choice(self.locations)
+            npc.current_location = self.rng.choice(self.locations)
             self.update_npc_location(npc)
+        self.npcs_by_location.setdefault(npc.current_location, {})[npc] = None
+
+    def remove_npc(self, npc):
+        self.npcs_by_location.get(npc.current_location, {}).pop(npc, None)
+
+    def npcs_at(self, location):
+        return list(self.npcs_by_location.get(location, ()))
 
     def move_npc(self, npc):
         old_location = npc.current_location
-        new_location = random.choice([loc for loc in self.locations if loc != old_location])
+        new_location = self.rng.choice([loc for loc in self.locations if loc != old_location])
+        self.relocate_npc(npc, new_location)
+        return new_location
+
+    def relocate_npc(self, npc, new_location):
+        """Moves npc to new_location, keeping the location index and the database in step."""
+        self.remove_npc(npc)
         npc.current_location = new_location
+        self.npcs_by_location.setdefault(new_location, {})[npc] = None
         self.update_npc_location(npc)
-        return new_location
 
     def update_npc_location(self, npc):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE npcs
-            SET current_location = ?
-            WHERE id = ?
-        ''', (npc.current_location, npc.get_npc_id()))
-        conn.commit()
-        conn.close()
+        if self.write_buffer is not None:
+            self.write_buffer.set_location(npc.id, npc.current_location)
+            return
+        with db.transaction(self.db_path) as conn:
+            conn.execute('''
+                UPDATE npcs
+                SET current_location = ?
+                WHERE id = ?
+            ''', (npc.current_location, npc.id))
 
     def get_current_time_str(self):
         return self.current_time.strftime("%Y-%m-%d %H:%M:%S")
@@ -0,0 +1,110 @@
+# world_state.py
+"""
+Array-backed world state for large populations.
+
+Locations are stored as small integer codes in a NumPy array, one slot per
+NPC, and bound NPC objects read and write their current_location through it.
+The movement step for the whole population is then a handful of vectorized
+operations, and only rows that actually changed are written back.
+"""
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+import db
+
+
+class WorldState:
+    def __init__(self, locations, size, seed=None):
+        if np is None:
+            raise ImportError("WorldState requires numpy (pip install numpy)")
+        self.locations = list(locations)
+        self.location_codes = {name: code for code, name in enumerate(self.locations)}
+        self.location = np.zeros(size, dtype=np.int16)
+        self.npc_ids = np.zeros(size, dtype=np.int64)
+        self.npcs = [None] * size
+        self.rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_npcs(cls, npcs, locations, seed=None):
+        """
+        Copies the NPCs' current state into arrays and turns each NPC into a
+        view over its slot. Locations not in the list are appended.
+        """
+        npcs = list(npcs)
+        locations = list(locations)
+        for npc in npcs:
+            if npc.current_location not in locations:
+                locations.append(npc.current_location)
+        world = cls(locations, len(npcs), seed=seed)
+        for index, npc in enumerate(npcs):
+            world.location[index] = world.location_codes[npc.current_location]
+            world.npc_ids[index] = npc.id if npc.id is not None else -1
+            world.npcs[index] = npc
+            npc._world = world
+            npc._world_index = index
+        return world
+
+    def __len__(self):
+        return len(self.npcs)
+
+    def location_name(self, index):
+        return self.locations[self.location[index]]
+
+    def set_location(self, index, name):
+        code = self.location_codes.get(name)
+        if code is None:
+            code = self.location_codes[name] = len(self.locations)
+            self.locations.append(name)
+        self.location[index] = code
+
+    def step_movement(self, move_probability=0.3):
+        """
+        Moves each NPC with probability move_probability to a different,
+        uniformly chosen location. Returns (indices, old codes, new codes) for
+        the NPCs that moved.
+        """
+        location_count = len(self.locations)
+        if location_count < 2 or not len(self.npcs):
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty.astype(np.int16), empty.astype(np.int16)
+        movers = self.rng.random(len(self.npcs)) < move_probability
+        indices = np.flatnonzero(movers)
+        old_codes = self.location[indices]
+        # A non-zero offset modulo the location count never lands on the old location.
+        offsets = self.rng.integers(1, location_count, size=len(indices), dtype=np.int16)
+        new_codes = ((old_codes + offsets) % location_count).astype(np.int16)
+        self.location[indices] = new_codes
+        return indices, old_codes, new_codes
+
+    def changed_rows(self, indices):
+        """(location name, npc id) pairs for the given slots, ready for executemany."""
+        names = self.locations
+        return [
+            (names[code], npc_id)
+            for code, npc_id in zip(self.location[indices].tolist(), self.npc_ids[indices].tolist())
+            if npc_id >= 0
+        ]
+
+    def write_locations(self, indices, write_buffer=None, db_path=db.DEFAULT_DB_PATH):
+        """Writes the locations of the given slots only, in one batch."""
+        rows = self.changed_rows(indices)
+        if not rows:
+            return 0
+        if write_buffer is not None:
+            write_buffer.set_locations((npc_id, name) for name, npc_id in rows)
+        else:
+            with db.transaction(db_path) as conn:
+                conn.executemany('UPDATE npcs SET current_location = ? WHERE id = ?', rows)
+        return len(rows)
+
+    def sync_village(self, village, indices, old_codes):
+        """Updates village.npcs_by_location for NPCs that moved in step_movement."""
+        index_by_location = village.npcs_by_location
+        names = self.locations
+        new_codes = self.location[indices].tolist()
+        for index, old_code, new_code in zip(indices.tolist(), old_codes.tolist(), new_codes):
+            npc = self.npcs[index]
+            index_by_location.get(names[old_code], {}).pop(npc, None)
+            index_by_location.setdefault(names[new_code], {})[npc] = None
@@ -0,0 +1,203 @@
+# write_buffer.py
+import atexit
+import signal
+import threading
+from datetime import datetime, timezone
+
+import change_feed
+import db
+import metrics
+
+# How hard SQLite works to make a flushed batch durable.
+#   'full'   - fsync on every commit, survives power loss
+#   'normal' - WAL default, survives process crashes
+#   'off'    - leave it to the OS, fastest, may lose the last batches on power loss
+DURABILITY_LEVELS = {'full': 'FULL', 'normal': 'NORMAL', 'off': 'OFF'}
+
+INSERT_ACTIONS = 'INSERT INTO actions (npc_id, location, action, timestamp) VALUES (?, ?, ?, ?)'
+INSERT_INTERACTIONS = '''
+    INSERT INTO interactions (speaker_id, listener_id, interaction_type, content, timestamp)
+    VALUES (?, ?, ?, ?, ?)
+'''
+INSERT_MEMORIES = 'INSERT INTO long_term_memory (npc_name, memory) VALUES (?, ?)'
+INSERT_EMBEDDINGS = '''
+    INSERT OR REPLACE INTO long_term_memory_embeddings (memory_id, npc_name, embedder, vector)
+    VALUES (?, ?, ?, ?)
+'''
+UPDATE_LOCATIONS = 'UPDATE npcs SET current_location = ? WHERE id = ?'
+UPSERT_SUMMARIES = '''
+    INSERT INTO memory_summaries (npc_name, summary, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT (npc_name) DO UPDATE SET summary = excluded.summary, updated_at = excluded.updated_at
+'''
+
+
+def current_timestamp():
+    """Same format and clock as SQLite's CURRENT_TIMESTAMP, taken when the row is queued."""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class WriteBuffer:
+    """
+    Collects per-row writes during a tick and commits them as one transaction.
+
+    flush() is called at the end of every tick and whenever max_rows rows are
+    pending. Location updates are keyed by NPC id, so only the last move of a
+    tick is written. If a flush fails the rows are kept for the next attempt.
+    With publish_events, each flush also appends its actions, interactions and
+    moves to the change feed and hands them to any listeners once committed.
+    """
+
+    def __init__(self, db_path=db.DEFAULT_DB_PATH, max_rows=1000, durability='normal', publish_events=True):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"durability must be one of {sorted(DURABILITY_LEVELS)}")
+        self.db_path = db_path
+        self.max_rows = max_rows
+        self.durability = durability
+        self.publish_events = publish_events
+        self._listeners = []
+        self._lock = threading.RLock()
+        self._actions = []
+        self._interactions = []
+        self._memories = []
+        self._locations = {}
+        self._summaries = {}
+        self._embeddings = []
+        self.rows_written = 0
+        self.flushes = 0
+
+    def __len__(self):
+        with self._lock:
+            return (len(self._actions) + len(self._interactions) + len(self._memories)
+                    + len(self._locations) + len(self._summaries) + len(self._embeddings))
+
+    def add_action(self, npc_id, location, action):
+        with self._lock:
+            self._actions.append((npc_id, location, action, current_timestamp()))
+        self._flush_if_full()
+
+    def add_interaction(self, speaker_id, listener_id, interaction_type, content):
+        with self._lock:
+            self._interactions.append((speaker_id, listener_id, interaction_type, content, current_timestamp()))
+        self._flush_if_full()
+
+    def add_memory(self, npc_name, memory, embedder_name=None, vector_blob=None):
+        with self._lock:
+            self._memories.append((npc_name, memory, embedder_name, vector_blob))
+        self._flush_if_full()
+
+    def set_location(self, npc_id, location):
+        with self._lock:
+            self._locations[npc_id] = location
+        self._flush_if_full()
+
+    def set_locations(self, locations):
+        """Queues many (npc_id, location) updates at once."""
+        with self._lock:
+            self._locations.update(locations)
+        self._flush_if_full()
+
+    def add_summary(self, npc_name, summary):
+        """Queues a rolling-summary upsert; only the latest one per NPC is written."""
+        with self._lock:
+            self._summaries[npc_name] = summary
+        self._flush_if_full()
+
+    def add_embeddings(self, rows):
+        """Queues vectors for memories that are already stored: (memory_id, npc_name, embedder, blob)."""
+        with self._lock:
+            self._embeddings.extend(rows)
+        self._flush_if_full()
+
+    def add_listener(self, callback):
+        """callback([(event_id, event)]) runs after each committed flush, e.g. Broadcaster.publish."""
+        self._listeners.append(callback)
+
+    def _flush_if_full(self):
+        if len(self) >= self.max_rows:
+            self.flush()
+
+    def flush(self):
+        """Writes everything pending in one transaction and returns the row count."""
+        with self._lock:
+            actions, self._actions = self._actions, []
+            interactions, self._interactions = self._interactions, []
+            memories, self._memories = self._memories, []
+            locations, self._locations = self._locations, {}
+            summaries, self._summaries = self._summaries, {}
+            embeddings, self._embeddings = self._embeddings, []
+            rows = (len(actions) + len(interactions) + len(memories) + len(locations) + len(summaries)
+                    + len(embeddings))
+            if not rows:
+                return 0
+            try:
+                conn = db.get_connection(self.db_path)
+                conn.execute(f'PRAGMA synchronous = {DURABILITY_LEVELS[self.durability]}')
+                with metrics.span('db_flush_seconds'), conn:
+                    if actions:
+                        conn.executemany(INSERT_ACTIONS, actions)
+                    if interactions:
+                        conn.executemany(INSERT_INTERACTIONS, interactions)
+                    if memories:
+                        self._write_memories(conn, memories)
+                    if locations:
+                        conn.executemany(UPDATE_LOCATIONS, [(loc, npc_id) for npc_id, loc in locations.items()])
+                    if summaries:
+                        conn.executemany(UPSERT_SUMMARIES, list(summaries.items()))
+                    if embeddings:
+                        conn.executemany(INSERT_EMBEDDINGS, embeddings)
+                    published = []
+                    if self.publish_events:
+                        published = change_feed.record(
+                            conn, change_feed.build_events(actions, interactions, locations)
+                        )
+            except Exception:
+                # Put the batch back in front of anything queued meanwhile.
+                self._actions[:0] = actions
+                self._interactions[:0] = interactions
+                self._memories[:0] = memories
+                self._locations = {**locations, **self._locations}
+                self._summaries = {**summaries, **self._summaries}
+                self._embeddings[:0] = embeddings
+                raise
+            self.rows_written += rows
+            self.flushes += 1
+            metrics.inc('db_rows_written_total', rows)
+            if published:
+                for listener in self._listeners:
+                    listener(published)
+            return rows
+
+    def _write_memories(self, conn, memories):
+        plain = [(npc_name, memory) for npc_name, memory, _, blob in memories if blob is None]
+        if plain:
+            conn.executemany(INSERT_MEMORIES, plain)
+        # Embeddings reference the new row id, so those memories go in one by one.
+        embeddings = []
+        for npc_name, memory, embedder_name, blob in memories:
+            if blob is not None:
+                cursor = conn.execute(INSERT_MEMORIES, (npc_name, memory))
+                embeddings.append((cursor.lastrowid, npc_name, embedder_name, blob))
+        if embeddings:
+            conn.executemany(INSERT_EMBEDDINGS, embeddings)
+
+    def close(self):
+        try:
+            self.flush()
+        except Exception as e:
+            print("Error flushing write buffer on shutdown:", e)
+
+    def install_shutdown_hooks(self):
+        """
+        Flushes pending rows at interpreter exit and on SIGTERM.
+        Must be called from the main thread.
+        """
+        atexit.register(self.close)
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def handle_sigterm(signum, frame):
+            self.close()
+            if callable(previous):
+                previous(signum, frame)
+            raise SystemExit(128 + signum)
+
+        signal.signal(signal.SIGTERM, handle_sigterm)